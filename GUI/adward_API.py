@@ -5,6 +5,13 @@ import json
 import signal
 import psutil
 import time
+import urllib.request
+import urllib.error
+import sys
+
+# Block and allow lists are parsed by the server's list_ingest module
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'main')))
+from list_ingest import list_files, unique_entries
 
 class AdwardAPI(QObject):
     summary_updated = Signal(dict)
@@ -19,6 +26,7 @@ class AdwardAPI(QObject):
         self.config_file = os.path.join(self.project_root, 'etc', 'adward.conf')
         self.blocklist_dir = os.path.join(self.project_root, 'etc', 'block_lists')
         self.allowlist_file = os.path.join(self.project_root, 'etc', 'allow_list.txt')
+        self.control_url, self.control_token_file = self._get_control_settings()
         
     def set_url(self, api_url: str = None) -> None:
         """Legacy method - not used in local implementation"""
@@ -32,11 +40,20 @@ class AdwardAPI(QObject):
     def fetch_summary(self) -> None:
         """Fetch summary data from logs"""
         try:
-            summary = {
-                "domains_blocked": self._count_blocklist_entries(),
-                "domains_allowed": self._count_allowlist_entries(),
-                "total_queries": 0 
-            }
+            stats = self._control_request('GET', '/stats')
+            if stats is not None:
+                block_list = stats['block_list']
+                summary = {
+                    "domains_blocked": block_list['blocked'] + block_list['blocked_zones'],
+                    "domains_allowed": block_list['allowed'] + block_list['allowed_zones'],
+                    "total_queries": stats['requests']['queries']
+                }
+            else:
+                summary = {
+                    "domains_blocked": self._count_blocklist_entries(),
+                    "domains_allowed": self._count_allowlist_entries(),
+                    "total_queries": 0
+                }
             self.summary_updated.emit(summary)
         except Exception as e:
             self.error_occurred.emit(f"Error fetching summary: {str(e)}")
@@ -84,21 +101,8 @@ class AdwardAPI(QObject):
     def get_blocklist(self):
         """Get list of blocked domains"""
         try:
-            blocked_domains = set()
-            for filename in os.listdir(self.blocklist_dir):
-                filepath = os.path.join(self.blocklist_dir, filename)
-                if os.path.isfile(filepath):
-                    with open(filepath, 'r') as file:
-                        for line in file:
-                            if line.startswith('0.0.0.0'):
-                                domain = line.split()[1].strip()
-                                blocked_domains.add(domain)
-            
-            allowed_domains = self._get_allowlist()
-            for domain in allowed_domains:
-                if domain in blocked_domains:
-                    blocked_domains.remove(domain)
-                    
+            blocked_domains = set(unique_entries(list_files(self.blocklist_dir)))
+            blocked_domains.difference_update(self._get_allowlist())
             return list(blocked_domains)
         except Exception as e:
             self.error_occurred.emit(f"Error fetching blocklist: {str(e)}")
@@ -111,10 +115,12 @@ class AdwardAPI(QObject):
     def add_to_blocklist(self, domain):
         """Add domain to temporary blocklist"""
         try:
+            if self._control_request('POST', '/blocklist', {'domain': domain}) is not None:
+                return True
             custom_blocklist = os.path.join(self.blocklist_dir, "custom_blocklist.txt")
             with open(custom_blocklist, 'a') as file:
                 file.write(f"0.0.0.0 {domain}\n")
-            self._restart_server_if_running()
+            self._reload_server_if_running()
             return True
         except Exception as e:
             self.error_occurred.emit(f"Error adding to blocklist: {str(e)}")
@@ -123,9 +129,11 @@ class AdwardAPI(QObject):
     def add_to_allowlist(self, domain):
         """Add domain to allowlist"""
         try:
+            if self._control_request('POST', '/allowlist', {'domain': domain}) is not None:
+                return True
             with open(self.allowlist_file, 'a') as file:
                 file.write(f"0.0.0.0 {domain}\n")
-            self._restart_server_if_running()
+            self._reload_server_if_running()
             return True
         except Exception as e:
             self.error_occurred.emit(f"Error adding to allowlist: {str(e)}")
@@ -134,6 +142,8 @@ class AdwardAPI(QObject):
     def remove_from_blocklist(self, domain):
         """Remove domain from custom blocklist"""
         try:
+            if self._control_request('DELETE', '/blocklist', {'domain': domain}) is not None:
+                return True
             custom_blocklist = os.path.join(self.blocklist_dir, "custom_blocklist.txt")
             if not os.path.exists(custom_blocklist):
                 return False
@@ -146,6 +156,8 @@ class AdwardAPI(QObject):
     def remove_from_allowlist(self, domain):
         """Remove domain from allowlist"""
         try:
+            if self._control_request('DELETE', '/allowlist', {'domain': domain}) is not None:
+                return True
             with open(self.allowlist_file, 'r') as file:
                 lines = file.readlines()
             
@@ -154,7 +166,7 @@ class AdwardAPI(QObject):
                     if not (line.startswith('0.0.0.0') and line.split()[1].strip() == domain):
                         file.write(line)
             
-            self._restart_server_if_running()
+            self._reload_server_if_running()
             return True
         except Exception as e:
             self.error_occurred.emit(f"Error removing from allowlist: {str(e)}")
@@ -225,14 +237,76 @@ class AdwardAPI(QObject):
         if stop_errors:
             raise Exception(f"Server stop errors: {'; '.join(stop_errors)}")
     
-    def _restart_server_if_running(self):
-        """Restart the server if it's currently running"""
-        was_running = self._is_server_running()
-        if was_running:
-            self._stop_server()
-            time.sleep(1)
-            self._start_server()
-            time.sleep(1)
+    def _get_control_settings(self):
+        """Read the address of the server's control API and its token file from adward.conf"""
+        values = {'controlHost': '127.0.0.1', 'controlPort': '0', 'controlTokenFile': '../etc/control.token'}
+        try:
+            with open(self.config_file, 'r') as file:
+                for line in file:
+                    name, _, value = line.strip().partition('=')
+                    if name in values:
+                        values[name] = value.strip()
+        except OSError:
+            pass
+        # Paths in adward.conf are relative to the server's directory
+        token_file = os.path.join(self.project_root, 'main', values['controlTokenFile'])
+        if not values['controlPort'].isdigit() or int(values['controlPort']) == 0:
+            return None, token_file
+        return f"http://{values['controlHost']}:{values['controlPort']}", token_file
+
+    def _read_control_token(self):
+        """Read the control API token the server wrote; None if there is none yet"""
+        try:
+            with open(self.control_token_file, 'r') as file:
+                return file.read().strip() or None
+        except OSError:
+            return None
+
+    def _control_request(self, method, path, payload=None):
+        """Call the running server's control API; returns None if it is not reachable"""
+        if self.control_url is None:
+            return None
+        token = self._read_control_token()
+        if token is None:
+            return None
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        request = urllib.request.Request(self.control_url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json', 'X-Adward-Token': token})
+        try:
+            with urllib.request.urlopen(request, timeout=2) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            # The server is up but refused the request, so don't fall back to editing the files
+            try:
+                message = json.loads(e.read()).get('error', str(e))
+            except ValueError:
+                message = str(e)
+            raise Exception(message)
+        except (urllib.error.URLError, OSError, ValueError):
+            return None
+
+    def _reload_server_if_running(self):
+        """Ask a running server to reload its block and allow lists"""
+        # The server also notices changed list files by itself within a few seconds,
+        # which is what happens on platforms without SIGHUP
+        if not hasattr(signal, 'SIGHUP'):
+            return
+        pids = set()
+        if self.server_process and self.server_process.poll() is None:
+            pids.add(self.server_process.pid)
+        for proc in psutil.process_iter(['pid', 'name', 'cmdline']):
+            try:
+                if proc.info['name'] == 'python' or proc.info['name'] == 'python3':
+                    cmdline = proc.info['cmdline']
+                    if cmdline and any('server.py' in cmd for cmd in cmdline):
+                        pids.add(proc.info['pid'])
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                pass
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGHUP)
+            except OSError as e:
+                self.error_occurred.emit(f"Could not ask the server to reload: {str(e)}")
     
     def _count_blocklist_entries(self):
         """Count number of domains in blocklists"""
@@ -247,11 +321,7 @@ class AdwardAPI(QObject):
         allowed_domains = []
         try:
             if os.path.exists(self.allowlist_file):
-                with open(self.allowlist_file, 'r') as file:
-                    for line in file:
-                        if line.startswith('0.0.0.0'):
-                            domain = line.split()[1].strip()
-                            allowed_domains.append(domain)
+                allowed_domains = list(unique_entries([self.allowlist_file]))
         except Exception as e:
             self.error_occurred.emit(f"Error reading allowlist: {str(e)}")
         return allowed_domains
\ No newline at end of file
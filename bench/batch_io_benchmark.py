@@ -0,0 +1,91 @@
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+import batch_io
+from batch_io import BatchSocket
+
+# Packets per second through a UDP socket on the loopback interface with one
+# system call per datagram (recvfrom/sendto, what DNSServer does by default)
+# against recvmmsg/sendmmsg batches (batchIO=True, see main/batch_io.py).
+#
+#     python bench/batch_io_benchmark.py --seconds 3 --batch-size 32
+
+PAYLOAD = bytes(40)  # about the size of a DNS query
+
+# Keep a receiver busy: send as fast as possible until the deadline
+def blast(address, seconds, batch_size):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = BatchSocket(sock, batch_size)
+    batch = [(PAYLOAD, address)] * batch_size
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        sender.send_batch(batch)
+
+def measure_receive(batched, seconds, batch_size):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    sock.bind(('127.0.0.1', 0))
+    sock.settimeout(0.5)
+    receiver = BatchSocket(sock, batch_size) if batched else None
+    blaster = multiprocessing.Process(target=blast, args=(sock.getsockname(), seconds + 0.5, batch_size))
+    blaster.start()
+    time.sleep(0.2)
+    received = calls = 0
+    started = time.monotonic()
+    while time.monotonic() - started < seconds:
+        if receiver is not None:
+            received += len(receiver.recv_batch())
+        else:
+            sock.recvfrom(512)
+            received += 1
+        calls += 1
+    elapsed = time.monotonic() - started
+    blaster.join()
+    sock.close()
+    return received / elapsed, received / calls
+
+def measure_send(batched, count, batch_size):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = sink.getsockname()
+    started = time.perf_counter()
+    if batched:
+        sender = BatchSocket(sock, batch_size)
+        batch = [(PAYLOAD, address)] * batch_size
+        for _ in range(count // batch_size):
+            sender.send_batch(batch)
+    else:
+        for _ in range(count):
+            sock.sendto(PAYLOAD, address)
+    elapsed = time.perf_counter() - started
+    sock.close()
+    sink.close()
+    return count / elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark batched UDP receive and send.")
+    parser.add_argument('--seconds', type=float, default=3, help="length of each receive measurement")
+    parser.add_argument('--count', type=int, default=500000, help="datagrams sent in each send measurement")
+    parser.add_argument('--batch-size', type=int, default=32, help="datagrams per recvmmsg/sendmmsg call")
+    args = parser.parse_args(argv)
+    if not batch_io.available():
+        print("recvmmsg/sendmmsg are not available on this platform.")
+        return 1
+
+    single, _ = measure_receive(False, args.seconds, args.batch_size)
+    batched, per_call = measure_receive(True, args.seconds, args.batch_size)
+    print(f"receive  recvfrom: {single:10.0f} pps   recvmmsg: {batched:10.0f} pps "
+          f"({per_call:.1f} datagrams per call, {batched / single:.1f}x)")
+    single = measure_send(False, args.count, args.batch_size)
+    batched = measure_send(True, args.count, args.batch_size)
+    print(f"send     sendto:   {single:10.0f} pps   sendmmsg: {batched:10.0f} pps ({batched / single:.1f}x)")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
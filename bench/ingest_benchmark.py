@@ -0,0 +1,81 @@
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+from list_ingest import iter_entries, unique, DEFAULT_CHUNK_SIZE
+
+# resource is not available on Windows; peak memory is only reported where it is
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Throughput of the block list ingest pipeline (list_ingest.py) on generated
+# lists. The lists mix hosts, plain domain and AdBlock-style lines with comments,
+# and overlap with each other so de-duplication has work to do.
+#
+#     python bench/ingest_benchmark.py --lines 5000000 --feeds 4 --chunk-size 1000000
+
+FORMATS = [
+    lambda name: f"0.0.0.0 {name}\n",
+    lambda name: f"127.0.0.1 {name} # tracker\n",
+    lambda name: f"{name}\n",
+    lambda name: f"||{name}^\n",
+    lambda name: f"{name.upper()}.\n",
+]
+
+def write_feeds(directory, lines, feeds, overlap, seed=1):
+    random.seed(seed)
+    distinct = max(1, int(lines * (1 - overlap)))
+    words = ['ads', 'track', 'metrics', 'cdn', 'pixel', 'beacon', 'stats', 'tag']
+    paths = []
+    per_feed = lines // feeds
+    for feed in range(feeds):
+        path = os.path.join(directory, f"feed{feed}.txt")
+        with open(path, 'w') as file:
+            file.write(f"# Generated feed {feed}\n! AdBlock comment\n")
+            for _ in range(per_feed):
+                number = random.randrange(distinct)
+                name = f"{words[number % len(words)]}{number}.example{number % 997}.com"
+                file.write(FORMATS[number % len(FORMATS)](name))
+        paths.append(path)
+    return paths
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark block list parsing and de-duplication.")
+    parser.add_argument('--lines', type=int, default=2000000, help="total lines over all feeds")
+    parser.add_argument('--feeds', type=int, default=4, help="number of list files")
+    parser.add_argument('--overlap', type=float, default=0.3, help="fraction of lines repeating another name")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help="entries de-duplicated in memory at once")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='adward-bench-') as directory:
+        started = time.perf_counter()
+        paths = write_feeds(directory, args.lines, args.feeds, args.overlap)
+        size = sum(os.path.getsize(path) for path in paths)
+        print(f"Generated {args.lines} lines in {args.feeds} feeds ({size / 1024 / 1024:.1f} MB) "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        parsed = sum(1 for _ in iter_entries(paths))
+        parse_time = time.perf_counter() - started
+        print(f"Parse:            {parsed} entries in {parse_time:.2f}s, {args.lines / parse_time / 1000:.0f}k lines/s")
+
+        started = time.perf_counter()
+        distinct = sum(1 for _ in unique(iter_entries(paths), args.chunk_size))
+        total_time = time.perf_counter() - started
+        print(f"Parse and dedupe: {distinct} distinct entries in {total_time:.2f}s, "
+              f"{args.lines / total_time / 1000:.0f}k lines/s (chunk size {args.chunk_size})")
+        if resource is None:
+            return
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak = peak / 1024 if sys.platform != 'darwin' else peak / 1024 / 1024
+        print(f"Peak memory:      {peak:.0f} MB")
+
+if __name__ == "__main__":
+    main()
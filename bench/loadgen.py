@@ -0,0 +1,396 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import selectors
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+import server
+from dns_cache import DNSCache
+from dns_wire import (question_end, rcode, HEADER_SIZE, TYPE_A, TYPE_AAAA, CLASS_IN,
+                      FLAG_QR, FLAG_AA, FLAG_RA, RCODE_SERVFAIL, COUNTS_NO_ANSWER, COUNTS_ONE_ANSWER)
+from list_ingest import iter_entries, list_files
+from query_logger import iter_log_rows
+
+# Load generator for the DNS server. Queries are sent over raw UDP at a target
+# rate (qps) and every answer is matched back to its query, so the report shows
+# the throughput, latency percentiles, lost queries and whether each name was
+# blocked or answered as the block lists say it should be. Blocked names are
+# recognised by the AA flag the server sets on the answers it makes up itself.
+#
+# By default the server runs in a child process with the configured block lists
+# and forwards to a fake upstream server on the loopback interface, which answers
+# every query with a fixed address (after --upstream-delay), so results do not
+# depend on the network. The query log is not written. With --target the queries
+# go to a server that is already running instead.
+#
+# The names come from block list files (--domains), a query log and its rotated
+# segments (--log, the Received rows) or by default from the configured block
+# lists mixed with made-up names that are not blocked (--blocked-share).
+#
+#     python bench/loadgen.py --qps 20000 --duration 10 --mode asyncio
+#     python bench/loadgen.py --log logs/dns_requests.csv --qps 5000 --cache
+#     python bench/loadgen.py --domains etc/block_lists --once --qps 5000
+
+FAKE_ADDRESSES = {TYPE_A: bytes((192, 0, 2, 1)), TYPE_AAAA: bytes.fromhex('20010db8000000000000000000000001')}
+QUERY_TYPES = {'A': TYPE_A, 'AAAA': TYPE_AAAA}
+
+# Stands in for the upstream DNS server: every A or AAAA query is answered with a
+# documentation address (192.0.2.1 or 2001:db8::1), other types with an empty answer
+def fake_upstream(sock, delay):
+    due = deque()
+    ready = threading.Condition()
+
+    def answer_later():
+        while True:
+            with ready:
+                ready.wait_for(lambda: due)
+                when, response, addr = due.popleft()
+            pause = when - time.monotonic()
+            if pause > 0:
+                time.sleep(pause)
+            sock.sendto(response, addr)
+
+    if delay > 0:
+        threading.Thread(target=answer_later, daemon=True).start()
+    while True:
+        data, addr = sock.recvfrom(4096)
+        try:
+            end = question_end(data)
+            qtype, qclass = struct.unpack_from('!HH', data, end - 4)
+        except (IndexError, struct.error):
+            continue
+        flags = bytes((data[2] & 0x01 | FLAG_QR, FLAG_RA))
+        address = FAKE_ADDRESSES.get(qtype) if qclass == CLASS_IN else None
+        if address is None:
+            response = data[:2] + flags + COUNTS_NO_ANSWER + data[HEADER_SIZE:end]
+        else:
+            response = (data[:2] + flags + COUNTS_ONE_ANSWER + data[HEADER_SIZE:end] + b'\xc0\x0c' +
+                        struct.pack('!HHIH', qtype, CLASS_IN, 300, len(address)) + address)
+        if delay > 0:
+            with ready:
+                due.append((time.monotonic() + delay, response, addr))
+                ready.notify()
+        else:
+            sock.sendto(response, addr)
+
+# Run the server under test; the sockets are bound by the parent so it knows the port
+def serve(mode, port, upstream, cache):
+    server.logging_enabled = False
+    dns_cache = DNSCache() if cache else None
+    if mode == 'asyncio':
+        dns_server = server.AsyncDNSServer(port=port, forwarder=upstream, cache=dns_cache)
+    else:
+        dns_server = server.DNSServer(port=port, forwarder=upstream, mode=mode, cache=dns_cache)
+    dns_server.start()
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def encode_query(name, qtype):
+    labels = name.encode('idna').split(b'.')
+    if any(not label or len(label) > 63 for label in labels):
+        raise ValueError(f"Cannot encode '{name}' as a query name")
+    question = b''.join(bytes((len(label),)) + label for label in labels) + b'\0'
+    return b'\0\0\x01\x00' + COUNTS_NO_ANSWER + question + struct.pack('!HH', qtype, CLASS_IN)
+
+# Names to query, with whether the server should block them
+def load_names(args):
+    if args.log:
+        names = [domain for _, action, domain in iter_log_rows(args.log) if action == 'Received']
+    elif args.domains:
+        paths = list_files(args.domains) if os.path.isdir(args.domains) else [args.domains]
+        names = [entry[2:] if entry.startswith('*.') else entry for entry in iter_entries(paths)]
+    else:
+        listed = [entry[2:] if entry.startswith('*.') else entry
+                  for entry in iter_entries(list_files(server.block_lists_directory))]
+        # As many names as the lists hold, blocked_share of them from the lists
+        random.seed(args.seed)
+        blocked = round(len(listed) * min(max(args.blocked_share, 0.0), 1.0))
+        names = random.sample(listed, blocked) + \
+            [f"host{i}.loadgen{i % 997}.test" for i in range(len(listed) - blocked)]
+        random.shuffle(names)
+    if not names:
+        raise SystemExit("No names to query")
+    return [(name, name in server.blocked_domains) for name in names]
+
+# Give each query its due time at qps queries per second (0 for as fast as possible)
+def paced(queries, qps):
+    interval = 1.0 / qps if qps else None
+    for number, query in enumerate(queries):
+        yield (number * interval if interval else None,) + query
+
+# Send a query and wait (up to timeout seconds) until the server answers it
+def wait_ready(address, timeout=30):
+    deadline = time.monotonic() + timeout
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(0.2)
+        while time.monotonic() < deadline:
+            sock.sendto(encode_query('loadgen-ready.test', TYPE_A), address)
+            try:
+                sock.recvfrom(4096)
+                return
+            except OSError:
+                continue
+    raise SystemExit(f"The DNS server on {address[0]}:{address[1]} did not answer")
+
+class LoadClient:
+    def __init__(self, address, sockets=4, timeout=2.0):
+        self.address = address
+        self.timeout = float(timeout)
+        self.sockets = []
+        self.selector = selectors.DefaultSelector()
+        for index in range(sockets):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+            sock.bind(('127.0.0.1' if address[0].startswith('127.') else '', 0))
+            self.sockets.append(sock)
+            self.selector.register(sock, selectors.EVENT_READ, index)
+        # (socket index, transaction ID) -> (sent, name, blocked); blocked is None when the
+        # name's expected answer is not known
+        self.pending = {}
+        self.latencies = []
+        self.sent = 0
+        self.late = 0
+        self.servfail = 0
+        self.blocked = 0
+        self.checked = 0
+        self.expected_blocked = 0
+        self.false_blocks = []
+        self.missed_blocks = []
+        self.running = False
+        self.last_answer = None
+        self.finished_sending = None
+        self.max_lag = 0.0
+
+    def _receive(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                try:
+                    data, _ = key.fileobj.recvfrom(65535)
+                except OSError:
+                    continue
+                received = time.perf_counter()
+                self._match(key.data, data, received)
+
+    def _match(self, index, data, received):
+        if len(data) < HEADER_SIZE or not data[2] & FLAG_QR:
+            return
+        query = self.pending.pop((index, int.from_bytes(data[:2], 'big')), None)
+        if query is None:
+            return
+        sent, name, blocked = query
+        latency = received - sent
+        if latency > self.timeout:
+            self.late += 1
+            return
+        self.latencies.append(latency)
+        self.last_answer = received
+        if rcode(data) == RCODE_SERVFAIL:
+            self.servfail += 1
+            return
+        was_blocked = bool(data[2] & FLAG_AA)
+        self.blocked += was_blocked
+        if blocked is None:
+            return
+        self.checked += 1
+        self.expected_blocked += blocked
+        if was_blocked and not blocked:
+            self.false_blocks.append(name)
+        elif blocked and not was_blocked:
+            self.missed_blocks.append(name)
+
+    # Send (due, wire, name, blocked) queries, each due seconds after the start (None sends
+    # it straight away), until count queries were sent or duration seconds passed, then
+    # wait for the last answers
+    def run(self, queries, count=None, duration=None):
+        self.running = True
+        receiver = threading.Thread(target=self._receive, name='loadgen-receiver', daemon=True)
+        receiver.start()
+        txids = [0] * len(self.sockets)
+        started = time.perf_counter()
+        deadline = started + duration if duration else None
+        try:
+            for number, (due, wire, name, blocked) in enumerate(queries):
+                if count is not None and number >= count:
+                    break
+                now = time.perf_counter()
+                if deadline is not None and now >= deadline:
+                    break
+                if due is not None:
+                    pause = started + due - now
+                    # Short sleeps overshoot, so fall behind a little and catch up in a burst
+                    if pause > 0.0005:
+                        time.sleep(pause)
+                    elif pause < -self.max_lag:
+                        self.max_lag = -pause
+                index = number % len(self.sockets)
+                txid = txids[index] = (txids[index] + 1) & 0xFFFF
+                # A query still unanswered after 65536 more on its socket is replaced and counts as lost
+                self.pending[(index, txid)] = (time.perf_counter(), name, blocked)
+                try:
+                    self.sockets[index].sendto(txid.to_bytes(2, 'big') + wire[2:], self.address)
+                except OSError:
+                    pass
+                self.sent += 1
+        except KeyboardInterrupt:
+            # Stop sending and report on the queries sent so far
+            pass
+        self.finished_sending = time.perf_counter()
+        wait_until = time.monotonic() + self.timeout
+        while self.pending and time.monotonic() < wait_until:
+            time.sleep(0.01)
+        self.running = False
+        receiver.join()
+        for sock in self.sockets:
+            sock.close()
+        return self.report(started)
+
+    def report(self, started):
+        latencies = sorted(self.latencies)
+        answered = len(latencies)
+        lost = self.sent - answered
+        elapsed = max((self.last_answer or self.finished_sending) - started, 1e-9)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(answered - 1, int(fraction * answered))] * 1000, 3)
+
+        return {
+            'sent': self.sent,
+            'answered': answered,
+            'lost': lost,
+            'loss_percent': round(100.0 * lost / self.sent, 3) if self.sent else 0.0,
+            'late': self.late,
+            'send_seconds': round(self.finished_sending - started, 3),
+            'send_qps': round(self.sent / max(self.finished_sending - started, 1e-9), 1),
+            'answered_qps': round(answered / elapsed, 1),
+            'latency_ms': {
+                'p50': percentile(0.50), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                'p999': percentile(0.999), 'max': percentile(1.0),
+                'mean': round(sum(latencies) / answered * 1000, 3) if answered else None,
+            },
+            'servfail': self.servfail,
+            'max_send_lag_ms': round(self.max_lag * 1000, 3),
+            'blocked': self.blocked,
+            'checked': self.checked,
+            'expected_blocked': self.expected_blocked,
+            'false_blocks': len(self.false_blocks),
+            'missed_blocks': len(self.missed_blocks),
+            'false_block_examples': self.false_blocks[:10],
+            'missed_block_examples': self.missed_blocks[:10],
+        }
+
+def print_report(report):
+    latency = report['latency_ms']
+    print(f"Sent {report['sent']} queries in {report['send_seconds']:.2f}s ({report['send_qps']:.0f} qps, "
+          f"at most {report['max_send_lag_ms']:.1f} ms behind schedule)")
+    print(f"Answered {report['answered']} ({report['answered_qps']:.0f} qps), lost {report['lost']} "
+          f"({report['loss_percent']:.3f}%, {report['late']} answered too late), {report['servfail']} SERVFAIL")
+    if report['answered']:
+        print(f"Latency: p50 {latency['p50']:.3f} ms, p95 {latency['p95']:.3f} ms, p99 {latency['p99']:.3f} ms, "
+              f"p99.9 {latency['p999']:.3f} ms, max {latency['max']:.3f} ms, mean {latency['mean']:.3f} ms")
+    if not report['checked']:
+        print(f"Blocked {report['blocked']} answers")
+        return
+    print(f"Blocked {report['blocked']} answers ({report['expected_blocked']} expected): "
+          f"{report['false_blocks']} blocked that should not be, {report['missed_blocks']} not blocked that should be")
+    for name in report['false_block_examples']:
+        print(f"  blocked but not listed: {name}")
+    for name in report['missed_block_examples']:
+        print(f"  listed but not blocked: {name}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Send DNS queries to the server at a target rate and report "
+                                                 "throughput, latency, loss and blocking.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--domains', help="block list file or folder of names to query")
+    source.add_argument('--log', help="query log whose Received names are queried (rotated segments included)")
+    parser.add_argument('--blocked-share', type=float, default=0.5,
+                        help="share of blocked names when querying the configured block lists (default 0.5)")
+    parser.add_argument('--qps', type=float, default=10000, help="queries per second, 0 for as fast as possible")
+    parser.add_argument('--duration', type=float, default=10, help="seconds to send for (default 10)")
+    parser.add_argument('--count', type=int, help="number of queries to send instead of --duration")
+    parser.add_argument('--once', action='store_true', help="query every name once, in order")
+    parser.add_argument('--qtype', choices=sorted(QUERY_TYPES), default='A')
+    parser.add_argument('--timeout', type=float, default=2.0, help="seconds after which a query counts as lost")
+    parser.add_argument('--sockets', type=int, default=4, help="client sockets to send from")
+    parser.add_argument('--target', help="host:port of a running server to test instead of starting one")
+    parser.add_argument('--mode', choices=['threaded', 'pool', 'asyncio'], default='pool',
+                        help="serving mode of the server started for the test")
+    parser.add_argument('--cache', action='store_true', help="enable the answer cache in the server")
+    parser.add_argument('--upstream-delay', type=float, default=0,
+                        help="milliseconds the fake upstream server waits before answering")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="also write the report to this JSON file")
+    parser.add_argument('--max-loss', type=float,
+                        help="fail (exit status 1) if more than this percentage of queries is lost")
+    args = parser.parse_args(argv)
+
+    names = load_names(args)
+    qtype = QUERY_TYPES[args.qtype]
+    queries = []
+    for name, blocked in names:
+        try:
+            queries.append((encode_query(name, qtype), name, blocked))
+        except (ValueError, UnicodeError):
+            continue
+    print(f"Querying {len(queries)} names ({sum(blocked for _, _, blocked in queries)} blocked)")
+
+    processes = []
+    if args.target:
+        host, _, port = args.target.partition(':')
+        address = (socket.gethostbyname(host), int(port or 53))
+    else:
+        # The children only need what is already loaded, so fork them where possible
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else None)
+        upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        upstream.bind(('127.0.0.1', 0))
+        address = ('127.0.0.1', free_port())
+        processes.append(context.Process(target=fake_upstream, args=(upstream, args.upstream_delay / 1000),
+                                         daemon=True))
+        processes.append(context.Process(target=serve, daemon=True,
+                                         args=(args.mode, address[1], f"127.0.0.1:{upstream.getsockname()[1]}",
+                                               args.cache)))
+        for process in processes:
+            process.start()
+    try:
+        wait_ready(address)
+        if args.once:
+            stream, count, duration = queries, args.count, None
+        else:
+            random.seed(args.seed)
+            shuffled = random.sample(queries, len(queries))
+            stream, count, duration = itertools.cycle(shuffled), args.count, None if args.count else args.duration
+        client = LoadClient(address, args.sockets, args.timeout)
+        report = client.run(paced(stream, args.qps), count, duration)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+    report.update({'target': f"{address[0]}:{address[1]}", 'mode': None if args.target else args.mode,
+                   'cache': args.cache, 'qps_target': args.qps, 'upstream_delay_ms': args.upstream_delay})
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if report['false_blocks'] or report['missed_blocks']:
+        return 1
+    if args.max_loss is not None and report['loss_percent'] > args.max_loss:
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+import dnslib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+import server
+from blocklist_snapshot import write_snapshot, load_snapshot
+from dns_cache import DNSCache
+from dns_wire import BlockReply, query_name, question_key, error_reply, fit_response, with_edns, RCODE_SERVFAIL
+from domain_matcher import DomainMatcher
+from domain_set import FrontCodedDomainSet
+from ingest_benchmark import write_feeds
+
+# Microbenchmarks of the hot paths of the DNS server, for comparing commits:
+#
+#     ingest  load_blocked_domains and remove_allowed_domains on generated lists
+#             (lines/s), compiling and loading the block list snapshot
+#     lookup  'domain in blocked_domains' with the set and compact backends at
+#             each --sizes entry count (ns per lookup, half of them misses)
+#     wire    reading the name and cache key of a query, building blocked,
+#             SERVFAIL, cached and forwarded answers, and dnslib for reference
+#             (ns per message)
+#
+# Every figure is the best of --repeat runs. --save writes the results with the
+# commit and Python version to a JSON file; --compare prints the change against
+# such a file and exits with status 1 if anything got more than --threshold
+# percent worse. Two saved files can be compared without running anything by
+# passing the newer one as --results.
+#
+#     python bench/microbench.py --save before.json
+#     python bench/microbench.py --save after.json --compare before.json
+#     python bench/microbench.py --only lookup --sizes 100000,1000000
+#     python bench/microbench.py --compare before.json --results after.json
+
+GROUPS = ('ingest', 'lookup', 'wire')
+
+# A result: value in unit, where higher is better for rates and lower for times
+def result(value, unit):
+    return {'value': round(value, 3), 'unit': unit, 'higher_is_better': unit.endswith('/s')}
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def size_label(size):
+    for divisor, suffix in ((1000000, 'M'), (1000, 'k')):
+        if size >= divisor and size % divisor == 0:
+            return f"{size // divisor}{suffix}"
+    return str(size)
+
+def bench_ingest(args):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='adward-bench-') as directory:
+        lists = os.path.join(directory, 'block_lists')
+        os.mkdir(lists)
+        write_feeds(lists, args.lines, 4, 0.3)
+        # Allow a tenth of the listed names, in the formats allow lists use
+        allow_list = os.path.join(directory, 'allow_list.txt')
+        allow_lines = max(1, args.lines // 10)
+        with open(allow_list, 'w') as f:
+            for number in range(allow_lines):
+                name = f"ads{number}.example{number % 997}.com"
+                f.write(f"{name}\n" if number % 2 else f"*.{name}\n")
+        sources = [os.path.join(lists, name) for name in sorted(os.listdir(lists))] + [allow_list]
+        snapshot = os.path.join(directory, 'block_lists.snapshot')
+
+        def load():
+            index = DomainMatcher()
+            with contextlib.redirect_stdout(io.StringIO()):
+                server.load_blocked_domains(lists, index)
+            return index
+
+        def allow(index):
+            with contextlib.redirect_stdout(io.StringIO()):
+                server.remove_allowed_domains(index, allow_list)
+
+        results['ingest.load_blocked_domains'] = result(args.lines / best_of(args.repeat, load), 'lines/s')
+        index = load()
+        results['ingest.remove_allowed_domains'] = result(
+            allow_lines / best_of(args.repeat, lambda: allow(index)), 'lines/s')
+        results['ingest.snapshot_write'] = result(
+            best_of(args.repeat, lambda: write_snapshot(snapshot, index, sources)), 's')
+        results['ingest.snapshot_load'] = result(
+            best_of(args.repeat, lambda: load_snapshot(snapshot, sources, False)) * 1000, 'ms')
+    return results
+
+# Names in the style of real block lists, the same for every run
+def generated_names(count):
+    words = ['ads', 'track', 'metrics', 'cdn', 'pixel', 'beacon', 'stats', 'tag']
+    return [f"{words[number % len(words)]}{number}.example{number % 9973}.com" for number in range(count)]
+
+def lookup_cost(index, probes, repeat):
+    def run():
+        for name in probes:
+            name in index
+    return best_of(repeat, run) / len(probes) * 1e9
+
+def bench_lookup(args):
+    results = {}
+    random.seed(1)
+    for size in args.sizes:
+        label = size_label(size)
+        names = generated_names(size)
+        present = random.sample(names, min(1000, size))
+        probes = present + [f"absent-{number}.{name}" for number, name in enumerate(present)]
+        random.shuffle(probes)
+        for backend in ('set', 'compact'):
+            index = DomainMatcher()
+            index.blocked = set(names) if backend == 'set' else FrontCodedDomainSet.from_names(names)
+            results[f"lookup.{backend}.{label}"] = result(lookup_cost(index, probes * 10, args.repeat), 'ns/op')
+            del index
+            gc.collect()
+        del names
+        gc.collect()
+    return results
+
+# A forwarded answer as the upstream server sends it: one address and an OPT record
+def upstream_answer(query):
+    record = dnslib.DNSRecord.parse(query)
+    reply = record.reply()
+    reply.add_answer(dnslib.RR(record.q.qname, dnslib.QTYPE.A, rdata=dnslib.A('192.0.2.1'), ttl=300))
+    reply.add_ar(dnslib.EDNS0(udp_len=1232))
+    return reply.pack()
+
+def bench_wire(args):
+    query = dnslib.DNSRecord.question('ADS.Tracker.Example.com', 'A').pack()
+    response = upstream_answer(with_edns(query, 1232))
+    key = question_key(query)
+    cache = DNSCache()
+    cache.put(key, response)
+    blocked = {mode: BlockReply(mode) for mode in ('nxdomain', 'null')}
+
+    def dnslib_reply():
+        request = dnslib.DNSRecord.parse(query)
+        reply = request.reply()
+        reply.header.rcode = dnslib.RCODE.NXDOMAIN
+        return reply.pack()
+
+    cases = {
+        'wire.query_name': lambda: query_name(query),
+        'wire.question_key': lambda: question_key(query),
+        'wire.block_nxdomain': lambda: blocked['nxdomain'].build(query),
+        'wire.block_null': lambda: blocked['null'].build(query),
+        'wire.servfail': lambda: error_reply(query, RCODE_SERVFAIL),
+        'wire.cache_hit': lambda: cache.get(key, query),
+        'wire.fit_response': lambda: fit_response(response, query, 1232),
+        'wire.dnslib_parse': lambda: dnslib.DNSRecord.parse(query),
+        'wire.dnslib_reply': dnslib_reply,
+    }
+    results = {}
+    for name, function in cases.items():
+        elapsed = min(timeit.repeat(function, number=args.number, repeat=args.repeat))
+        results[name] = result(elapsed / args.number * 1e9, 'ns/op')
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_results(results):
+    for name, entry in results.items():
+        print(f"{name:36} {entry['value']:14,.1f} {entry['unit']}")
+
+# Print the change of every result against baseline and return the names that got worse by more
+# than threshold percent
+def compare(baseline, results, threshold):
+    regressions = []
+    for name, entry in results.items():
+        before = baseline.get(name)
+        if before is None or before['unit'] != entry['unit'] or not before['value']:
+            print(f"{name:36} {entry['value']:14,.1f} {entry['unit']:8} (new)")
+            continue
+        change = (entry['value'] - before['value']) / before['value'] * 100
+        worse = -change if entry['higher_is_better'] else change
+        flag = ''
+        if worse > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif worse < -threshold:
+            flag = '  faster'
+        print(f"{name:36} {before['value']:14,.1f} -> {entry['value']:14,.1f} {entry['unit']:8} {change:+7.1f}%{flag}")
+    return regressions
+
+def read_results(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark block list loading, lookups and DNS message handling.")
+    parser.add_argument('--only', help=f"comma-separated groups to run ({', '.join(GROUPS)})")
+    parser.add_argument('--lines', type=int, default=1000000, help="block list lines for the ingest benchmarks")
+    parser.add_argument('--sizes', default='100000,10000000',
+                        help="comma-separated block list sizes for the lookup benchmarks")
+    parser.add_argument('--number', type=int, default=100000, help="messages per wire measurement")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per measurement; the best one counts")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results to compare against")
+    parser.add_argument('--results', help="compare these saved results instead of running the benchmarks")
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help="percentage by which a result may get worse before it counts as a regression")
+    args = parser.parse_args(argv)
+    args.sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    groups = args.only.split(',') if args.only else GROUPS
+    for group in groups:
+        if group not in GROUPS:
+            parser.error(f"unknown benchmark group '{group}'")
+
+    if args.results:
+        if not args.compare:
+            parser.error("--results needs --compare")
+        report = read_results(args.results)
+    else:
+        benchmarks = {'ingest': bench_ingest, 'lookup': bench_lookup, 'wire': bench_wire}
+        results = {}
+        for group in groups:
+            started = time.perf_counter()
+            group_results = benchmarks[group](args)
+            results.update(group_results)
+            print_results(group_results)
+            print(f"({group} took {time.perf_counter() - started:.1f}s)\n")
+        report = {
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'settings': {'lines': args.lines, 'sizes': args.sizes, 'number': args.number, 'repeat': args.repeat},
+            'results': results,
+        }
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved results to {args.save}")
+
+    if not args.compare:
+        return 0
+    baseline = read_results(args.compare)
+    print(f"\nCompared with {args.compare} (commit {baseline.get('commit')}, Python {baseline.get('python')}):")
+    regressions = compare(baseline['results'], report['results'], args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} result(s) more than {args.threshold:g}% worse: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+import argparse
+import heapq
+import json
+import os
+import socket
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+import server
+from loadgen import LoadClient, QUERY_TYPES, encode_query, print_report
+from query_logger import find_segments, iter_log_rows
+
+# Replays the queries recorded in query logs against a running DNS server. Every
+# Received row is sent again as a query over UDP, keeping the time between rows
+# as it was in the log (or --speed times faster), so the server sees the same
+# bursts and quiet spells as when the log was written. The logs do not record the
+# query type, so every query asks for --qtype.
+#
+# Each log brings its rotated segments (found through the manifest next to it);
+# single rotated segments can be passed as well, and CSV and binary logs can be
+# mixed. Rows of several logs are merged by time. --start and --end pick out a
+# stretch of time, e.g. around an incident, and --max-gap shortens long idle
+# spells. The report is the same as bench/loadgen.py's, and with
+# --check-blocking every answer is also checked against the configured lists.
+#
+#     python bench/replay.py logs/dns_requests.csv --target 127.0.0.1:53
+#     python bench/replay.py logs/dns_requests.csv --speed 10 --max-gap 1 --json replay.json
+#     python bench/replay.py logs/dns_requests.2024-05-01*.csv.gz --start "2024-05-01 18:00:00" --end "2024-05-01 18:15:00"
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def parse_timestamp(text):
+    return datetime.strptime(text, TIME_FORMAT).timestamp()
+
+# Turn log rows into (due, wire, name, blocked) queries for LoadClient.run, due
+# seconds after the first one
+def schedule(rows, speed=1.0, max_gap=None, qtype='A', check_blocking=False):
+    previous = None
+    offset = 0.0
+    for timestamp, action, domain in rows:
+        if action != 'Received':
+            continue
+        try:
+            wire = encode_query(domain, QUERY_TYPES[qtype])
+        except (ValueError, UnicodeError):
+            continue
+        if previous is not None:
+            gap = max(0.0, timestamp - previous)
+            offset += min(gap, max_gap) if max_gap is not None else gap
+        previous = timestamp
+        blocked = domain in server.blocked_domains if check_blocking else None
+        yield offset / speed if speed else None, wire, domain, blocked
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the queries of AdWard query logs against a DNS server.")
+    parser.add_argument('logs', nargs='+', help="query logs (.csv or .bin, with their rotated segments) "
+                                                "or single rotated segments")
+    parser.add_argument('--target', help="host:port of the DNS server (default: 127.0.0.1 and the configured dnsPort)")
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help="replay this many times faster than recorded; 0 sends as fast as possible")
+    parser.add_argument('--max-gap', type=float, help="shorten pauses between queries to at most this many seconds")
+    parser.add_argument('--start', type=parse_timestamp, help="first log time to replay ('YYYY-MM-DD HH:MM:SS')")
+    parser.add_argument('--end', type=parse_timestamp, help="last log time to replay ('YYYY-MM-DD HH:MM:SS')")
+    parser.add_argument('--count', type=int, help="stop after this many queries")
+    parser.add_argument('--qtype', choices=sorted(QUERY_TYPES), default='A')
+    parser.add_argument('--timeout', type=float, default=2.0, help="seconds after which a query counts as lost")
+    parser.add_argument('--sockets', type=int, default=4, help="client sockets to send from")
+    parser.add_argument('--check-blocking', action='store_true',
+                        help="check that answers are blocked as the configured block lists say")
+    parser.add_argument('--json', help="also write the report to this JSON file")
+    args = parser.parse_args(argv)
+    if args.speed < 0:
+        parser.error("--speed cannot be negative")
+
+    if args.target:
+        host, _, port = args.target.partition(':')
+    else:
+        host, port = '127.0.0.1', server.get_config_value(server.config_file, 'dnsPort', 53)
+    address = (socket.gethostbyname(host), int(port or 53))
+
+    for path in args.logs:
+        segments = find_segments(path, args.start, args.end)
+        if not segments:
+            parser.error(f"no query log found at {path}")
+        print(f"{path}: {len(segments)} file(s)")
+    rows = heapq.merge(*(iter_log_rows(path, args.start, args.end) for path in args.logs), key=lambda row: row[0])
+    speed = f"{args.speed:g}x speed" if args.speed else "full speed"
+    print(f"Replaying Received queries to {address[0]}:{address[1]} at {speed}\n")
+
+    client = LoadClient(address, args.sockets, args.timeout)
+    report = client.run(schedule(rows, args.speed, args.max_gap, args.qtype, args.check_blocking), args.count)
+    report.update({'target': f"{address[0]}:{address[1]}", 'logs': args.logs, 'speed': args.speed,
+                   'max_gap': args.max_gap})
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if report['false_blocks'] or report['missed_blocks'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,272 @@
+import ctypes
+import ctypes.util
+import collections
+import errno
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+import logging
+
+# Batched UDP I/O with recvmmsg(2) and sendmmsg(2), which move many datagrams
+# per system call. Python's socket module does not wrap them, so they are called
+# through ctypes from the C library; they exist on Linux only, and available()
+# tells callers whether to use this module or plain recvfrom/sendto.
+#
+# Buffers, address storage and the message headers are allocated once per
+# socket and reused for every call. ctypes releases the GIL around the calls, so
+# other threads keep running while a receive blocks.
+
+MSG_WAITFORONE = 0x10000
+SOCKADDR_SIZE = 128  # sizeof(struct sockaddr_storage)
+# Decoded and encoded addresses are cached, as the same clients keep asking
+ADDRESS_CACHE_SIZE = 4096
+
+class iovec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(iovec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', msghdr), ('msg_len', ctypes.c_uint)]
+
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.recvmmsg.restype = ctypes.c_int
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int]
+        libc.sendmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+libc = _load_libc()
+
+def available():
+    return libc is not None
+
+def _raise_errno():
+    code = ctypes.get_errno()
+    raise OSError(code, os.strerror(code))
+
+# Decode a sockaddr_in / sockaddr_in6 into the address tuple socket.recvfrom returns
+def _decode_address(buffer):
+    family = int.from_bytes(buffer[0:2], sys.byteorder)
+    port = int.from_bytes(buffer[2:4], 'big')
+    if family == socket.AF_INET:
+        return socket.inet_ntop(socket.AF_INET, buffer[4:8]), port
+    flowinfo = int.from_bytes(buffer[4:8], 'big')
+    scope_id = int.from_bytes(buffer[24:28], sys.byteorder)
+    return socket.inet_ntop(socket.AF_INET6, buffer[8:24]), port, flowinfo, scope_id
+
+# Encode an address tuple into sockaddr_in / sockaddr_in6 bytes
+def _encode_address(address):
+    host, port = address[0], address[1]
+    if len(address) == 2:
+        return (socket.AF_INET.to_bytes(2, sys.byteorder) + port.to_bytes(2, 'big')
+                + socket.inet_pton(socket.AF_INET, host) + bytes(8))
+    flowinfo = address[2] if len(address) > 2 else 0
+    scope_id = address[3] if len(address) > 3 else 0
+    return (socket.AF_INET6.to_bytes(2, sys.byteorder) + port.to_bytes(2, 'big')
+            + flowinfo.to_bytes(4, 'big') + socket.inet_pton(socket.AF_INET6, host)
+            + scope_id.to_bytes(4, sys.byteorder))
+
+# Fields are read and written through memoryviews with struct, which costs far
+# less per datagram than going through the ctypes structure attributes
+_MESSAGE_SIZE = ctypes.sizeof(mmsghdr)
+_IOVEC_SIZE = ctypes.sizeof(iovec)
+_MSG_LEN_OFFSET = mmsghdr.msg_len.offset
+_NAMELEN_OFFSET = mmsghdr.msg_hdr.offset + msghdr.msg_namelen.offset
+_IOV_LEN_OFFSET = iovec.iov_len.offset
+_UINT32 = struct.Struct('=I')
+_SIZE_T = struct.Struct('N')
+
+# A set of message headers with their own buffers, for one direction of a socket
+class _MessageVector:
+    def __init__(self, size, buffer_size):
+        self.size = size
+        self.buffer_size = buffer_size
+        self.buffers = ctypes.create_string_buffer(size * buffer_size)
+        self.names = ctypes.create_string_buffer(size * SOCKADDR_SIZE)
+        self.iovecs = (iovec * size)()
+        self.messages = (mmsghdr * size)()
+        base = ctypes.addressof(self.buffers)
+        names = ctypes.addressof(self.names)
+        for index in range(size):
+            self.iovecs[index].iov_base = base + index * buffer_size
+            self.iovecs[index].iov_len = buffer_size
+            header = self.messages[index].msg_hdr
+            header.msg_name = names + index * SOCKADDR_SIZE
+            header.msg_namelen = SOCKADDR_SIZE
+            header.msg_iov = ctypes.pointer(self.iovecs[index])
+            header.msg_iovlen = 1
+        self.buffer_view = memoryview(self.buffers).cast('B')
+        self.name_view = memoryview(self.names).cast('B')
+        self.iovec_view = memoryview(self.iovecs).cast('B')
+        self.message_view = memoryview(self.messages).cast('B')
+        # Reads every msg_len of the vector in one call
+        self.lengths = struct.Struct('=' + f"{_MSG_LEN_OFFSET}xI{_MESSAGE_SIZE - _MSG_LEN_OFFSET - 4}x" * size)
+        self.used = 0
+
+# Receives and sends batches of datagrams on a UDP socket
+class BatchSocket:
+    def __init__(self, sock, batch_size=32, buffer_size=512):
+        if libc is None:
+            raise OSError(errno.ENOSYS, "recvmmsg/sendmmsg are not available on this platform")
+        self.sock = sock
+        self.batch_size = int(batch_size)
+        self.buffer_size = int(buffer_size)
+        self.receive = _MessageVector(self.batch_size, self.buffer_size)
+        self.send = _MessageVector(self.batch_size, self.buffer_size)
+        self.send_lock = threading.Lock()
+        self.name_length = 16 if sock.family == socket.AF_INET else 28
+        self.decoded = {}
+        self.encoded = {}
+
+    # Wait for at least one datagram and return every one that is already
+    # queued, up to batch_size, as a list of (data, address)
+    def recv_batch(self):
+        vector = self.receive
+        # The kernel shrinks msg_namelen to the length of the address it stored
+        for index in range(vector.used):
+            _UINT32.pack_into(vector.message_view, index * _MESSAGE_SIZE + _NAMELEN_OFFSET, SOCKADDR_SIZE)
+        vector.used = 0
+        while True:
+            count = libc.recvmmsg(self.sock.fileno(), vector.messages, vector.size, MSG_WAITFORONE, None)
+            if count >= 0:
+                break
+            code = ctypes.get_errno()
+            if code in (errno.EAGAIN, errno.EWOULDBLOCK):
+                # Sockets with a timeout are non-blocking underneath; wait like recvfrom would
+                timeout = self.sock.gettimeout()
+                if timeout == 0:
+                    return []
+                if not select.select([self.sock], [], [], timeout)[0]:
+                    raise socket.timeout('timed out')
+            elif code != errno.EINTR:
+                _raise_errno()
+            # Interrupted by a signal; its Python handler runs before the next call
+        vector.used = count
+        lengths = vector.lengths.unpack_from(vector.message_view)
+        buffers, names, buffer_size = vector.buffer_view, vector.name_view, vector.buffer_size
+        decoded, name_length = self.decoded, self.name_length
+        datagrams = []
+        for index in range(count):
+            start = index * buffer_size
+            name = names[index * SOCKADDR_SIZE:index * SOCKADDR_SIZE + name_length].tobytes()
+            address = decoded.get(name)
+            if address is None:
+                if len(decoded) >= ADDRESS_CACHE_SIZE:
+                    decoded.clear()
+                address = decoded[name] = _decode_address(name)
+            datagrams.append((buffers[start:start + lengths[index]].tobytes(), address))
+        return datagrams
+
+    # Send (data, address) datagrams, batch_size at a time. Datagrams larger than
+    # buffer_size are sent on their own with sendto.
+    def send_batch(self, datagrams):
+        with self.send_lock:
+            vector = self.send
+            pending = []
+            for data, address in datagrams:
+                if len(data) > vector.buffer_size:
+                    self.sock.sendto(data, address)
+                    continue
+                pending.append((data, address))
+                if len(pending) == vector.size:
+                    self._send(pending)
+                    pending = []
+            if pending:
+                self._send(pending)
+
+    def _send(self, datagrams):
+        vector = self.send
+        buffers, names, buffer_size = vector.buffer_view, vector.name_view, vector.buffer_size
+        encoded = self.encoded
+        for index, (data, address) in enumerate(datagrams):
+            start = index * buffer_size
+            buffers[start:start + len(data)] = data
+            _SIZE_T.pack_into(vector.iovec_view, index * _IOVEC_SIZE + _IOV_LEN_OFFSET, len(data))
+            name = encoded.get(address)
+            if name is None:
+                if len(encoded) >= ADDRESS_CACHE_SIZE:
+                    encoded.clear()
+                name = encoded[address] = _encode_address(address)
+            names[index * SOCKADDR_SIZE:index * SOCKADDR_SIZE + len(name)] = name
+            _UINT32.pack_into(vector.message_view, index * _MESSAGE_SIZE + _NAMELEN_OFFSET, len(name))
+        sent = 0
+        while sent < len(datagrams):
+            if sent:
+                messages = ctypes.cast(ctypes.byref(vector.messages, sent * _MESSAGE_SIZE), ctypes.POINTER(mmsghdr))
+            else:
+                messages = vector.messages
+            count = libc.sendmmsg(self.sock.fileno(), messages, len(datagrams) - sent, 0)
+            if count < 0:
+                code = ctypes.get_errno()
+                if code == errno.EINTR:
+                    continue
+                # The first unsent datagram failed (e.g. the client is unreachable); skip it
+                logging.debug(f"Could not send a response to {datagrams[sent][1]}: {os.strerror(code)}")
+                sent += 1
+            else:
+                sent += count
+
+# Collects responses written by many threads and sends whatever has piled up in
+# one sendmmsg call from a single sender thread
+class BatchSender:
+    def __init__(self, batch_socket):
+        self.batch_socket = batch_socket
+        self.pending = collections.deque()
+        self.wake = threading.Event()
+        self.running = False
+        self.thread = None
+        self.batches = 0
+        self.sent = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='batch-sender', daemon=True)
+        self.thread.start()
+
+    def send(self, data, address):
+        self.pending.append((data, address))
+        self.wake.set()
+
+    def _run(self):
+        while self.running:
+            self.wake.wait()
+            self.wake.clear()
+            batch = []
+            try:
+                while True:
+                    batch.append(self.pending.popleft())
+            except IndexError:
+                pass
+            if not batch:
+                continue
+            try:
+                self.batch_socket.send_batch(batch)
+                self.batches += 1
+                self.sent += len(batch)
+            except OSError as e:
+                if not self.running:
+                    break
+                logging.error(f"Socket error: {e}")
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
@@ -0,0 +1,228 @@
+import argparse
+import csv
+import gzip
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from datetime import datetime
+
+# zstandard is optional; it is only needed to read zstd-compressed segments
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compact binary query log.
+#
+# A log is two append-only files. The record file starts with a 16 byte header
+# (magic, version, record size) followed by fixed-width 13 byte records:
+#
+#     int64   time in microseconds since the epoch
+#     uint32  domain ID
+#     uint8   action (index into ACTIONS)
+#
+# The domain dictionary (<record file>.domains) holds one domain per line; a
+# domain's ID is its line number. Query names may hold any character, so a
+# backslash in a name is written as two backslashes and a newline as backslash-n,
+# and the dictionary is split on newlines only, never on the other line breaks
+# str.splitlines knows (\r, \x85, \x1c...). New domains are always written to the
+# dictionary before the records that use them, so a reader that maps the record
+# file never sees an ID it cannot resolve.
+
+MAGIC = b'ADWQLOG\0'
+VERSION = 1
+HEADER = struct.Struct('<8sHH4x')
+RECORD = struct.Struct('<qIB')
+
+# Action codes are stored on disk, so only ever append to this list
+ACTIONS = ['Received', 'Blocked', 'Forwarded', 'Cached']
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+UNKNOWN_ACTION = 255
+
+def dictionary_path(path):
+    return path + '.domains'
+
+def action_name(code):
+    return ACTIONS[code] if code < len(ACTIONS) else 'Unknown'
+
+# Read a whole file, inflating rotated segments compressed by the query logger
+def _read_bytes(path):
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        with open(path, 'rb') as f:
+            return zstandard.ZstdDecompressor().stream_reader(f).read()
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        return f.read()
+
+def _escape(domain):
+    return domain.replace('\\', '\\\\').replace('\n', '\\n')
+
+def _unescape(entry):
+    if '\\' not in entry:
+        return entry
+    return re.sub(r'\\(.)', lambda match: '\n' if match.group(1) == 'n' else match.group(1), entry)
+
+def _read_dictionary(path):
+    if not os.path.isfile(path):
+        return []
+    # Whatever follows the last newline is an entry still being written
+    lines = _read_bytes(path).split(b'\n')[:-1]
+    return [_unescape(line.decode('utf-8')) for line in lines]
+
+# Appends query log rows to a binary log
+class BinaryLogWriter:
+    def __init__(self, path):
+        self.path = path
+        self.domains = _read_dictionary(dictionary_path(path))
+        self.domain_ids = {domain: index for index, domain in enumerate(self.domains)}
+        new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'ab')
+        self.dictionary = open(dictionary_path(path), 'a', encoding='utf-8', newline='\n')
+        if new_file:
+            self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            self.file.flush()
+
+    # Files making up the log, record file first
+    def files(self):
+        return [self.path, dictionary_path(self.path)]
+
+    # Write (epoch seconds, action, domain) rows
+    def write_rows(self, rows):
+        records = []
+        new_domains = []
+        for timestamp, action, domain in rows:
+            domain_id = self.domain_ids.get(domain)
+            if domain_id is None:
+                domain_id = len(self.domains)
+                self.domains.append(domain)
+                self.domain_ids[domain] = domain_id
+                new_domains.append(domain)
+            records.append(RECORD.pack(int(timestamp * 1000000), domain_id, ACTION_CODES.get(action, UNKNOWN_ACTION)))
+        if new_domains:
+            self.dictionary.write(''.join(_escape(domain) + '\n' for domain in new_domains))
+            self.dictionary.flush()
+        self.file.write(b''.join(records))
+        self.file.flush()
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+        self.dictionary.close()
+
+# Reads a binary log. Uncompressed logs are memory-mapped, so scanning them does
+# not copy the file into memory; compressed rotated segments are inflated.
+class BinaryLogReader:
+    def __init__(self, path):
+        self.path = path
+        base, extension = os.path.splitext(path)
+        compressed = extension in ('.gz', '.zst')
+        if compressed:
+            self.domains = _read_dictionary(dictionary_path(base) + extension)
+        else:
+            self.domains = _read_dictionary(dictionary_path(path))
+        self.file = None
+        if compressed:
+            self.buffer = _read_bytes(path)
+        else:
+            self.file = open(path, 'rb')
+            size = os.fstat(self.file.fileno()).st_size
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        if len(self.buffer) < HEADER.size:
+            raise ValueError(f"{path} is not a query log: file is too short")
+        magic, version, record_size = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{path} is not a version {VERSION} query log")
+        # Ignore a record that is still being written
+        self.count = (len(self.buffer) - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self.count
+
+    # Yield raw (microseconds, domain ID, action code) tuples
+    def iter_records(self):
+        end = HEADER.size + self.count * RECORD.size
+        return RECORD.iter_unpack(memoryview(self.buffer)[HEADER.size:end])
+
+    # Yield (epoch seconds, action, domain) rows
+    def __iter__(self):
+        domains = self.domains
+        for microseconds, domain_id, action in self.iter_records():
+            yield microseconds / 1000000, action_name(action), domains[domain_id]
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        if self.file is not None:
+            self.file.close()
+
+# Convert a CSV query log (optionally gzip-compressed) to a binary log
+def convert_csv(csv_path, binary_path):
+    opener = gzip.open if csv_path.endswith('.gz') else open
+    writer = BinaryLogWriter(binary_path)
+    converted = 0
+    batch = []
+    with opener(csv_path, 'rt', newline='') as f:
+        for row in csv.DictReader(f):
+            try:
+                timestamp = datetime.strptime(row['time'] + '000', '%Y-%m-%d %H:%M:%S:%f').timestamp()
+            except (TypeError, ValueError):
+                continue
+            batch.append((timestamp, row['action'], row['domain']))
+            if len(batch) >= 10000:
+                writer.write_rows(batch)
+                converted += len(batch)
+                batch = []
+    writer.write_rows(batch)
+    converted += len(batch)
+    writer.close()
+    return converted
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert and inspect binary AdWard query logs.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert = commands.add_parser('convert', help="convert CSV query logs to a binary log")
+    convert.add_argument('csv_files', nargs='+', help="CSV logs to convert, oldest first (.csv or .csv.gz)")
+    convert.add_argument('output', help="binary log to append to")
+    dump = commands.add_parser('dump', help="print a binary log as CSV")
+    dump.add_argument('binary_file')
+    summary = commands.add_parser('stats', help="count actions and distinct domains in a binary log")
+    summary.add_argument('binary_file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        started = time.perf_counter()
+        total = 0
+        csv_bytes = 0
+        for csv_file in args.csv_files:
+            total += convert_csv(csv_file, args.output)
+            csv_bytes += os.path.getsize(csv_file)
+        binary_bytes = os.path.getsize(args.output) + os.path.getsize(dictionary_path(args.output))
+        print(f"Converted {total} rows in {time.perf_counter() - started:.2f}s: "
+              f"{csv_bytes} bytes of CSV -> {binary_bytes} bytes ({csv_bytes / max(binary_bytes, 1):.1f}x smaller)")
+    elif args.command == 'dump':
+        reader = BinaryLogReader(args.binary_file)
+        writer = csv.writer(sys.stdout)
+        writer.writerow(['time', 'action', 'domain'])
+        for timestamp, action, domain in reader:
+            writer.writerow([datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S:%f')[:-3], action, domain])
+        reader.close()
+    elif args.command == 'stats':
+        reader = BinaryLogReader(args.binary_file)
+        counts = [0] * 256
+        for _, _, action in reader.iter_records():
+            counts[action] += 1
+        print(f"{len(reader)} records, {len(reader.domains)} distinct domains")
+        for code, count in enumerate(counts):
+            if count:
+                print(f"  {action_name(code)}: {count}")
+        reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import hashlib
+import mmap
+import os
+import struct
+import logging
+
+from domain_matcher import DomainMatcher
+from domain_set import FrontCodedDomainSet, pack_domain_set
+from list_ingest import PARSER_VERSION
+
+# Precompiled block list snapshot.
+#
+# Parsing the block lists and applying the allow list takes seconds, so the
+# resulting DomainMatcher is written to a binary snapshot that later starts
+# memory-map instead. Layout (little endian):
+#
+#     header   magic, format version, flags, section count,
+#              SHA-256 of the source files' paths/sizes/mtimes,
+#              SHA-256 of the source files' contents
+#     sections one per matcher set (blocked, blocked zones, allowed,
+#              allowed zones), each a front-coded domain set as described
+#              in domain_set.py
+#
+# Version 1 stored plain sorted string tables; version 2 front codes them.
+#
+# The snapshot is rebuilt when the sources or the list parser change: the cheap
+# stat fingerprint is checked first and the content hash only when that differs.
+
+MAGIC = b'ADWSNAP\0'
+VERSION = 2
+HEADER = struct.Struct('<8sHHH2x32s32s')
+SECTIONS = ('blocked', 'blocked_zones', 'allowed', 'allowed_zones')
+FLAG_BLOCK_SUBDOMAINS = 1
+
+# Fingerprint of the source files from their metadata only
+def stat_fingerprint(sources, block_subdomains):
+    digest = hashlib.sha256(f"{VERSION}:{PARSER_VERSION}:{block_subdomains}".encode())
+    for path in sorted(sources):
+        info = os.stat(path)
+        digest.update(f"\0{path}\0{info.st_size}\0{info.st_mtime_ns}".encode())
+    return digest.digest()
+
+# Fingerprint of the source files from their contents
+def content_fingerprint(sources, block_subdomains):
+    digest = hashlib.sha256(f"{VERSION}:{PARSER_VERSION}:{block_subdomains}".encode())
+    for path in sorted(sources):
+        digest.update(f"\0{os.path.basename(path)}\0".encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.digest()
+
+# Write matcher to path atomically
+def write_snapshot(path, matcher, sources):
+    flags = FLAG_BLOCK_SUBDOMAINS if matcher.block_subdomains else 0
+    header = HEADER.pack(MAGIC, VERSION, flags, len(SECTIONS),
+                         stat_fingerprint(sources, matcher.block_subdomains),
+                         content_fingerprint(sources, matcher.block_subdomains))
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(header)
+        for section in SECTIONS:
+            f.write(pack_domain_set(getattr(matcher, section)))
+    os.replace(temporary, path)
+
+# Record the current stat fingerprint so the next load can skip hashing
+def _update_stat_key(path, stat_key):
+    try:
+        with open(path, 'r+b') as f:
+            f.seek(HEADER.size - 64)
+            f.write(stat_key)
+    except OSError:
+        pass
+
+# Memory-map the snapshot at path and return a DomainMatcher backed by it, or
+# None if there is no usable snapshot for the current sources. With the 'compact'
+# backend lookups run against the mapped file; with 'set' the names are copied
+# into Python sets, which use several times more memory but are faster to search.
+def load_snapshot(path, sources, block_subdomains, backend='compact'):
+    try:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(buffer) < HEADER.size:
+        return None
+    magic, version, flags, section_count, stat_key, content_key = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION or section_count != len(SECTIONS):
+        logging.info(f"Ignoring block list snapshot {path} written by another version")
+        return None
+    if bool(flags & FLAG_BLOCK_SUBDOMAINS) != block_subdomains:
+        return None
+    current_stat_key = stat_fingerprint(sources, block_subdomains)
+    if stat_key != current_stat_key:
+        # Files were touched; only rebuild if their contents actually changed
+        if content_key != content_fingerprint(sources, block_subdomains):
+            return None
+        _update_stat_key(path, current_stat_key)
+    matcher = DomainMatcher(block_subdomains=block_subdomains)
+    offset = HEADER.size
+    for section in SECTIONS:
+        domains = FrontCodedDomainSet(buffer, offset)
+        setattr(matcher, section, set(domains) if backend == 'set' else domains)
+        offset = domains.end
+    return matcher
@@ -0,0 +1,171 @@
+import hmac
+import json
+import os
+import secrets
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local control channel for the DNS server: a small HTTP/JSON API the GUI (or
+# curl) uses to read live counters and edit the block and allow lists without
+# restarting the server. It only listens on the loopback interface by default.
+#
+# Every request must carry the shared token from the token file (readable only by
+# the user running the server) in an X-Adward-Token header, name a loopback Host,
+# and come from no Origin other than a loopback one, so web pages open in a
+# browser cannot reach it. Request bodies must be sent as application/json.
+#
+#     curl -H "X-Adward-Token: $(cat etc/control.token)" http://127.0.0.1:5380/stats
+#
+#     GET    /health                       liveness and basic facts
+#     GET    /stats                        request counters, latency histogram, engine stats
+#     POST   /blocklist  {"domain": ...}   block a domain ('*.example.com' blocks the zone)
+#     DELETE /blocklist  {"domain": ...}   unblock a domain
+#     POST   /allowlist  {"domain": ...}   allow a domain
+#     DELETE /allowlist  {"domain": ...}   remove a domain from the allow list
+#     POST   /reload                       rebuild the index from the list files
+#
+# Routes map (method, path) to a function taking the decoded JSON body (a dict,
+# empty for GET) and returning a JSON-serialisable result. A ValueError raised by
+# a route becomes a 400 answer.
+
+MAX_BODY_SIZE = 64 * 1024
+TOKEN_HEADER = 'X-Adward-Token'
+LOOPBACK_HOSTS = ('localhost', '127.0.0.1', '[::1]', '::1')
+
+# Read the control token from path, creating it with a new random token that only
+# the current user can read if it does not exist yet
+def load_token(path):
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'r') as f:
+            token = f.read().strip()
+        if not token:
+            raise ValueError(f"Control token file {path} is empty")
+        return token
+    token = secrets.token_urlsafe(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(token + '\n')
+    return token
+
+# The host part of a Host header or Origin URL ('localhost:5380' -> 'localhost')
+def _host_name(value):
+    value = value.strip().lower()
+    if value.startswith('['):
+        return value[:value.find(']') + 1]
+    return value.rsplit(':', 1)[0] if value.count(':') == 1 else value
+
+def is_loopback_host(value):
+    return _host_name(value) in LOOPBACK_HOSTS
+
+def is_loopback_origin(origin):
+    scheme, separator, host = origin.strip().partition('://')
+    return bool(separator) and scheme.lower() in ('http', 'https') and is_loopback_host(host.split('/', 1)[0])
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'AdwardControl/1.0'
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Returns (status, message) for a request that must be refused, or None
+    def _refusal(self):
+        if not is_loopback_host(self.headers.get('Host', '')):
+            return 403, "Host must be a loopback address"
+        origin = self.headers.get('Origin')
+        if origin is not None and not is_loopback_origin(origin):
+            return 403, f"Requests from {origin} are not allowed"
+        token = self.headers.get(TOKEN_HEADER, '')
+        if not hmac.compare_digest(token.encode('utf-8'), self.server.token.encode('utf-8')):
+            return 401, f"Missing or wrong {TOKEN_HEADER} header"
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            return 400, "Invalid Content-Length"
+        # rfile.read(-1) would read until the client closes the connection
+        if length < 0:
+            return 400, "Invalid Content-Length"
+        content_type = self.headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+        if length > 0 and content_type != 'application/json':
+            return 415, "Request body must be application/json"
+        return None
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            raise ValueError("Request body is too large")
+        if length == 0:
+            return {}
+        body = json.loads(self.rfile.read(length))
+        if not isinstance(body, dict):
+            raise ValueError("Request body must be a JSON object")
+        return body
+
+    def _handle(self, method):
+        refusal = self._refusal()
+        if refusal is not None:
+            status, message = refusal
+            self._reply(status, {'error': message})
+            return
+        path = self.path.split('?', 1)[0].rstrip('/') or '/'
+        route = self.server.routes.get((method, path))
+        if route is None:
+            if any(route_path == path for _, route_path in self.server.routes):
+                self._reply(405, {'error': f"{method} is not supported on {path}"})
+            else:
+                self._reply(404, {'error': f"Unknown path {path}"})
+            return
+        try:
+            result = route(self._read_body())
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logging.error(f"Control request {method} {path} failed: {e}")
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, result)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def log_message(self, format, *args):
+        logging.debug(f"Control request from {self.client_address[0]}: {format % args}")
+
+class ControlServer:
+    def __init__(self, routes, token, host='127.0.0.1', port=5380):
+        self.host = host
+        self.port = int(port)
+        self.routes = routes
+        self.token = token
+        self.httpd = None
+        self.thread = None
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), ControlRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.routes = self.routes
+        self.httpd.token = self.token
+        # Port 0 picks a free port
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='control', daemon=True)
+        self.thread.start()
+        print(f"Control API listening on http://{self.host}:{self.port}")
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
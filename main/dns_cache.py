@@ -0,0 +1,208 @@
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import dns_wire
+
+# Rough per-entry bookkeeping overhead (key, entry object, dict slot) counted
+# towards the memory bound on top of the response bytes themselves
+ENTRY_OVERHEAD = 256
+
+# A cached upstream response and the offsets of the TTL fields to age on the way out
+class CacheEntry:
+    def __init__(self, response, ttl_fields, ttl, negative):
+        self.response = response
+        self.ttl_fields = ttl_fields
+        self.ttl = ttl
+        self.stored_at = time.monotonic()
+        self.expires_at = self.stored_at + ttl
+        self.negative = negative
+        self.size = len(response) + ENTRY_OVERHEAD
+        self.hits = 0
+        self.refreshing = False
+
+# TTL-aware answer cache keyed on (qname, qtype, qclass). Positive answers live for
+# the smallest TTL in the answer section, NXDOMAIN/NODATA answers for the SOA-derived
+# negative TTL (RFC 2308). Entries are evicted least-recently-used first once either
+# the entry or the byte limit is reached.
+#
+# Prefetch: an entry hit at least prefetch_min_hits times that is asked for again in
+# the last prefetch_threshold share of its TTL is refreshed in the background, by
+# calling refresh(key, query), which the server sets. Popular names are then never
+# seen expired, so their clients never wait for the upstream.
+#
+# Serve-stale (RFC 8767): expired entries are kept for up to stale_max_age seconds,
+# and when the upstream cannot be reached get_stale returns them with a TTL of
+# stale_ttl seconds instead of failing the query. The servers only let a client
+# whose question has such an entry wait stale_answer_timeout seconds for the
+# upstream (the client response timer) before answering it stale; the lookup
+# carries on and refreshes the entry when it ends.
+class DNSCache:
+    def __init__(self, max_entries=10000, max_bytes=32 * 1024 * 1024, max_ttl=86400, max_negative_ttl=3600,
+                 prefetch_min_hits=3, prefetch_threshold=0.1, stale_max_age=0, stale_ttl=30,
+                 stale_answer_timeout=1.8):
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes)
+        self.max_ttl = int(max_ttl)
+        self.max_negative_ttl = int(max_negative_ttl)
+        self.prefetch_min_hits = int(prefetch_min_hits)
+        self.prefetch_threshold = float(prefetch_threshold)
+        self.stale_max_age = float(stale_max_age)
+        self.stale_ttl = int(stale_ttl)
+        self.stale_answer_timeout = float(stale_answer_timeout)
+        self.refresh = None
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.uncacheable = 0
+        self.prefetches = 0
+        self.stale_served = 0
+
+    # Return the cached response for key with aged TTLs and the transaction ID and
+    # question name (which may differ in case) of query, or None
+    def get(self, key, query):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= now:
+                # Expired entries are kept while they may still be served stale
+                if now - entry.expires_at >= self.stale_max_age:
+                    self._remove(key)
+                    self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            entry.hits += 1
+            refresh = (self.refresh is not None and self.prefetch_min_hits > 0 and not entry.refreshing
+                       and entry.hits >= self.prefetch_min_hits
+                       and entry.expires_at - now <= entry.ttl * self.prefetch_threshold)
+            if refresh:
+                entry.refreshing = True
+                self.prefetches += 1
+        response = self._render(entry, query, len(key[0]), int(now - entry.stored_at))
+        if refresh:
+            self.refresh(key, query)
+        return response
+
+    # Whether there is an expired response for key that may still be served stale
+    def has_stale(self, key):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry.expires_at <= now and now - entry.expires_at < self.stale_max_age
+
+    # Return an expired response for key that may still be served stale, with a TTL of
+    # stale_ttl, or None. For when the upstream cannot be reached.
+    def get_stale(self, key, query):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or now - entry.expires_at >= self.stale_max_age:
+                return None
+            if entry.expires_at > now:
+                # Refreshed in the meantime
+                return self._render(entry, query, len(key[0]), int(now - entry.stored_at))
+            self.stale_served += 1
+        return self._render(entry, query, len(key[0]), ttl=self.stale_ttl)
+
+    def _render(self, entry, query, name_length, age=0, ttl=None):
+        response = bytearray(entry.response)
+        response[:2] = query[:2]
+        name_end = dns_wire.HEADER_SIZE + name_length
+        response[dns_wire.HEADER_SIZE:name_end] = query[dns_wire.HEADER_SIZE:name_end]
+        for offset, record_ttl in entry.ttl_fields:
+            struct.pack_into('!I', response, offset, ttl if ttl is not None else max(0, record_ttl - age))
+        return bytes(response)
+
+    # Let the next hit of an entry whose refresh failed try again
+    def refresh_failed(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                entry.refreshing = False
+
+    # Cache an upstream response if it is cacheable
+    def put(self, key, response):
+        try:
+            entry = self._make_entry(response)
+        except (IndexError, struct.error):
+            entry = None
+        if entry is None:
+            with self.lock:
+                self.uncacheable += 1
+            return
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.bytes += entry.size
+            self.inserts += 1
+            while self.entries and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _make_entry(self, response):
+        rcode = dns_wire.rcode(response)
+        if dns_wire.is_truncated(response) or rcode not in (dns_wire.RCODE_NOERROR, dns_wire.RCODE_NXDOMAIN):
+            return None
+        ttl_fields = []
+        answer_ttl = None
+        negative_ttl = None
+        for section, rtype, ttl, ttl_offset, rdata_offset, _ in dns_wire.iter_records(response):
+            if rtype == dns_wire.TYPE_OPT:
+                # The OPT pseudo-record uses the TTL field for EDNS flags
+                continue
+            ttl_fields.append((ttl_offset, ttl))
+            if section == dns_wire.ANSWER:
+                answer_ttl = ttl if answer_ttl is None else min(answer_ttl, ttl)
+            elif section == dns_wire.AUTHORITY and rtype == dns_wire.TYPE_SOA:
+                negative_ttl = dns_wire.soa_negative_ttl(response, ttl, rdata_offset)
+        if rcode == dns_wire.RCODE_NOERROR and answer_ttl is not None:
+            ttl = min(answer_ttl, self.max_ttl)
+            negative = False
+        elif negative_ttl is not None:
+            # NXDOMAIN or NODATA; without an SOA there is no negative TTL and
+            # RFC 2308 says the answer should not be cached
+            ttl = min(negative_ttl, self.max_negative_ttl)
+            negative = True
+        else:
+            return None
+        if ttl <= 0:
+            return None
+        return CacheEntry(bytes(response), ttl_fields, ttl, negative)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'cache_entries': len(self.entries),
+                'cache_bytes': self.bytes,
+                'cache_hits': self.hits,
+                'cache_misses': self.misses,
+                'cache_hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'cache_inserts': self.inserts,
+                'cache_evictions': self.evictions,
+                'cache_expirations': self.expirations,
+                'cache_uncacheable': self.uncacheable,
+                'cache_prefetches': self.prefetches,
+                'cache_stale_served': self.stale_served,
+            }
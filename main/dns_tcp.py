@@ -0,0 +1,217 @@
+import asyncio
+import random
+import socket
+import threading
+import logging
+
+from dns_wire import question_bytes, HEADER_SIZE
+
+# DNS over TCP (RFC 7766). Every message is sent with a two-byte length prefix,
+# so answers are not limited to the size of a UDP datagram. Clients ask again
+# over TCP when a UDP answer comes back truncated (TC set); the forwarders do
+# the same with the upstream server.
+#
+# A client may send several queries on one connection without waiting for the
+# answers (pipelining). Each query is handed to the server like a datagram, and
+# answers are written back as they become ready, which need not be in order.
+
+# Read one length-prefixed message; returns None when the peer closed the connection
+def read_message(sock):
+    header = _read_exactly(sock, 2)
+    if header is None:
+        return None
+    length = int.from_bytes(header, 'big')
+    message = _read_exactly(sock, length)
+    if message is None:
+        raise ConnectionError("Connection closed in the middle of a message")
+    return message
+
+def _read_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            if data:
+                raise ConnectionError("Connection closed in the middle of a message")
+            return None
+        data += chunk
+    return data
+
+def frame(message):
+    return len(message).to_bytes(2, 'big') + message
+
+# Send a query to a DNS server over TCP and return its answer with the query's own
+# transaction ID, or None if there was no valid answer within timeout seconds
+def query_tcp(address, data, timeout):
+    txid = random.getrandbits(16)
+    try:
+        with socket.create_connection(address, timeout=timeout) as sock:
+            sock.sendall(frame(txid.to_bytes(2, 'big') + data[2:]))
+            response = read_message(sock)
+    except OSError as e:
+        logging.debug(f"TCP query to {address[0]}:{address[1]} failed: {e}")
+        return None
+    return _check_answer(response, txid, data)
+
+async def query_tcp_async(address, data, timeout):
+    txid = random.getrandbits(16)
+
+    async def exchange():
+        reader, writer = await asyncio.open_connection(address[0], address[1])
+        try:
+            writer.write(frame(txid.to_bytes(2, 'big') + data[2:]))
+            await writer.drain()
+            header = await reader.readexactly(2)
+            return await reader.readexactly(int.from_bytes(header, 'big'))
+        finally:
+            writer.close()
+
+    try:
+        response = await asyncio.wait_for(exchange(), timeout)
+    except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+        logging.debug(f"TCP query to {address[0]}:{address[1]} failed: {e!r}")
+        return None
+    return _check_answer(response, txid, data)
+
+def _check_answer(response, txid, query):
+    if response is None or len(response) < HEADER_SIZE or int.from_bytes(response[:2], 'big') != txid:
+        return None
+    try:
+        if question_bytes(response) != question_bytes(query):
+            return None
+    except IndexError:
+        return None
+    return query[:2] + response[2:]
+
+# One client connection. It stands in for the client address of a datagram, so
+# DNSServer.send writes the answer back here.
+class TCPConnection:
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        self.pending = 0
+        self.closed = False
+
+    def __repr__(self):
+        return f"{self.address[0]}:{self.address[1]} (TCP)"
+
+    def received(self):
+        with self.lock:
+            self.pending += 1
+
+    # A query that gets no answer (malformed, ignored or shed under load) no longer
+    # holds up drain()
+    def dropped(self):
+        with self.lock:
+            self.pending = max(0, self.pending - 1)
+            self.idle.notify_all()
+
+    def send(self, message):
+        with self.lock:
+            self.pending = max(0, self.pending - 1)
+            if not self.closed:
+                try:
+                    self.sock.sendall(frame(message))
+                except OSError as e:
+                    logging.debug(f"Could not answer {self}: {e}")
+            self.idle.notify_all()
+
+    # Wait (up to timeout seconds) for the answers to the queries already read
+    def drain(self, timeout):
+        with self.lock:
+            self.idle.wait_for(lambda: self.pending == 0, timeout)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+# Threaded TCP listener for DNSServer. Every connection gets a thread that reads
+# queries and passes each one to dispatch(data, connection); connections idle
+# for idle_timeout seconds are closed.
+class TCPListener:
+    def __init__(self, host, port, dispatch, idle_timeout=10, max_connections=128, reuse_port=False):
+        self.dispatch = dispatch
+        self.idle_timeout = float(idle_timeout)
+        self.max_connections = int(max_connections)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind((host, int(port)))
+        self.sock.listen(128)
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.running = False
+        self.accepted = 0
+        self.rejected = 0
+        self.queries = 0
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._accept, name='tcp-listener', daemon=True).start()
+
+    def _accept(self):
+        while self.running:
+            try:
+                sock, address = self.sock.accept()
+            except OSError:
+                if not self.running:
+                    break
+                continue
+            with self.lock:
+                if len(self.connections) >= self.max_connections:
+                    self.rejected += 1
+                    sock.close()
+                    continue
+                connection = TCPConnection(sock, address)
+                self.connections.add(connection)
+                self.accepted += 1
+            threading.Thread(target=self._serve, args=(connection,), daemon=True).start()
+
+    def _serve(self, connection):
+        connection.sock.settimeout(self.idle_timeout)
+        try:
+            while self.running:
+                data = read_message(connection.sock)
+                if data is None:
+                    # The client has sent all its queries; let the answers go out first
+                    connection.drain(self.idle_timeout)
+                    break
+                with self.lock:
+                    self.queries += 1
+                connection.received()
+                self.dispatch(data, connection)
+        except (OSError, ConnectionError) as e:
+            logging.debug(f"Closing TCP connection {connection}: {e}")
+        finally:
+            connection.close()
+            with self.lock:
+                self.connections.discard(connection)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'tcp_connections': len(self.connections),
+                'tcp_connections_accepted': self.accepted,
+                'tcp_connections_rejected': self.rejected,
+                'tcp_queries': self.queries,
+            }
+
+    def stop(self):
+        self.running = False
+        try:
+            # Wakes up the thread blocked in accept()
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            connection.close()
@@ -0,0 +1,243 @@
+# Helpers for reading DNS messages straight from the wire format (RFC 1035 section 4)
+# without building dnslib objects.
+
+import struct
+
+HEADER_SIZE = 12
+
+# Message sections
+ANSWER, AUTHORITY, ADDITIONAL = 1, 2, 3
+
+# Record types, classes and response codes we need to recognise
+TYPE_A = 1
+TYPE_SOA = 6
+TYPE_AAAA = 28
+TYPE_OPT = 41
+CLASS_IN = 1
+RCODE_NOERROR = 0
+RCODE_SERVFAIL = 2
+RCODE_NXDOMAIN = 3
+RCODE_REFUSED = 5
+
+# Header flag bits (third byte)
+FLAG_QR = 0x80
+FLAG_AA = 0x04
+FLAG_TC = 0x02
+# Opcode and RD, which a response copies from the query
+QUERY_FLAGS = 0x79
+# Fourth byte: RA
+FLAG_RA = 0x80
+
+# Section counts of a response carrying the question and no or one answer
+COUNTS_NO_ANSWER = struct.pack('!4H', 1, 0, 0, 0)
+COUNTS_ONE_ANSWER = struct.pack('!4H', 1, 1, 0, 0)
+
+MAX_NAME_LENGTH = 255
+
+# Largest UDP message a client without EDNS can receive (RFC 1035 section 4.2.1)
+MAX_UDP_SIZE = 512
+# Largest query read from a UDP socket; EDNS queries can exceed 512 bytes
+MAX_QUERY_SIZE = 4096
+
+# Raised for queries too short or malformed to answer
+class MalformedMessage(ValueError):
+    pass
+
+# Return the offset just past the (possibly compressed) name starting at offset
+def skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            # A compression pointer always ends the name
+            return offset + 2
+        offset += length + 1
+
+# Return the offset just past the first question of the message
+def question_end(data):
+    return skip_name(data, HEADER_SIZE) + 4
+
+# Return the question section of a message as raw bytes, used to check that an
+# upstream answer belongs to the query it claims to answer
+def question_bytes(data):
+    return bytes(data[HEADER_SIZE:question_end(data)])
+
+# Return the name asked for in the first question of a query as a lower case
+# string without the trailing dot ('ADS.Example.COM.' -> 'ads.example.com'), the
+# form the block lists are matched in. Only ASCII letters are folded, as DNS
+# names compare case-insensitively in ASCII only (RFC 4343); other bytes are
+# decoded as Latin-1 and can never match a list entry.
+def query_name(data):
+    if len(data) < HEADER_SIZE + 5 or data[4:6] == b'\0\0':
+        raise MalformedMessage("Message has no question")
+    labels = []
+    offset = HEADER_SIZE
+    try:
+        length = data[offset]
+        while length:
+            if length > 63:
+                # Compression pointers are not allowed in the first name of a query
+                raise MalformedMessage("Invalid label in question name")
+            labels.append(data[offset + 1:offset + 1 + length])
+            offset += length + 1
+            length = data[offset]
+    except IndexError:
+        raise MalformedMessage("Question name runs past the end of the message") from None
+    if offset + 5 > len(data) or offset - HEADER_SIZE >= MAX_NAME_LENGTH:
+        raise MalformedMessage("Truncated question")
+    return b'.'.join(labels).lower().decode('latin-1')
+
+# Return the cache key (lowercased wire-format name, type, class) of the first question
+def question_key(data):
+    end = question_end(data)
+    qtype, qclass = struct.unpack_from('!HH', data, end - 4)
+    return bytes(data[HEADER_SIZE:end - 4]).lower(), qtype, qclass
+
+# Return response, the answer to a query for the same name, type and class as
+# query, as the answer to query: with its transaction ID and its spelling of the name
+def answer_for(response, query):
+    end = question_end(query) - 4
+    return query[:2] + response[2:HEADER_SIZE] + query[HEADER_SIZE:end] + response[end:]
+
+# Walk the resource records of a message, yielding (section, type, ttl, ttl offset,
+# rdata offset, rdata length) so callers can read or patch records in place
+def iter_records(data):
+    qdcount, ancount, nscount, arcount = struct.unpack_from('!4H', data, 4)
+    offset = HEADER_SIZE
+    for _ in range(qdcount):
+        offset = skip_name(data, offset) + 4
+    for section, count in ((ANSWER, ancount), (AUTHORITY, nscount), (ADDITIONAL, arcount)):
+        for _ in range(count):
+            offset = skip_name(data, offset)
+            rtype, _, ttl, rdlength = struct.unpack_from('!HHIH', data, offset)
+            yield section, rtype, ttl, offset + 4, offset + 10, rdlength
+            offset += 10 + rdlength
+
+# Return the negative caching TTL of an SOA record: the lesser of the record TTL
+# and the SOA MINIMUM field (RFC 2308 section 5)
+def soa_negative_ttl(data, ttl, rdata_offset):
+    offset = skip_name(data, skip_name(data, rdata_offset))
+    minimum = struct.unpack_from('!I', data, offset + 16)[0]
+    return min(ttl, minimum)
+
+# Header fields
+def rcode(data):
+    return data[3] & 0x0F
+
+def is_truncated(data):
+    return bool(data[2] & FLAG_TC)
+
+# EDNS0 (RFC 6891). The OPT pseudo-record in the additional section carries the
+# largest UDP payload its sender can receive in its class field.
+
+# Return (start, end, payload size) of the OPT record of a message, or None
+def find_opt(data):
+    if data[10:12] == b'\0\0':
+        return None
+    try:
+        for section, rtype, _, ttl_offset, rdata_offset, rdlength in iter_records(data):
+            if section == ADDITIONAL and rtype == TYPE_OPT:
+                # The owner name of an OPT record is the root, a single byte
+                return ttl_offset - 5, rdata_offset + rdlength, int.from_bytes(data[ttl_offset - 2:ttl_offset], 'big')
+    except (IndexError, struct.error):
+        raise MalformedMessage("Records run past the end of the message") from None
+    return None
+
+# Return the largest UDP answer the sender of query can receive
+def udp_payload_size(query):
+    opt = find_opt(query)
+    return max(MAX_UDP_SIZE, opt[2]) if opt is not None else MAX_UDP_SIZE
+
+# Return query advertising payload_size, by rewriting the size of its OPT record
+# or adding one, so the upstream server can send answers of up to that size
+def with_edns(query, payload_size):
+    opt = find_opt(query)
+    if opt is not None:
+        return query[:opt[0] + 3] + payload_size.to_bytes(2, 'big') + query[opt[0] + 5:]
+    arcount = int.from_bytes(query[10:12], 'big') + 1
+    return (query[:10] + arcount.to_bytes(2, 'big') + query[12:]
+            + b'\0' + struct.pack('!HHIH', TYPE_OPT, payload_size, 0, 0))
+
+# Return response without its OPT record, for clients that did not send one
+# (RFC 6891 section 7). Only an OPT record at the end of the message, where
+# servers put it, is removed.
+def without_edns(response):
+    opt = find_opt(response)
+    if opt is None or opt[1] != len(response):
+        return response
+    arcount = int.from_bytes(response[10:12], 'big') - 1
+    return response[:10] + arcount.to_bytes(2, 'big') + response[12:opt[0]]
+
+# Return the header and question of response with TC set, which tells the client
+# to ask again over TCP (RFC 1035 section 4.2.1, RFC 7766)
+def truncated_reply(response):
+    flags = bytes((response[2] | FLAG_TC, response[3]))
+    if response[4:6] == b'\0\0':
+        return response[:2] + flags + bytes(8)
+    return response[:2] + flags + COUNTS_NO_ANSWER + response[HEADER_SIZE:question_end(response)]
+
+# Adapt a response to the query it answers: the OPT record is dropped if the query
+# had none, and over UDP (max_udp_size given) an answer larger than the client can
+# receive is replaced with a truncated one
+def fit_response(response, query, max_udp_size=None):
+    client_opt = find_opt(query)
+    if client_opt is None and response[10:12] != b'\0\0':
+        response = without_edns(response)
+    if max_udp_size is not None:
+        limit = min(max_udp_size, max(MAX_UDP_SIZE, client_opt[2])) if client_opt is not None else MAX_UDP_SIZE
+        if len(response) > limit:
+            response = truncated_reply(response)
+    return response
+
+
+# Build a response to query that carries only its question and the given rcode,
+# e.g. SERVFAIL when the upstream server does not answer
+def error_reply(query, rcode):
+    if len(query) < HEADER_SIZE + 5:
+        raise MalformedMessage("Message has no question")
+    try:
+        end = question_end(query)
+    except IndexError:
+        raise MalformedMessage("Question name runs past the end of the message") from None
+    if end > len(query):
+        raise MalformedMessage("Truncated question")
+    return query[:2] + bytes(((query[2] & QUERY_FLAGS) | FLAG_QR, FLAG_RA | rcode)) + COUNTS_NO_ANSWER + query[HEADER_SIZE:end]
+
+# How blocked names are answered
+BLOCK_MODES = ('nxdomain', 'null', 'refused')
+
+# Builds the answers for blocked names by copying the query's ID and question
+# and setting the response flags, without parsing the query into objects:
+#
+#     nxdomain  the name does not exist
+#     null      A queries get 0.0.0.0 and AAAA queries :: (with ttl), other
+#               types an empty NOERROR answer
+#     refused   the server refuses to answer
+#
+# The answer records are packed once up front; they point back at the question
+# name (offset 12) instead of repeating it.
+class BlockReply:
+    def __init__(self, mode='nxdomain', ttl=60):
+        if mode not in BLOCK_MODES:
+            raise ValueError(f"Unknown block mode '{mode}'. Expected one of {', '.join(BLOCK_MODES)}.")
+        self.mode = mode
+        self.rcode = {'nxdomain': RCODE_NXDOMAIN, 'null': RCODE_NOERROR, 'refused': RCODE_REFUSED}[mode]
+        self.answers = {}
+        if mode == 'null':
+            ttl = int(ttl)
+            self.answers[TYPE_A] = b'\xc0\x0c' + struct.pack('!HHIH', TYPE_A, CLASS_IN, ttl, 4) + bytes(4)
+            self.answers[TYPE_AAAA] = b'\xc0\x0c' + struct.pack('!HHIH', TYPE_AAAA, CLASS_IN, ttl, 16) + bytes(16)
+
+    # Build the answer for a query whose name was already read with query_name
+    def build(self, query):
+        end = skip_name(query, HEADER_SIZE) + 4
+        flags = bytes(((query[2] & QUERY_FLAGS) | FLAG_QR | FLAG_AA, FLAG_RA | self.rcode))
+        answer = None
+        if self.answers:
+            qtype, qclass = struct.unpack_from('!HH', query, end - 4)
+            if qclass == CLASS_IN:
+                answer = self.answers.get(qtype)
+        if answer is None:
+            return query[:2] + flags + COUNTS_NO_ANSWER + query[HEADER_SIZE:end]
+        return query[:2] + flags + COUNTS_ONE_ANSWER + query[HEADER_SIZE:end] + answer
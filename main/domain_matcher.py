@@ -0,0 +1,118 @@
+# Block/allow list matching with zone (wildcard) support.
+#
+# Entries are plain names ('ads.example.com', blocks exactly that name) or zones
+# ('*.ads.example.com', blocks the name and everything under it). A lookup walks
+# the query name from the most specific suffix to the least specific one:
+#
+#     x.ads.example.com -> ads.example.com -> example.com -> com
+#
+# and the first level with a matching entry decides. At a given level allow
+# entries win over block entries, so an allowed name inside a blocked zone is
+# answered while a blocked zone inside an allowed zone is still blocked. Each
+# level is a hash lookup, so the cost is bounded by the number of labels in the
+# query name, not the size of the lists.
+
+ZONE_PREFIX = '*.'
+
+# Mutable view over a read-only set of names (such as a memory-mapped snapshot
+# section). Additions and removals are kept in two small sets so edits are O(1)
+# and never touch the underlying data.
+class LayeredSet:
+    def __init__(self, base):
+        self.base = base
+        self.added = set()
+        self.removed = set()
+
+    def add(self, name):
+        if name in self.removed:
+            self.removed.discard(name)
+        elif name not in self.base:
+            self.added.add(name)
+
+    def discard(self, name):
+        if name in self.added:
+            self.added.discard(name)
+        elif name in self.base:
+            self.removed.add(name)
+
+    def __contains__(self, name):
+        return name in self.added or (name in self.base and name not in self.removed)
+
+    def __len__(self):
+        return len(self.base) + len(self.added) - len(self.removed)
+
+    def __iter__(self):
+        for name in self.base:
+            if name not in self.removed:
+                yield name
+        yield from self.added
+
+# Split a list entry into (name, is_zone)
+def parse_entry(entry):
+    entry = entry.strip().lower().rstrip('.')
+    if entry.startswith(ZONE_PREFIX):
+        return entry[len(ZONE_PREFIX):], True
+    return entry, False
+
+class DomainMatcher:
+    def __init__(self, block_subdomains=False):
+        # With block_subdomains every plain block entry is treated as a zone
+        self.block_subdomains = block_subdomains
+        self.blocked = set()
+        self.blocked_zones = set()
+        self.allowed = set()
+        self.allowed_zones = set()
+
+    # Return the named set ready for edits. Sets loaded read-only from a snapshot
+    # are wrapped in a LayeredSet the first time they are edited, so lookups only
+    # pay for the extra layer once there is something in it.
+    def _editable(self, section):
+        domains = getattr(self, section)
+        if not isinstance(domains, (set, LayeredSet)):
+            domains = LayeredSet(domains)
+            setattr(self, section, domains)
+        return domains
+
+    def add(self, entry):
+        name, zone = parse_entry(entry)
+        self._editable('blocked_zones' if zone or self.block_subdomains else 'blocked').add(name)
+
+    def update(self, entries):
+        for entry in entries:
+            self.add(entry)
+
+    def discard(self, entry):
+        name, zone = parse_entry(entry)
+        self._editable('blocked_zones' if zone or self.block_subdomains else 'blocked').discard(name)
+
+    def allow(self, entry):
+        name, zone = parse_entry(entry)
+        self._editable('allowed_zones' if zone else 'allowed').add(name)
+
+    def disallow(self, entry):
+        name, zone = parse_entry(entry)
+        self._editable('allowed_zones' if zone else 'allowed').discard(name)
+
+    def is_blocked(self, domain):
+        if domain in self.allowed or domain in self.allowed_zones:
+            return False
+        if domain in self.blocked or domain in self.blocked_zones:
+            return True
+        if not self.blocked_zones:
+            return False
+        name = domain
+        index = name.find('.')
+        while index != -1:
+            name = name[index + 1:]
+            if name in self.allowed_zones:
+                return False
+            if name in self.blocked_zones:
+                return True
+            index = name.find('.')
+        return False
+
+    def __contains__(self, domain):
+        return self.is_blocked(domain)
+
+    def __len__(self):
+        return len(self.blocked) + len(self.blocked_zones)
@@ -0,0 +1,138 @@
+import bisect
+import random
+import struct
+import sys
+import time
+
+# Memory-compact, read-only set of domain names.
+#
+# Names are stored byte-reversed ('ads.example.com' -> 'moc.elpmaxe.sda') so
+# names in the same zone share a prefix, sorted, and front coded in blocks of
+# block_size names. The first name of a block is stored whole; every other name
+# stores how many leading bytes it shares with the previous name and the rest:
+#
+#     uint32 count, uint32 block size, uint32 block count
+#     uint32 block offsets[block count + 1] (relative to the block data)
+#     blocks: uint8 length, bytes name,
+#             then per name: uint8 shared, uint8 suffix length, bytes suffix
+#
+# A lookup binary-searches the block heads and scans one block, so it touches a
+# handful of bytes regardless of the set size. The block heads (one name in
+# block_size) are decoded into a list on load so the search runs in C. The
+# layout works on any buffer, so the same structure is used in memory and
+# memory-mapped from the snapshot.
+
+HEADER = struct.Struct('<III')
+DEFAULT_BLOCK_SIZE = 16
+
+# Encode names into the front-coded layout
+def pack_domain_set(names, block_size=DEFAULT_BLOCK_SIZE):
+    keys = sorted({name.encode('utf-8')[::-1] for name in names})
+    block_count = (len(keys) + block_size - 1) // block_size
+    offsets = []
+    data = bytearray()
+    previous = b''
+    for index, key in enumerate(keys):
+        if len(key) > 255:
+            raise ValueError(f"Domain name is too long: {key[::-1]!r}")
+        if index % block_size == 0:
+            offsets.append(len(data))
+            data.append(len(key))
+            data += key
+        else:
+            shared = 0
+            limit = min(len(key), len(previous), 255)
+            while shared < limit and key[shared] == previous[shared]:
+                shared += 1
+            data.append(shared)
+            data.append(len(key) - shared)
+            data += key[shared:]
+        previous = key
+    offsets.append(len(data))
+    return HEADER.pack(len(keys), block_size, block_count) + struct.pack(f'<{len(offsets)}I', *offsets) + bytes(data)
+
+class FrontCodedDomainSet:
+    def __init__(self, buffer, offset=0):
+        self.buffer = buffer
+        self.start = offset
+        self.count, self.block_size, self.block_count = HEADER.unpack_from(buffer, offset)
+        offsets_start = offset + HEADER.size
+        self.offsets = memoryview(buffer)[offsets_start:offsets_start + (self.block_count + 1) * 4].cast('I')
+        self.data_start = offsets_start + (self.block_count + 1) * 4
+        self.end = self.data_start + self.offsets[self.block_count]
+        self.heads = [self._head(block) for block in range(self.block_count)]
+
+    def _head(self, block):
+        start = self.data_start + self.offsets[block]
+        return bytes(self.buffer[start + 1:start + 1 + self.buffer[start]])
+
+    @classmethod
+    def from_names(cls, names, block_size=DEFAULT_BLOCK_SIZE):
+        return cls(pack_domain_set(names, block_size))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        key = name.encode('utf-8')[::-1]
+        block = bisect.bisect_right(self.heads, key) - 1
+        if block < 0:
+            return False
+        candidate = self.heads[block]
+        if candidate >= key:
+            return candidate == key
+        # Scan the rest of the block; names are sorted so stop at the first one >= key
+        data = self.buffer[self.data_start + self.offsets[block]:self.data_start + self.offsets[block + 1]]
+        position = 1 + len(candidate)
+        end = len(data)
+        while position < end:
+            shared = data[position]
+            length = data[position + 1]
+            candidate = candidate[:shared] + data[position + 2:position + 2 + length]
+            if candidate >= key:
+                return candidate == key
+            position += 2 + length
+        return False
+
+    # Decode the keys of one block in order
+    def _iter_block(self, block):
+        buffer = self.buffer
+        position = self.data_start + self.offsets[block]
+        end = self.data_start + self.offsets[block + 1]
+        length = buffer[position]
+        key = buffer[position + 1:position + 1 + length]
+        yield key
+        position += 1 + length
+        while position < end:
+            shared = buffer[position]
+            length = buffer[position + 1]
+            key = key[:shared] + buffer[position + 2:position + 2 + length]
+            yield key
+            position += 2 + length
+
+    def __iter__(self):
+        for block in range(self.block_count):
+            for key in self._iter_block(block):
+                yield key[::-1].decode('utf-8')
+
+    def memory_usage(self):
+        return self.end - self.start + sys.getsizeof(self.heads) + sum(sys.getsizeof(head) for head in self.heads)
+
+# Approximate bytes held by a domain set (Python set or compact set)
+def memory_usage(domains):
+    if hasattr(domains, 'memory_usage'):
+        return domains.memory_usage()
+    return sys.getsizeof(domains) + sum(sys.getsizeof(name) for name in domains)
+
+# Average lookup time in nanoseconds over a sample of present and absent names,
+# taken from names (defaults to domains itself)
+def lookup_latency(domains, samples=2000, names=None):
+    present = [name for _, name in zip(range(samples // 2), domains if names is None else names)]
+    if not present:
+        return 0.0
+    probes = present + [f"absent-{index}.{name}" for index, name in enumerate(present)]
+    random.shuffle(probes)
+    started = time.perf_counter_ns()
+    for name in probes:
+        name in domains
+    return (time.perf_counter_ns() - started) / len(probes)
@@ -0,0 +1,249 @@
+import socket
+import selectors
+import threading
+import random
+import logging
+import time
+from collections import deque
+
+from dns_wire import question_bytes, question_key, answer_for, is_truncated
+from dns_tcp import query_tcp
+
+# Keeps a window of recent upstream round-trip times and reports percentiles
+class LatencyTracker:
+    def __init__(self, samples=1024):
+        self.samples = deque(maxlen=samples)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+
+    def percentiles(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {}
+        def pick(fraction):
+            return round(samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000, 3)
+        return {'p50_ms': pick(0.50), 'p90_ms': pick(0.90), 'p99_ms': pick(0.99), 'max_ms': pick(1.0)}
+
+# A query waiting for its upstream answer
+class PendingQuery:
+    def __init__(self, question):
+        self.question = question
+        self.event = threading.Event()
+        self.response = None
+        self.upstream = None
+
+# An upstream lookup that queries for the same name, type and class can wait for
+class Lookup:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+
+# One copy of a query, sent to one upstream server
+class Attempt:
+    def __init__(self, query, upstream, timeout):
+        self.query = query
+        self.upstream = upstream
+        self.sent = time.monotonic()
+        self.deadline = self.sent + timeout
+
+# Long-lived forwarder that multiplexes queries over a few upstream UDP sockets.
+# Each socket is bound to a random source port and every query gets a random
+# transaction ID; answers are matched back on (socket, transaction ID, source
+# address, question) so stray or spoofed packets are ignored. Truncated answers
+# are fetched again over TCP.
+#
+# The UpstreamPool (see upstream_pool.py) picks the upstream servers for each
+# query. When a query goes to several, the first answer is returned; the other
+# copies stay pending until they are answered or time out, so every upstream's
+# round-trip time and health are still recorded.
+#
+# Queries for a name, type and class that is already being looked up are not
+# sent again: they wait for the lookup in flight and get a copy of its answer,
+# so a burst of clients asking for the same name costs one upstream query.
+class UpstreamForwarder:
+    def __init__(self, upstreams, sockets=4, timeout=2.0, retries=2, latency_samples=1024):
+        self.upstreams = upstreams
+        self.socket_count = int(sockets)
+        self.timeout = float(timeout)
+        self.retries = int(retries)
+        self.sockets = []
+        self.pending = {}
+        self.lookups = {}
+        self.lock = threading.Lock()
+        self.selector = selectors.DefaultSelector()
+        self.next_socket = 0
+        self.next_expiry = 0
+        self.running = False
+        self.latency = LatencyTracker(latency_samples)
+        self.queries = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.mismatched = 0
+        self.truncated = 0
+        self.tcp_queries = 0
+        self.tcp_failures = 0
+        self.coalesced = 0
+
+    def start(self):
+        for index in range(self.socket_count):
+            sock = self._open_socket()
+            self.sockets.append(sock)
+            self.selector.register(sock, selectors.EVENT_READ, index)
+        self.running = True
+        threading.Thread(target=self._receive, name='upstream-receiver', daemon=True).start()
+
+    # Bind to a random source port so answers cannot be guessed from the port alone
+    def _open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for _ in range(16):
+            try:
+                sock.bind(('', random.randint(1024, 65535)))
+                return sock
+            except OSError:
+                continue
+        sock.bind(('', 0))
+        return sock
+
+    def _receive(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                try:
+                    data, addr = key.fileobj.recvfrom(65535)
+                except OSError:
+                    continue
+                self._match(key.data, data, addr)
+            self._expire()
+
+    def _match(self, index, data, addr):
+        if len(data) < 12:
+            self.mismatched += 1
+            return
+        key = (index, int.from_bytes(data[:2], 'big'))
+        with self.lock:
+            attempt = self.pending.get(key)
+        try:
+            matches = (attempt is not None and addr == attempt.upstream.address
+                       and question_bytes(data) == attempt.query.question)
+        except IndexError:
+            matches = False
+        if not matches:
+            self.mismatched += 1
+            return
+        with self.lock:
+            self.pending.pop(key, None)
+        rtt = time.monotonic() - attempt.sent
+        self.latency.add(rtt)
+        self.upstreams.success(attempt.upstream, rtt)
+        query = attempt.query
+        # Only this thread answers queries, so the first answer wins
+        if query.response is None:
+            query.response = data
+            query.upstream = attempt.upstream
+            query.event.set()
+
+    # Count the copies of queries that were not answered in time against their upstream
+    def _expire(self):
+        now = time.monotonic()
+        if now < self.next_expiry:
+            return
+        self.next_expiry = now + 0.1
+        with self.lock:
+            expired = [key for key, attempt in self.pending.items() if attempt.deadline <= now]
+            attempts = [self.pending.pop(key) for key in expired]
+            self.timeouts += len(attempts)
+        for attempt in attempts:
+            self.upstreams.failure(attempt.upstream, self.timeout)
+
+    def _send(self, query, upstream, data):
+        with self.lock:
+            index = self.next_socket
+            self.next_socket = (index + 1) % len(self.sockets)
+            txid = random.getrandbits(16)
+            while (index, txid) in self.pending:
+                txid = random.getrandbits(16)
+            self.pending[(index, txid)] = Attempt(query, upstream, self.timeout)
+        try:
+            self.sockets[index].sendto(txid.to_bytes(2, 'big') + data[2:], upstream.address)
+        except OSError as e:
+            logging.debug(f"Failed to send query to {upstream}: {e}")
+
+    # Forward a query and return the answer with the caller's transaction ID,
+    # or None if the upstream did not answer after all retries
+    def query(self, data):
+        key = question_key(data)
+        with self.lock:
+            lookup = self.lookups.get(key)
+            leader = lookup is None
+            if leader:
+                lookup = self.lookups[key] = Lookup()
+            else:
+                self.coalesced += 1
+        if not leader:
+            # The lookup in flight always finishes, after at most all its retries
+            lookup.done.wait()
+            return answer_for(lookup.response, data) if lookup.response is not None else None
+        try:
+            lookup.response = self._query(data)
+        finally:
+            with self.lock:
+                del self.lookups[key]
+            lookup.done.set()
+        return lookup.response
+
+    def _query(self, data):
+        question = question_bytes(data)
+        with self.lock:
+            self.queries += 1
+        tried = []
+        for attempt in range(self.retries + 1):
+            pending = PendingQuery(question)
+            for upstream in self.upstreams.choose(tried):
+                self._send(pending, upstream, data)
+                tried.append(upstream)
+            if pending.event.wait(self.timeout):
+                response = data[:2] + pending.response[2:]
+                if is_truncated(response):
+                    return self.query_tcp(data, pending.upstream) or response
+                return response
+        with self.lock:
+            self.failures += 1
+        return None
+
+    # Ask again over TCP for an answer that did not fit in a UDP datagram. If that
+    # fails too the truncated answer is passed on, so the client can try TCP itself.
+    def query_tcp(self, data, upstream):
+        with self.lock:
+            self.truncated += 1
+            self.tcp_queries += 1
+        response = query_tcp(upstream.address, data, self.timeout)
+        if response is None:
+            with self.lock:
+                self.tcp_failures += 1
+        return response
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                'upstream': str(self.upstreams),
+                'upstream_queries': self.queries,
+                'upstream_in_flight': len(self.pending),
+                'upstream_timeouts': self.timeouts,
+                'upstream_failures': self.failures,
+                'upstream_mismatched': self.mismatched,
+                'upstream_truncated': self.truncated,
+                'upstream_tcp_queries': self.tcp_queries,
+                'upstream_tcp_failures': self.tcp_failures,
+                'upstream_coalesced': self.coalesced,
+                'upstream_lookups_in_flight': len(self.lookups),
+            }
+        stats.update({f"upstream_latency_{name}": value for name, value in self.latency.percentiles().items()})
+        stats['upstreams'] = self.upstreams.stats()
+        return stats
+
+    def close(self):
+        self.running = False
+        for sock in self.sockets:
+            self.selector.unregister(sock)
+            sock.close()
+        self.sockets = []
@@ -0,0 +1,153 @@
+import heapq
+import os
+import re
+import tempfile
+import logging
+
+import idna
+
+# Streaming parser for block and allow lists.
+#
+# Every list goes through the same pipeline: files are read line by line, each
+# line is parsed into zero or more entries, names are normalised and checked,
+# and entries are de-duplicated across all the files. Understood formats:
+#
+#     0.0.0.0 ads.example.com        hosts files; also 127.0.0.1, ::, ::1 and
+#     127.0.0.1 a.example b.example  several names per line
+#     ads.example.com                one domain per line
+#     *.ads.example.com              a zone (the name and everything below it)
+#     ||ads.example.com^             AdBlock-style domain rule, read as a zone
+#     # comment, ! comment           comments, also after an entry ('name # note')
+#
+# Anything else (other addresses in hosts files, cosmetic and URL filters, ...)
+# is skipped. Entries are returned in the form DomainMatcher takes: the lower
+# case ASCII (IDNA) name, without a trailing dot, prefixed with '*.' for zones.
+#
+# De-duplication keeps at most chunk_size entries in memory: larger inputs are
+# sorted in chunks that are spilled to temporary files and merged back, so the
+# result is a sorted stream whatever the input size.
+
+# Bump when parsing changes so compiled snapshots of unchanged files are rebuilt
+PARSER_VERSION = 1
+
+DEFAULT_CHUNK_SIZE = 1000000
+
+SINKHOLE_ADDRESSES = frozenset(['0.0.0.0', '127.0.0.1', '::', '::1', '0'])
+
+# Names hosts files map to loopback for the system's own use, never block entries
+LOCAL_NAMES = frozenset([
+    'localhost', 'localhost.localdomain', 'local', 'broadcasthost', '0.0.0.0',
+    'ip6-localhost', 'ip6-loopback', 'ip6-localnet', 'ip6-mcastprefix',
+    'ip6-allnodes', 'ip6-allrouters', 'ip6-allhosts',
+])
+
+# AdBlock rule options that do not restrict a domain rule
+ADBLOCK_OPTIONS = frozenset(['important', 'all'])
+
+# Dot-separated labels of letters, digits, '-' and '_', and not an IPv4 address
+VALID_NAME = re.compile(r'(?![0-9.]+$)(?:[a-z0-9_-]{1,63}\.)*[a-z0-9_-]{1,63}')
+ZONE_PREFIX = '*.'
+
+# Normalise a domain name; returns None if it is not a valid name
+def normalise_name(name):
+    name = name.rstrip('.')
+    if name.isascii():
+        name = name.lower()
+    else:
+        try:
+            name = idna.encode(name, uts46=True).decode('ascii')
+        except idna.IDNAError:
+            return None
+    if len(name) > 253 or not VALID_NAME.fullmatch(name):
+        return None
+    return name
+
+# Normalise a list entry (a name or a '*.' zone); returns None if it is not valid
+def normalise_entry(entry):
+    entry = entry.strip()
+    if entry.startswith(ZONE_PREFIX):
+        name = normalise_name(entry[len(ZONE_PREFIX):])
+        return ZONE_PREFIX + name if name else None
+    return normalise_name(entry)
+
+# Parse one line into a list of entries. This runs for every line of every list,
+# so it splits the line once and works on the fields.
+def parse_line(line):
+    fields = line.split()
+    if not fields:
+        return []
+    first = fields[0]
+    # Comments, AdBlock headers and AdBlock exception rules ('@@||name^', which allow names)
+    if first[0] in '#![@':
+        return []
+    if first.startswith('||'):
+        rule, _, options = first[2:].partition('$')
+        if len(fields) > 1 and fields[1][0] != '#':
+            return []
+        if not rule.endswith('^') or (options and not set(options.split(',')) <= ADBLOCK_OPTIONS):
+            return []
+        name = normalise_name(rule[:-1])
+        return [ZONE_PREFIX + name] if name else []
+    if first in SINKHOLE_ADDRESSES:
+        names = fields[1:]
+    elif len(fields) == 1 or fields[1][0] == '#':
+        names = fields[:1]
+    else:
+        # Another address in a hosts file, or not a list entry at all
+        return []
+    entries = []
+    for name in names:
+        if name[0] == '#':
+            break
+        entry = normalise_entry(name)
+        if entry and entry not in LOCAL_NAMES:
+            entries.append(entry)
+    return entries
+
+# Files in a list folder, skipping hidden files (downloads still in progress)
+def list_files(directory):
+    return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+            if not filename.startswith('.') and os.path.isfile(os.path.join(directory, filename))]
+
+# Yield the entries of the given files in file order, duplicates included
+def iter_entries(paths):
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', errors='replace') as file:
+            for line in file:
+                yield from parse_line(line)
+
+def _spill(chunk, directory):
+    spill = tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=directory, suffix='.chunk', delete=False)
+    with spill:
+        spill.write('\n'.join(sorted(chunk)))
+        spill.write('\n')
+    return spill.name
+
+def _read_spill(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            yield line[:-1]
+
+# Yield the distinct entries in sorted order, holding at most chunk_size of them in memory
+def unique(entries, chunk_size=DEFAULT_CHUNK_SIZE):
+    chunk = set()
+    spills = []
+    with tempfile.TemporaryDirectory(prefix='adward-ingest-') as directory:
+        for entry in entries:
+            chunk.add(entry)
+            if len(chunk) >= chunk_size:
+                spills.append(_spill(chunk, directory))
+                chunk = set()
+        if not spills:
+            yield from sorted(chunk)
+            return
+        logging.debug(f"De-duplicating block list entries from {len(spills)} sorted chunks")
+        previous = None
+        for entry in heapq.merge(sorted(chunk), *(_read_spill(path) for path in spills)):
+            if entry != previous:
+                yield entry
+                previous = entry
+
+# The distinct entries of all the given files, sorted
+def unique_entries(paths, chunk_size=DEFAULT_CHUNK_SIZE):
+    return unique(iter_entries(paths), chunk_size)
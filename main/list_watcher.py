@@ -0,0 +1,88 @@
+import os
+import threading
+import logging
+
+# Watches the block and allow list files and calls on_change from its own thread
+# when they change, so the index can be rebuilt off the request path. Files are
+# polled (size and mtime) every interval seconds, which works the same on every
+# platform; a change is only acted on once the files have stopped changing for
+# one interval, so a list that is still being written is not loaded half-way.
+# trigger() requests a reload straight away, and acknowledge() tells the watcher
+# about files the server changed itself, which are already in the index.
+class ListWatcher:
+    def __init__(self, get_sources, on_change, interval=2.0):
+        self.get_sources = get_sources
+        self.on_change = on_change
+        self.interval = float(interval)
+        self.wake = threading.Event()
+        self.forced = False
+        self.lock = threading.Lock()
+        self.current = None
+        self.running = False
+        self.thread = None
+        self.reloads = 0
+
+    def _signature(self):
+        signature = []
+        for path in sorted(self.get_sources()):
+            try:
+                info = os.stat(path)
+            except FileNotFoundError:
+                continue
+            signature.append((path, info.st_size, info.st_mtime_ns))
+        return signature
+
+    def start(self):
+        self.current = self._signature()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='list-watcher', daemon=True)
+        self.thread.start()
+
+    def trigger(self):
+        self.forced = True
+        self.wake.set()
+
+    # Take the current state of paths as the baseline, so writing them does not
+    # cause a reload; changes to the other files are still noticed
+    def acknowledge(self, paths):
+        paths = set(paths)
+        with self.lock:
+            if self.current is None:
+                return
+            signature = [entry for entry in self._signature() if entry[0] in paths]
+            signature += [entry for entry in self.current if entry[0] not in paths]
+            self.current = sorted(signature)
+
+    def _run(self):
+        pending = None
+        while self.running:
+            self.wake.wait(self.interval if self.interval > 0 else None)
+            self.wake.clear()
+            if not self.running:
+                break
+            with self.lock:
+                try:
+                    signature = self._signature()
+                except OSError as e:
+                    logging.error(f"Could not check block lists for changes: {e}")
+                    continue
+                if self.forced:
+                    self.forced = False
+                elif signature == self.current:
+                    pending = None
+                    continue
+                elif signature != pending:
+                    # Changed since the last poll; wait until it settles
+                    pending = signature
+                    continue
+                pending = None
+                self.current = signature
+            try:
+                self.on_change()
+                self.reloads += 1
+            except Exception as e:
+                logging.error(f"Failed to reload block lists: {e}")
+
+    def stop(self):
+        self.running = False
+        self.wake.set()
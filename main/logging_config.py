@@ -9,19 +9,21 @@ def setup_logging(config_file):
         # Ensure the logs directory exists
         os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
-        # Configure logging to both file and console
+        # Configure logging to both file and console. Diagnostic messages go next to the
+        # query log rather than into it, since the CSV has a single writer (see query_logger.py)
         logging.basicConfig(level=logging.INFO, format='%(asctime)s\t%(message)s', handlers=[
-            logging.FileHandler(log_file),
+            logging.FileHandler(os.path.splitext(log_file)[0] + '.log'),
             logging.StreamHandler()
         ])
         return print("Logging enabled.\n")
     else:
         return print("Logging disabled.\n")
 
-def get_config_value(config_file, variable_name):
+def get_config_value(config_file, variable_name, default=None):
     with open(config_file, 'r') as f:
         config_data = f.read()
     for line in config_data.splitlines():
-        if line.startswith(variable_name):
+        # Match the whole key so that e.g. 'logFile' does not pick up 'logFileFormat'
+        if line.split('=')[0].strip() == variable_name:
             return line.split('=')[1].strip()
-    return None
\ No newline at end of file
+    return default
\ No newline at end of file
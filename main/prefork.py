@@ -0,0 +1,184 @@
+import multiprocessing
+import queue
+import socket
+import threading
+import time
+import logging
+
+# Prefork serving: several worker processes each bind their own UDP socket to
+# the same address with SO_REUSEPORT, and the kernel spreads incoming queries
+# over them, so the server is no longer limited to the one core the GIL allows a
+# single process. This needs Linux (3.9+), where SO_REUSEPORT load-balances UDP.
+#
+# The parent compiles the block list snapshot before forking, and every worker
+# loads the index from it with the configured blockListBackend. Only with
+# 'compact' do the workers search the same memory-mapped snapshot, so that its
+# pages are shared between them through the page cache. With the default 'set'
+# each worker holds its own copy of the index in Python sets: the one inherited
+# at fork is copied page by page as reference counts change, and every reload
+# builds a new private copy per worker. The parent keeps the list watcher, the control API and the query
+# log. Workers send it their counters and log rows over a report queue, and the
+# parent sends each worker list edits and reloads over its own command queue.
+#
+# Report queue messages:      ('stats', worker, request counters, engine stats)
+#                             ('log', worker, [(time, action, domain), ...])
+# Command queue messages:     list of (DomainMatcher method, entry) edits, or
+#                             None to reload the index from the snapshot
+
+# Engine stats that are not added up over the workers: the worst worker is reported
+def _combine(values, name):
+    if name.endswith('_ms') or name.startswith('peak_'):
+        return max(values)
+    return sum(values)
+
+def reuse_port_supported():
+    return hasattr(socket, 'SO_REUSEPORT')
+
+class PreforkServer:
+    def __init__(self, worker_main, processes, on_log=None, on_stats=None, stats_interval=0):
+        if not reuse_port_supported():
+            raise ValueError("The prefork server mode needs SO_REUSEPORT, which this platform does not support.")
+        self.worker_main = worker_main
+        self.processes = int(processes) if int(processes) > 0 else multiprocessing.cpu_count()
+        self.on_log = on_log
+        self.on_stats = on_stats
+        self.stats_interval = float(stats_interval)
+        # Fork so workers start from the parent's loaded index instead of re-importing the server
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        self.report_queue = None
+        self.workers = []
+        self.engine_stats = {}
+        self.lock = threading.Lock()
+        self.running = False
+
+    # Start the worker processes. Call this before the parent starts any threads.
+    def spawn(self):
+        self.report_queue = self.context.Queue()
+        for index in range(self.processes):
+            commands = self.context.Queue()
+            process = self.context.Process(target=self.worker_main, args=(index, commands, self.report_queue),
+                                           name=f"dns-worker-{index}", daemon=True)
+            process.start()
+            self.workers.append((process, commands))
+
+    # Send list edits (or None for a full reload) to every worker
+    def broadcast(self, edits):
+        for process, commands in self.workers:
+            if process.is_alive():
+                commands.put(edits)
+
+    def _handle(self, message):
+        kind, worker, payload = message[0], message[1], message[2:]
+        if kind == 'log':
+            if self.on_log is not None:
+                self.on_log(payload[0])
+        elif kind == 'stats':
+            if self.on_stats is not None:
+                self.on_stats(worker, payload[0])
+            with self.lock:
+                self.engine_stats[worker] = payload[1]
+
+    def get_stats(self):
+        with self.lock:
+            per_worker = list(self.engine_stats.values())
+        stats = {}
+        for name in {name for worker_stats in per_worker for name in worker_stats}:
+            values = [worker_stats[name] for worker_stats in per_worker
+                      if isinstance(worker_stats.get(name), (int, float)) and not isinstance(worker_stats.get(name), bool)]
+            if values:
+                stats[name] = _combine(values, name)
+        stats['mode'] = 'prefork'
+        stats['worker_processes'] = len(self.workers)
+        stats['worker_processes_alive'] = sum(1 for process, _ in self.workers if process.is_alive())
+        return stats
+
+    def start(self):
+        if not self.workers:
+            self.spawn()
+        print(f"Serving with {len(self.workers)} worker processes sharing the port (SO_REUSEPORT)\n")
+        self.running = True
+        last_report = time.monotonic()
+        reported_dead = set()
+        while self.running:
+            try:
+                self._handle(self.report_queue.get(timeout=1))
+            except queue.Empty:
+                pass
+            for index, (process, _) in enumerate(self.workers):
+                if not process.is_alive() and index not in reported_dead and self.running:
+                    logging.error(f"DNS worker process {index} exited with code {process.exitcode}")
+                    reported_dead.add(index)
+            if self.stats_interval > 0 and time.monotonic() - last_report >= self.stats_interval:
+                last_report = time.monotonic()
+                stats = self.get_stats()
+                logging.info(f"Prefork stats: {stats['worker_processes_alive']}/{stats['worker_processes']} workers alive, "
+                             f"{stats.get('upstream_queries', 0)} upstream queries, {stats.get('dropped', 0)} dropped")
+
+    def stop(self):
+        self.running = False
+        for process, _ in self.workers:
+            if process.is_alive():
+                process.terminate()
+        for process, _ in self.workers:
+            process.join(timeout=5)
+        # Take in the last log rows the workers sent while shutting down
+        while True:
+            try:
+                self._handle(self.report_queue.get_nowait())
+            except (queue.Empty, OSError, ValueError):
+                break
+
+# Stands in for the QueryLogger inside a worker process: rows are batched and
+# sent to the parent, which writes them to the one query log
+class LogForwarder:
+    def __init__(self, report_queue, worker, batch_size=256, flush_interval=1.0):
+        self.report_queue = report_queue
+        self.worker = worker
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.rows = []
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+        self.running = False
+        self.forwarded = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='log-forwarder', daemon=True)
+        self.thread.start()
+
+    def log(self, action, domain):
+        with self.lock:
+            self.rows.append((time.time(), action, domain))
+            full = len(self.rows) >= self.batch_size
+        if full:
+            self.wake.set()
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if rows:
+            self.report_queue.put(('log', self.worker, rows))
+            self.forwarded += len(rows)
+
+    def stats(self):
+        return {'log_rows_forwarded': self.forwarded}
+
+    def close(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
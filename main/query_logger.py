@@ -0,0 +1,420 @@
+import csv
+import gzip
+import io
+import json
+import os
+import queue
+import shutil
+import struct
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime
+
+from binary_log import BinaryLogWriter, BinaryLogReader, RECORD, HEADER
+
+# zstandard is optional; gzip is used when it is not installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S:%f'
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime(TIME_FORMAT)[:-3]
+
+def parse_time(text):
+    return datetime.strptime(text + '000', TIME_FORMAT).timestamp()
+
+# Path of the manifest that lists the rotated segments of a log file
+def manifest_path(log_path):
+    return os.path.splitext(log_path)[0] + '.manifest.json'
+
+def read_manifest(path):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {'version': 1, 'segments': []}
+
+# Return the paths of the rotated segments of log_path overlapping [start, end]
+# (epoch seconds, either may be None), oldest first, followed by the active file.
+# Only segments in the format of log_path (.bin for binary logs) are returned.
+def find_segments(log_path, start=None, end=None):
+    directory = os.path.dirname(log_path)
+    log_format = 'binary' if log_path.endswith('.bin') else 'csv'
+    paths = []
+    for segment in read_manifest(manifest_path(log_path))['segments']:
+        if segment.get('format', 'csv') != log_format:
+            continue
+        if start is not None and segment['end'] < start:
+            continue
+        if end is not None and segment['start'] > end:
+            continue
+        paths.append(os.path.join(directory, segment['file']))
+    if os.path.isfile(log_path):
+        paths.append(log_path)
+    return paths
+
+# Open a log segment for reading whatever its compression
+def open_segment(path, mode='rt'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, newline='' if 't' in mode else None)
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise RuntimeError(f"zstandard is required to read {path}")
+        stream = zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'))
+        return io.TextIOWrapper(stream, newline='') if 't' in mode else stream
+    return open(path, mode, newline='' if 't' in mode else None)
+
+# Whether path is a binary log or a compressed segment of one
+def is_binary_log(path):
+    base, extension = os.path.splitext(path)
+    return (base if extension in ('.gz', '.zst') else path).endswith('.bin')
+
+# Yield the (epoch seconds, action, domain) rows of log_path and its rotated segments
+# from start to end (epoch seconds, either may be None), oldest first. log_path may
+# also be a single rotated segment. Rows that cannot be parsed are skipped.
+def iter_log_rows(log_path, start=None, end=None):
+    for path in find_segments(log_path, start, end):
+        for row in _iter_segment(path, is_binary_log(path)):
+            if (start is None or row[0] >= start) and (end is None or row[0] <= end):
+                yield row
+
+def _iter_segment(path, binary):
+    if binary:
+        reader = BinaryLogReader(path)
+        try:
+            yield from reader
+        finally:
+            reader.close()
+        return
+    with open_segment(path) as f:
+        for row in csv.DictReader(f):
+            try:
+                yield parse_time(row['time']), row['action'], row['domain']
+            except (KeyError, TypeError, ValueError):
+                continue
+
+# Writes query log rows as CSV
+class CsvLogWriter:
+    fields = ['time', 'action', 'domain']
+
+    def __init__(self, path):
+        self.path = path
+        new_file = not os.path.isfile(path) or os.path.getsize(path) == 0
+        self.file = open(path, 'a', newline='')
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(self.fields)
+            self.file.flush()
+
+    def files(self):
+        return [self.path]
+
+    def write_rows(self, rows):
+        self.writer.writerows((format_time(timestamp), action, domain) for timestamp, action, domain in rows)
+        self.file.flush()
+
+    def size(self):
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+# Times of the first and last rows of an existing log file and how many rows it holds,
+# so a logger carrying on with the file can describe it correctly when it is rotated.
+# Returns (None, None, 0) for a file without rows.
+def scan_log_file(path, log_format):
+    first = last = None
+    rows = 0
+    try:
+        if log_format == 'binary':
+            with open(path, 'rb') as f:
+                # Ignore a record that is still being written
+                rows = max(0, (os.fstat(f.fileno()).st_size - HEADER.size) // RECORD.size)
+                if rows:
+                    f.seek(HEADER.size)
+                    first = RECORD.unpack(f.read(RECORD.size))[0] / 1000000
+                    f.seek(HEADER.size + (rows - 1) * RECORD.size)
+                    last = RECORD.unpack(f.read(RECORD.size))[0] / 1000000
+            return first, last, rows
+        with open(path, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    timestamp = parse_time(row['time'])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if first is None:
+                    first = timestamp
+                last = timestamp
+                rows += 1
+    except (OSError, struct.error):
+        return None, None, 0
+    return first, last, rows
+
+# Buffered query logger. Request threads only append to an in-memory queue; a
+# single writer thread keeps the log file open and writes rows in batches, either
+# when batch_size rows are waiting or every flush_interval seconds. When the queue
+# is full new rows are dropped and counted rather than blocking the request path.
+#
+# The active file is rotated once it reaches max_bytes or its first row is
+# rotate_interval seconds old (also when carrying on with an existing file, whose
+# time range and row count are read back on start). Rotated segments are compressed by a second background
+# thread, pruned to retention_count segments / retention_days days and listed with
+# their time range in a JSON manifest next to the log file.
+#
+# Rows are written as CSV or, with log_format='binary', in the compact format
+# described in binary_log.py (the log file then gets a .bin extension).
+class QueryLogger:
+    def __init__(self, path, batch_size=256, flush_interval=1.0, queue_size=65536, max_bytes=0,
+                 rotate_interval=0, compression='gzip', retention_count=0, retention_days=0, log_format='csv'):
+        if log_format not in ('csv', 'binary'):
+            raise ValueError(f"Unknown log format '{log_format}'. Expected 'csv' or 'binary'.")
+        self.log_format = log_format
+        if log_format == 'binary':
+            path = os.path.splitext(path)[0] + '.bin'
+        self.path = path
+        self.batch_size = int(batch_size)
+        self.flush_interval = float(flush_interval)
+        self.queue_size = int(queue_size)
+        self.max_bytes = int(max_bytes)
+        self.rotate_interval = float(rotate_interval)
+        if compression == 'zstd' and zstandard is None:
+            logging.warning("zstandard is not installed, compressing rotated logs with gzip instead.")
+            compression = 'gzip'
+        if compression not in ('gzip', 'zstd', 'none'):
+            raise ValueError(f"Unknown log compression '{compression}'. Expected 'gzip', 'zstd' or 'none'.")
+        self.compression = compression
+        self.retention_count = int(retention_count)
+        self.retention_days = float(retention_days)
+        self.manifest_path = manifest_path(path)
+        # deque.append and deque.popleft are atomic, so producers never take a lock
+        self.queue = deque()
+        self.wake = threading.Event()
+        self.lock = threading.Lock()
+        self.manifest_lock = threading.Lock()
+        self.compress_queue = queue.Queue()
+        self.thread = None
+        self.compress_thread = None
+        self.running = False
+        self.writer = None
+        self.segment_start = None
+        self.segment_end = None
+        self.segment_rows = 0
+        self.logged = 0
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self._open()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='query-logger', daemon=True)
+        self.thread.start()
+        self.compress_thread = threading.Thread(target=self._compress_segments, name='query-log-compressor', daemon=True)
+        self.compress_thread.start()
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.segment_start = self.segment_end = None
+        self.segment_rows = 0
+        if os.path.isfile(self.path):
+            # Carry on with an existing file: the segment runs from its first row to its last
+            self.segment_start, self.segment_end, self.segment_rows = scan_log_file(self.path, self.log_format)
+        if self.log_format == 'binary':
+            self.writer = BinaryLogWriter(self.path)
+        else:
+            self.writer = CsvLogWriter(self.path)
+
+    def log(self, action, domain):
+        if len(self.queue) >= self.queue_size:
+            with self.lock:
+                self.dropped += 1
+            return
+        self.queue.append((time.time(), action, domain))
+        self.logged += 1
+        if len(self.queue) >= self.batch_size:
+            self.wake.set()
+
+    # Queue rows that were timestamped elsewhere, such as by a prefork worker process
+    def log_rows(self, rows):
+        room = self.queue_size - len(self.queue)
+        if room < len(rows):
+            with self.lock:
+                self.dropped += len(rows) - max(room, 0)
+            rows = rows[:max(room, 0)]
+        self.queue.extend(rows)
+        self.logged += len(rows)
+        if len(self.queue) >= self.batch_size:
+            self.wake.set()
+
+    def _run(self):
+        while self.running:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self._flush()
+            if self._should_rotate():
+                self._rotate()
+        self._flush()
+
+    def _flush(self):
+        batch = []
+        try:
+            while True:
+                batch.append(self.queue.popleft())
+        except IndexError:
+            pass
+        if not batch:
+            return
+        try:
+            self.writer.write_rows(batch)
+            self.written += len(batch)
+        except OSError as e:
+            with self.lock:
+                self.dropped += len(batch)
+            logging.error(f"Failed to write {len(batch)} query log rows: {e}")
+            return
+        if self.segment_start is None:
+            self.segment_start = batch[0][0]
+        self.segment_end = batch[-1][0]
+        self.segment_rows += len(batch)
+
+    def _should_rotate(self):
+        if self.segment_start is None:
+            return False
+        if self.max_bytes > 0 and self.writer.size() >= self.max_bytes:
+            return True
+        return self.rotate_interval > 0 and time.time() - self.segment_start >= self.rotate_interval
+
+    # Move the active file aside and hand it to the compressor
+    def _rotate(self):
+        files = self.writer.files()
+        self.writer.close()
+        base, extension = os.path.splitext(self.path)
+        stamp = datetime.fromtimestamp(self.segment_start).strftime('%Y%m%d-%H%M%S')
+        rotated = f"{base}.{stamp}{extension}"
+        suffix = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz') or os.path.exists(rotated + '.zst'):
+            rotated = f"{base}.{stamp}-{suffix}{extension}"
+            suffix += 1
+        # Side files (the binary log's domain dictionary) keep their suffix
+        renamed = [rotated + name[len(self.path):] for name in files]
+        try:
+            for source, target in zip(files, renamed):
+                os.replace(source, target)
+        except OSError as e:
+            logging.error(f"Failed to rotate query log: {e}")
+            renamed = None
+        if renamed is not None:
+            segment = {
+                'file': os.path.basename(renamed[0]),
+                'start': self.segment_start,
+                'end': self.segment_end if self.segment_end is not None else self.segment_start,
+                'rows': self.segment_rows,
+                'format': self.log_format,
+                'compression': 'none',
+            }
+            if len(renamed) > 1:
+                segment['dictionary'] = os.path.basename(renamed[1])
+            self._update_manifest(lambda segments: segments.append(segment))
+            self.compress_queue.put(segment)
+            self.rotations += 1
+        self._open()
+
+    def _compress_segments(self):
+        while True:
+            segment = self.compress_queue.get()
+            if segment is None:
+                break
+            if self.compression != 'none':
+                self._compress(segment)
+            self._apply_retention()
+
+    def _compress(self, segment):
+        directory = os.path.dirname(self.path)
+        extension = '.gz' if self.compression == 'gzip' else '.zst'
+        keys = [key for key in ('file', 'dictionary') if key in segment]
+        for key in keys:
+            source = os.path.join(directory, segment[key])
+            target = source + extension
+            try:
+                with open(source, 'rb') as src, open(target + '.tmp', 'wb') as dst:
+                    if self.compression == 'gzip':
+                        with gzip.GzipFile(fileobj=dst, mode='wb') as out:
+                            shutil.copyfileobj(src, out)
+                    else:
+                        zstandard.ZstdCompressor().copy_stream(src, dst)
+                os.replace(target + '.tmp', target)
+            except OSError as e:
+                logging.error(f"Failed to compress {source}: {e}")
+                return
+        def mark_compressed(segments):
+            for entry in segments:
+                if entry['file'] == segment['file']:
+                    for key in keys:
+                        entry[key] = segment[key] + extension
+                    entry['compression'] = self.compression
+        self._update_manifest(mark_compressed)
+        for key in keys:
+            os.remove(os.path.join(directory, segment[key]))
+
+    # Delete the oldest rotated segments beyond the configured count and age
+    def _apply_retention(self):
+        if self.retention_count <= 0 and self.retention_days <= 0:
+            return
+        directory = os.path.dirname(self.path)
+        expired = []
+        def prune(segments):
+            segments.sort(key=lambda entry: entry['start'])
+            cutoff = time.time() - self.retention_days * 86400
+            while segments and (
+                (self.retention_count > 0 and len(segments) > self.retention_count)
+                or (self.retention_days > 0 and segments[0]['end'] < cutoff)
+            ):
+                expired.append(segments.pop(0))
+        self._update_manifest(prune)
+        for segment in expired:
+            for key in ('file', 'dictionary'):
+                try:
+                    if key in segment:
+                        os.remove(os.path.join(directory, segment[key]))
+                except FileNotFoundError:
+                    pass
+
+    # Apply change to the manifest's segment list and write it back atomically
+    def _update_manifest(self, change):
+        with self.manifest_lock:
+            manifest = read_manifest(self.manifest_path)
+            change(manifest['segments'])
+            temporary = self.manifest_path + '.tmp'
+            with open(temporary, 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.replace(temporary, self.manifest_path)
+
+    def stats(self):
+        return {
+            'log_queue_depth': len(self.queue),
+            'log_rows_logged': self.logged,
+            'log_rows_written': self.written,
+            'log_rows_dropped': self.dropped,
+            'log_rotations': self.rotations,
+        }
+
+    # Stop the writer thread after writing out everything still queued
+    def close(self):
+        if self.thread is None:
+            return
+        self.running = False
+        self.wake.set()
+        self.thread.join()
+        self.thread = None
+        self.writer.close()
+        self.writer = None
+        self.compress_queue.put(None)
+        self.compress_thread.join()
+        self.compress_thread = None
@@ -1,77 +1,221 @@
-import dnslib
 import socket
 import threading
 import logging
 import os
-import csv
+import time
+import random
+import asyncio
+import atexit
+import signal
+import sys
 from logging import getLogger
-from datetime import datetime
 
 # Import the logging configuration
 from logging_config import setup_logging, get_config_value
+from worker_pool import WorkerPool
+from forwarder import UpstreamForwarder, LatencyTracker
+from upstream_pool import UpstreamPool, parse_upstreams
+from dns_cache import DNSCache
+from dns_wire import (question_key, question_bytes, query_name, error_reply, fit_response, with_edns, is_truncated,
+                      answer_for, BlockReply, MalformedMessage, RCODE_SERVFAIL, MAX_UDP_SIZE, MAX_QUERY_SIZE)
+from query_logger import QueryLogger
+from domain_matcher import DomainMatcher
+from blocklist_snapshot import load_snapshot, write_snapshot, SECTIONS
+from domain_set import memory_usage, lookup_latency
+from list_watcher import ListWatcher
+from domain_matcher import parse_entry
+from list_ingest import list_files, unique_entries, normalise_entry
+from server_stats import ServerStats
+from control import ControlServer, load_token
+from prefork import PreforkServer, LogForwarder
+from batch_io import BatchSocket, BatchSender, available as batch_io_available
+from dns_tcp import TCPListener, TCPConnection, query_tcp_async, frame
 
 # Internal variables
 config_file = os.path.join(os.path.dirname(__file__), '../etc/adward.conf')
 
-# List of blocked domains
-blocked_domains = set()
+# Entries written as '*.example.com' block the whole zone; with blockSubdomains=True every entry does.
+block_subdomains = get_config_value(config_file, 'blockSubdomains', 'False') == 'True'
 
-# Function to load blocked domains from files in block_lists folder
-def load_blocked_domains(directory):
-    blocked = set()
+# Function to load blocked domains from files in block_lists folder into the index.
+# Lists may be hosts files, plain domain lists or AdBlock-style rules, see list_ingest.py.
+def load_blocked_domains(directory, index):
     if not os.path.isdir(directory):
         raise FileNotFoundError(f"The directory {directory} does not exist.")
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        if os.path.isfile(filepath):
-            with open(filepath, 'r') as file:
-                for line in file:
-                    if line.startswith('0.0.0.0'): # Matching formatting in the file
-                        domain = line.split()[1].strip()
-                        blocked.add(domain)
-    print(f"Loaded {len(blocked)} to be blocked.")
-    return blocked
-
-# Function to load allowed domains from allow list file and remove them from blocked domains
+    count = 0
+    for entry in unique_entries(list_files(directory)):
+        index.add(entry)
+        count += 1
+    print(f"Loaded {count} to be blocked.")
+    return count
+
+# Function to load allowed domains from allow list file and exempt them from blocked domains.
+# Allow entries take precedence over block entries at the same or a less specific level.
 def remove_allowed_domains(blocked_domains, allow_list_file):
     if not os.path.isfile(allow_list_file):
         raise FileNotFoundError(f"The allow list file {allow_list_file} does not exist.")
     allowed_count = 0
-    with open(allow_list_file, 'r') as file:
-        for line in file:
-            if line.startswith('0.0.0.0'): # Matching formatting in the file
-                domain = line.split()[1].strip()
-                if domain in blocked_domains:
-                    blocked_domains.remove(domain)
-                allowed_count += 1
+    for entry in unique_entries([allow_list_file]):
+        blocked_domains.allow(entry)
+        allowed_count += 1
     print(f"Removed {allowed_count} allowed domains from blocked domains")
 
-# Load additional blocked domains from block lists
+# Block list sources
 block_lists_directory = get_config_value(config_file, 'blockListDir')
 if block_lists_directory is None:
     raise ValueError("Configuration value for 'blockListDir' is missing or invalid.")
 block_lists_directory = os.path.join(os.path.dirname(__file__), block_lists_directory)
-blocked_domains.update(load_blocked_domains(block_lists_directory))
 
-# Load allowed domains from allow list file
 allow_list_file = get_config_value(config_file, 'allowListFile')
 if allow_list_file is None:
     raise ValueError("Configuration value for 'allowListFile' is missing or invalid.")
 allow_list_file = os.path.join(os.path.dirname(__file__), allow_list_file)
-remove_allowed_domains(blocked_domains, allow_list_file)
+
+# Compiled snapshot of the block list index, see blocklist_snapshot.py
+block_list_snapshot = get_config_value(config_file, 'blockListSnapshot', '../etc/block_lists.snapshot')
+block_list_snapshot = os.path.join(os.path.dirname(__file__), block_list_snapshot)
+
+# How the index is held in memory: 'set' copies the snapshot into Python sets for the fastest lookups;
+# 'compact' searches the memory-mapped snapshot directly, for lists with millions of entries
+block_list_backend = get_config_value(config_file, 'blockListBackend', 'set')
+if block_list_backend not in ('compact', 'set'):
+    raise ValueError(f"Unknown block list backend '{block_list_backend}'. Expected 'compact' or 'set'.")
+
+# Function to list the files the block list index is built from
+def block_list_sources():
+    if not os.path.isdir(block_lists_directory):
+        raise FileNotFoundError(f"The directory {block_lists_directory} does not exist.")
+    sources = list_files(block_lists_directory)
+    if os.path.isfile(allow_list_file):
+        sources.append(allow_list_file)
+    return sources
+
+# Function to build the block list index. The compiled snapshot is used when it is up to date;
+# otherwise the lists are parsed and the snapshot is rewritten for the next start.
+def load_block_index():
+    started = time.perf_counter()
+    sources = block_list_sources()
+    index = load_snapshot(block_list_snapshot, sources, block_subdomains, block_list_backend)
+    if index is not None:
+        print(f"Loaded {len(index)} blocked domains from snapshot in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        report_block_index(index)
+        return index
+    index = DomainMatcher(block_subdomains=block_subdomains)
+    load_blocked_domains(block_lists_directory, index)
+    remove_allowed_domains(index, allow_list_file)
+    try:
+        write_snapshot(block_list_snapshot, index, sources)
+        print(f"Compiled block list snapshot in {(time.perf_counter() - started) * 1000:.1f} ms.")
+        if block_list_backend == 'compact':
+            index = load_snapshot(block_list_snapshot, sources, block_subdomains, block_list_backend) or index
+    except OSError as e:
+        logging.error(f"Could not write block list snapshot {block_list_snapshot}: {e}")
+    report_block_index(index)
+    return index
+
+# Function to print how much memory the index takes per domain and how long a lookup takes
+def report_block_index(index):
+    if len(index) == 0:
+        return
+    usage = sum(memory_usage(getattr(index, section)) for section in SECTIONS)
+    latency = lookup_latency(index, names=index.blocked if len(index.blocked) else index.blocked_zones)
+    print(f"Block list index ({block_list_backend}): {usage / 1024 / 1024:.1f} MB, "
+          f"{usage / len(index):.1f} bytes per domain, {latency / 1000:.2f} us per lookup.")
+
+blocked_domains = load_block_index()
+block_index_lock = threading.Lock()
+
+# Called with the edits applied to the index (a list of (DomainMatcher method, entry)), or with
+# None after a full reload; prefork mode uses this to pass them on to the worker processes
+index_listeners = []
+
+def notify_index_listeners(edits):
+    for listener in index_listeners:
+        listener(edits)
+
+# Function to rebuild the block list index and swap it in while the server keeps answering.
+# Requests read the module-level index once per lookup, so rebinding it is atomic for them.
+def reload_block_index():
+    global blocked_domains
+    with block_index_lock:
+        print("Block lists changed, reloading.")
+        blocked_domains = load_block_index()
+        notify_index_listeners(None)
+
+# Function to apply edits to the live index, each a set insert or removal
+def apply_index_edits(edits):
+    for method, entry in edits:
+        getattr(blocked_domains, method)(entry)
+    return edits
+
+# Block list entries added from the GUI or the control API
+custom_block_list_file = os.path.join(block_lists_directory, 'custom_blocklist.txt')
+
+# Function to check a domain sent to the control API and return it normalised
+def normalise_list_entry(domain):
+    if not isinstance(domain, str):
+        raise ValueError("Expected a 'domain' string")
+    entry = normalise_entry(domain)
+    if entry is None:
+        raise ValueError(f"Invalid domain '{domain}'")
+    return entry
+
+def append_list_entry(path, domain):
+    with open(path, 'a') as file:
+        file.write(f"0.0.0.0 {domain}\n")
+
+# Function to remove every line for domain from a list file; returns whether there was one
+def remove_list_entry(path, domain):
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'r') as file:
+        lines = file.readlines()
+    kept = [line for line in lines if not (line.startswith('0.0.0.0') and line.split()[1:2] == [domain])]
+    if len(kept) == len(lines):
+        return False
+    with open(path, 'w') as file:
+        file.writelines(kept)
+    return True
+
+# List edits made while the server runs. Each one is applied to the live index straight away
+# and written to the list files, so the next rebuild of the index picks it up as well. The
+# watcher is told about the written files, as the index already has the edit.
+def edit_block_index(edit, domain):
+    with block_index_lock:
+        edits = apply_index_edits(edit(domain))
+        notify_index_listeners(edits)
+        list_watcher.acknowledge([custom_block_list_file, allow_list_file])
+
+def block_domain(domain):
+    remove_list_entry(allow_list_file, domain)
+    append_list_entry(custom_block_list_file, domain)
+    return [('disallow', domain), ('add', domain)]
+
+# Unblocking a domain that came from a downloaded block list needs an allow list entry,
+# so like the GUI this allows the domain as well when it is still blocked.
+def unblock_domain(domain):
+    edits = []
+    if remove_list_entry(custom_block_list_file, domain):
+        # Applied now so the check below sees it; applying an edit twice changes nothing
+        edits = apply_index_edits([('discard', domain)])
+    if parse_entry(domain)[0] in blocked_domains:
+        append_list_entry(allow_list_file, domain)
+        edits.append(('allow', domain))
+    return edits
+
+def allow_domain(domain):
+    append_list_entry(allow_list_file, domain)
+    return [('allow', domain)]
+
+def disallow_domain(domain):
+    remove_list_entry(allow_list_file, domain)
+    return [('disallow', domain)]
 
 # CSV logging setup
 csv_log_file = get_config_value(config_file, 'logFile')
 if csv_log_file is None:
     raise ValueError("Configuration value for 'logFile' is missing or invalid.")
 csv_log_file = os.path.join(os.path.dirname(__file__), csv_log_file)
-csv_log_fields = ['time', 'action', 'domain']
-
-# Ensure the CSV log file exists and has headers
-if not os.path.isfile(csv_log_file):
-    with open(csv_log_file, 'w', newline='') as csvfile:
-        csv_writer = csv.DictWriter(csvfile, fieldnames=csv_log_fields)
-        csv_writer.writeheader()
 
 # Check if logging is enabled
 logging_enabled = get_config_value(config_file, 'loggingEnabled')
@@ -79,60 +223,209 @@ if logging_enabled is None:
     raise ValueError("Configuration value for 'loggingEnabled' is missing or invalid.")
 logging_enabled = logging_enabled == 'True'
 
+# Rows are handed to a single background writer; see query_logger.py
+query_logger = QueryLogger(csv_log_file,
+                           batch_size=get_config_value(config_file, 'logBatchSize', 256),
+                           flush_interval=get_config_value(config_file, 'logFlushInterval', 1.0),
+                           queue_size=get_config_value(config_file, 'logQueueSize', 65536),
+                           max_bytes=get_config_value(config_file, 'logRotateMaxBytes', 0),
+                           rotate_interval=get_config_value(config_file, 'logRotateInterval', 0),
+                           compression=get_config_value(config_file, 'logCompression', 'gzip'),
+                           retention_count=get_config_value(config_file, 'logRetentionCount', 0),
+                           retention_days=get_config_value(config_file, 'logRetentionDays', 0),
+                           log_format=get_config_value(config_file, 'logFormat', 'csv'))
+atexit.register(query_logger.close)
+
 def log_to_csv(action, domain):
-    global logging_enabled
     if logging_enabled:
-        try:
-            with open(csv_log_file, 'a', newline='') as csvfile:
-                csv_writer = csv.DictWriter(csvfile, fieldnames=csv_log_fields)
-                csv_writer.writerow({
-                    'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S:%f')[:-3], 
-                    'action': action, 
-                    'domain': domain
-                })
-        except OSError as e:
-            if e.errno == 10054:  # Connection reset by peer
-                logging_enabled = False
-                logging.error("Socket forcibly closed. Logging disabled.")
-            else:
-                raise
+        query_logger.log(action, domain)
+
+# Live request counters, served by the control API
+server_stats = ServerStats()
+
+# How blocked domains are answered: 'nxdomain', 'null' (0.0.0.0 / :: for blockTtl seconds) or 'refused'
+block_reply = BlockReply(get_config_value(config_file, 'blockMode', 'nxdomain'),
+                         get_config_value(config_file, 'blockTtl', 60))
+
+# Answer a query from the block list if possible. Returns (domain, reply) where reply is the
+# packed response for blocked domains and None for domains that have to be forwarded.
+# Both are None for queries that are ignored altogether. The name is read straight from the
+# packet (lower case, so mixed-case queries match the lists) and the reply is built from the
+# query bytes, so no DNS objects are created. Raises MalformedMessage for unusable packets.
+def answer_locally(data):
+    domain = query_name(data)
+
+    # Skip logging for reverse DNS lookups for 127.0.0.1
+    if domain == '1.0.0.127.in-addr.arpa':
+        return None, None
+
+    log_to_csv('Received', domain)
+    server_stats.received()
+
+    if domain in blocked_domains:
+        return domain, block_reply.build(data)
+    return domain, None
+
+# Build a SERVFAIL answer for a query we cannot resolve
+def servfail_reply(data):
+    return error_reply(data, RCODE_SERVFAIL)
+
+# Largest UDP answer we ask upstream servers for and send to clients (EDNS0, RFC 6891)
+edns_payload_size = max(MAX_UDP_SIZE, int(get_config_value(config_file, 'ednsPayloadSize', 1232)))
+
+# Fit an answer to the client that asked: the OPT record is dropped for clients that did not
+# send one and, over UDP, answers larger than the client can receive go out truncated (TC set)
+# so it asks again over TCP
+def client_reply(response, query, udp=True):
+    reply = fit_response(response, query, edns_payload_size if udp else None)
+    if udp and is_truncated(reply) and not is_truncated(response):
+        server_stats.truncated()
+    return reply
+
+# Log and count an answered query
+log_actions = {'blocked': 'Blocked', 'cached': 'Cached', 'stale': 'Cached', 'forwarded': 'Forwarded'}
+
+def record_answer(outcome, domain, started):
+    if outcome in log_actions:
+        log_to_csv(log_actions[outcome], domain)
+    server_stats.answered(outcome, started)
 
 class DNSServer:
-    def __init__(self, host='127.0.0.1', port=None, forwarder=None):
+    def __init__(self, host='127.0.0.1', port=None, forwarder=None, mode='threaded',
+                 pool_size=32, queue_size=1024, overload_policy='drop', stats_interval=0,
+                 upstream_sockets=4, upstream_timeout=2.0, upstream_retries=2, cache=None, reuse_port=False,
+                 batch_io=False, batch_size=32, tcp=True, tcp_idle_timeout=10, tcp_max_connections=128,
+                 upstream_race=False, upstream_failure_limit=3, upstream_probe_interval=10):
         self.host = host
         self.port = int(port) if port else 53 # Default DNS port
         self.forwarder = forwarder if forwarder else '8.8.8.8' # Google DNS
+        if mode not in ('threaded', 'pool'):
+            raise ValueError(f"Unknown server mode '{mode}'. Expected 'threaded' or 'pool'.")
+        if overload_policy not in ('drop', 'servfail'):
+            raise ValueError(f"Unknown overload policy '{overload_policy}'. Expected 'drop' or 'servfail'.")
+        self.mode = mode
+        self.overload_policy = overload_policy
+        self.stats_interval = float(stats_interval)
+        self.pool = WorkerPool(self.handle_request, pool_size, queue_size) if mode == 'pool' else None
+        # forwarder may list several upstream servers ('host[:port], ...'), see upstream_pool.py
+        self.upstream_pool = UpstreamPool(parse_upstreams(self.forwarder), upstream_race, upstream_failure_limit,
+                                          upstream_probe_interval)
+        self.upstream = UpstreamForwarder(self.upstream_pool, sockets=upstream_sockets,
+                                          timeout=upstream_timeout, retries=upstream_retries)
+        self.cache = cache
+        if cache is not None:
+            cache.refresh = self.refresh
+        self.dropped = 0
+        self.servfailed = 0
         self.server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if reuse_port:
+            # Let the other prefork workers bind the same port
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.server.bind((self.host, self.port))
+        # With batch_io, datagrams are received and sent many per system call where the platform
+        # supports it (see batch_io.py); the sockets are set up in start()
+        self.batch_io = batch_io
+        self.batch_size = int(batch_size)
+        self.batch_socket = None
+        self.sender = None
+        # Queries over TCP share the pool (or get a thread each) like datagrams; their
+        # answers go back through the TCPConnection that stands in for the address
+        self.tcp = None
+        if tcp:
+            try:
+                self.tcp = TCPListener(self.host, self.port, self.dispatch, tcp_idle_timeout, tcp_max_connections,
+                                       reuse_port)
+            except OSError as e:
+                logging.error(f"Could not listen for DNS over TCP on port {self.port}: {e}")
         self.running = True
 
+    def send(self, data, addr):
+        if isinstance(addr, TCPConnection):
+            addr.send(data)
+        elif self.sender is not None:
+            self.sender.send(data, addr)
+        else:
+            self.server.sendto(data, addr)
+
+    # Answer a query. Returns (outcome, domain, response) with outcome 'blocked', 'cached',
+    # 'forwarded', 'stale' or 'servfail', or all None for queries that are ignored.
+    def resolve(self, data):
+        domain, reply = answer_locally(data)
+        if domain is None:
+            return None, None, None
+        if reply is not None:
+            return 'blocked', domain, reply
+
+        key = None
+        if self.cache is not None:
+            key = question_key(data)
+            cached = self.cache.get(key, data)
+            if cached is not None:
+                return 'cached', domain, cached
+
+        # Forward the request to the external DNS server (8.8.8.8), offering it our EDNS buffer size
+        forward_data = self.forward(with_edns(data, edns_payload_size), key)
+        if forward_data is None:
+            logging.debug(f"No answer from {self.upstream_pool} for {domain}")
+            # Rather an expired answer than none at all (RFC 8767)
+            stale = self.cache.get_stale(key, data) if key is not None else None
+            if stale is not None:
+                return 'stale', domain, stale
+            return 'servfail', domain, servfail_reply(data)
+        return 'forwarded', domain, forward_data
+
+    # Ask the upstream servers and cache their answer. Returns None if there is none yet. When
+    # an expired answer for the question may be served stale, the client waits no longer than
+    # the cache's stale_answer_timeout (RFC 8767 client response timer) and the lookup goes
+    # on in the background, refreshing the cache when it ends.
+    def forward(self, query, key=None):
+        def lookup():
+            forward_data = self.upstream.query(query)
+            if forward_data is not None and key is not None:
+                self.cache.put(key, forward_data)
+            return forward_data
+
+        if key is None or self.cache.stale_answer_timeout <= 0 or not self.cache.has_stale(key):
+            return lookup()
+        result = {}
+        done = threading.Event()
+
+        def background():
+            result['answer'] = lookup()
+            done.set()
+
+        threading.Thread(target=background, name='stale-refresh', daemon=True).start()
+        done.wait(self.cache.stale_answer_timeout)
+        return result.get('answer')
+
+    # Called by the cache to refresh a popular entry before it expires
+    def refresh(self, key, query):
+        threading.Thread(target=self._refresh, args=(key, query), name='cache-prefetch', daemon=True).start()
+
+    def _refresh(self, key, query):
+        forward_data = self.upstream.query(with_edns(query, edns_payload_size))
+        if forward_data is None:
+            self.cache.refresh_failed(key)
+        else:
+            self.cache.put(key, forward_data)
+
+    # Called for a query that gets no answer, so a TCP connection stops waiting for it
+    def drop(self, addr):
+        if isinstance(addr, TCPConnection):
+            addr.dropped()
+
     def handle_request(self, data, addr):
+        started = time.perf_counter()
+        answered = False
         try:
-            request = dnslib.DNSRecord.parse(data)
-            domain = str(request.q.qname).strip('.')
-            
-            # Skip logging for reverse DNS lookups for 127.0.0.1
-            if domain == '1.0.0.127.in-addr.arpa':
+            outcome, domain, response = self.resolve(data)
+            if outcome is None:
                 return
-
-            log_to_csv('Received', domain)
-
-            if domain in blocked_domains:
-                # Respond with NXDOMAIN if the domain is blocked
-                reply = request.reply()
-                reply.header.rcode = dnslib.RCODE.NXDOMAIN
-                self.server.sendto(reply.pack(), addr)
-                log_to_csv('Blocked', domain)
-            else:
-                # Forward the request to the external DNS server (8.8.8.8)
-                forward_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                forward_sock.sendto(data, (self.forwarder, 53))
-                forward_data, _ = forward_sock.recvfrom(512)
-                forward_sock.close()
-
-                # Send the response from the external DNS server back to the client
-                self.server.sendto(forward_data, addr)
-                log_to_csv('Forwarded', domain)
+            self.send(client_reply(response, data, not isinstance(addr, TCPConnection)), addr)
+            answered = True
+            record_answer(outcome, domain, started)
+        except MalformedMessage as e:
+            logging.debug(f"Malformed DNS request from {addr}: {e}")
         except socket.error as e:
             if e.errno == 10054:
                 logging.debug("Socket error: [WinError 10054] An existing connection was forcibly closed by the remote host.")
@@ -140,14 +433,98 @@ class DNSServer:
                 logging.error("Socket error: [WinError 10048] Only one usage of each socket address (protocol/network address/port) is normally permitted. Please close the existing server instance.")
             else:
                 logging.error(f"Socket error: {e}")
+        finally:
+            if not answered:
+                self.drop(addr)
+
+    # Apply the configured overload policy to a datagram the pool could not accept
+    def reject_request(self, data, addr):
+        if self.overload_policy == 'servfail':
+            try:
+                self.send(servfail_reply(data), addr)
+                self.servfailed += 1
+                return
+            except (MalformedMessage, socket.error):
+                pass
+        self.dropped += 1
+        self.drop(addr)
+
+    def dispatch(self, data, addr):
+        if self.pool is None:
+            threading.Thread(target=self.handle_request, args=(data, addr)).start()
+        elif not self.pool.submit(data, addr):
+            self.reject_request(data, addr)
+
+    def get_stats(self):
+        stats = {'mode': self.mode, 'dropped': self.dropped, 'servfailed': self.servfailed}
+        if self.pool is not None:
+            stats.update(self.pool.stats())
+        if self.tcp is not None:
+            stats.update(self.tcp.stats())
+        if self.sender is not None:
+            stats.update({'batch_receives': self.batch_receives, 'batch_datagrams_received': self.batch_received,
+                          'batch_sends': self.sender.batches, 'batch_datagrams_sent': self.sender.sent})
+        stats.update(self.upstream.stats())
+        if self.cache is not None:
+            stats.update(self.cache.stats())
+        stats.update(query_logger.stats())
+        return stats
+
+    def report_stats(self):
+        while self.running:
+            time.sleep(self.stats_interval)
+            stats = self.get_stats()
+            if self.pool is not None:
+                logging.info(
+                    f"Pool stats: {stats['busy_workers']}/{stats['pool_size']} workers busy "
+                    f"(peak {stats['peak_busy_workers']}), queue {stats['queue_depth']}/{stats['queue_capacity']} "
+                    f"(peak {stats['peak_queue_depth']}), dropped {stats['dropped']}, servfail {stats['servfailed']}"
+                )
+            logging.info(
+                f"Upstream stats: {stats['upstream_queries']} queries, {stats['upstream_timeouts']} timeouts, "
+                f"{stats['upstream_failures']} failures, latency p50 {stats.get('upstream_latency_p50_ms')} ms, "
+                f"p99 {stats.get('upstream_latency_p99_ms')} ms"
+            )
+            if self.cache is not None:
+                logging.info(
+                    f"Cache stats: {stats['cache_entries']} entries ({stats['cache_bytes']} bytes), "
+                    f"{stats['cache_hits']} hits, {stats['cache_misses']} misses, {stats['cache_evictions']} evictions"
+                )
 
     def start(self):
         print(f"Starting DNS server on {self.host}:{self.port}")
-        print(f"Forwarding DNS requests to {self.forwarder}\n")
+        print(f"Forwarding DNS requests to {self.upstream_pool}{' (race mode)' if self.upstream_pool.race else ''}\n")
+        if logging_enabled:
+            query_logger.start()
+        self.upstream.start()
+        if self.stats_interval > 0:
+            threading.Thread(target=self.report_stats, daemon=True).start()
+        if self.pool is not None:
+            print(f"Using a pool of {self.pool.size} workers with a queue of {self.pool.queue.maxsize} requests (overload policy: {self.overload_policy})\n")
+            self.pool.start()
+        if self.batch_io:
+            if batch_io_available():
+                self.batch_socket = BatchSocket(self.server, self.batch_size, MAX_QUERY_SIZE)
+                self.sender = BatchSender(self.batch_socket)
+                self.sender.start()
+                print(f"Receiving and sending up to {self.batch_size} datagrams per system call\n")
+            else:
+                logging.info("Batched socket I/O is not available on this platform, using recvfrom/sendto.")
+        self.batch_receives = self.batch_received = 0
+        if self.tcp is not None:
+            print(f"Accepting DNS queries over TCP on {self.host}:{self.port}\n")
+            self.tcp.start()
         while self.running:
             try:
-                data, addr = self.server.recvfrom(512)
-                threading.Thread(target=self.handle_request, args=(data, addr)).start()
+                if self.batch_socket is not None:
+                    datagrams = self.batch_socket.recv_batch()
+                    self.batch_receives += 1
+                    self.batch_received += len(datagrams)
+                    for data, addr in datagrams:
+                        self.dispatch(data, addr)
+                    continue
+                data, addr = self.server.recvfrom(MAX_QUERY_SIZE)
+                self.dispatch(data, addr)
             except socket.error as e:
                 if not self.running:
                     break
@@ -158,20 +535,557 @@ class DNSServer:
 
     def stop(self):
         self.running = False
+        if self.sender is not None:
+            self.sender.stop()
+        if self.tcp is not None:
+            self.tcp.stop()
         self.server.close()
+        if self.pool is not None:
+            self.pool.stop()
+        self.upstream.close()
+        query_logger.close()
         print("DNS server stopped")
 
-if __name__ == "__main__":
-    setup_logging(config_file)
+# asyncio protocol for the client-facing socket of AsyncDNSServer
+class ClientProtocol(asyncio.DatagramProtocol):
+    def __init__(self, dns_server):
+        self.dns_server = dns_server
+
+    def connection_made(self, transport):
+        self.dns_server.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.dns_server.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        logging.debug(f"Socket error: {exc}")
+
+# asyncio protocol for one upstream socket. Many queries, to any of the upstream
+# servers, share the socket and are told apart by their (rewritten) DNS
+# transaction ID, the address the answer comes from and the question it repeats.
+class UpstreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.transport = None
+        self.pending = {}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if len(data) < 12:
+            return
+        txid = int.from_bytes(data[:2], 'big')
+        pending = self.pending.get(txid)
+        try:
+            matches = pending is not None and pending[1] == addr and question_bytes(data) == pending[2]
+        except IndexError:
+            matches = False
+        if not matches:
+            return
+        future = self.pending.pop(txid)[0]
+        if not future.done():
+            future.set_result(data)
+
+    def error_received(self, exc):
+        logging.debug(f"Upstream socket error: {exc}")
+
+    async def query(self, data, address, timeout):
+        txid = random.getrandbits(16)
+        while txid in self.pending:
+            txid = random.getrandbits(16)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[txid] = (future, address, question_bytes(data))
+        try:
+            self.transport.sendto(txid.to_bytes(2, 'big') + data[2:], address)
+            response = await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(txid, None)
+        # Give the client back its own transaction ID
+        return data[:2] + response[2:]
+
+# Single-threaded DNS server built on asyncio. Client and upstream traffic are both
+# handled by the event loop, so no thread is tied up while a query is in flight.
+class AsyncDNSServer:
+    def __init__(self, host='127.0.0.1', port=None, forwarder=None, upstream_sockets=4, upstream_timeout=2.0,
+                 upstream_retries=2, cache=None, reuse_port=False, tcp=True, tcp_idle_timeout=10,
+                 tcp_max_connections=128, upstream_race=False, upstream_failure_limit=3, upstream_probe_interval=10):
+        self.host = host
+        self.port = int(port) if port else 53 # Default DNS port
+        self.forwarder = forwarder if forwarder else '8.8.8.8' # Google DNS
+        self.upstream_sockets = int(upstream_sockets)
+        self.upstream_timeout = float(upstream_timeout)
+        self.upstream_retries = int(upstream_retries)
+        self.upstream_pool = UpstreamPool(parse_upstreams(self.forwarder), upstream_race, upstream_failure_limit,
+                                          upstream_probe_interval)
+        self.cache = cache
+        if cache is not None:
+            cache.refresh = self.refresh
+        self.reuse_port = reuse_port
+        self.tcp = tcp
+        self.tcp_idle_timeout = float(tcp_idle_timeout)
+        self.tcp_max_connections = int(tcp_max_connections)
+        self.latency = LatencyTracker()
+        self.timeouts = 0
+        self.failures = 0
+        self.upstream_truncated = 0
+        self.upstream_tcp_failures = 0
+        self.coalesced = 0
+        # Upstream lookups in flight by question, which queries for the same question wait for
+        self.lookups = {}
+        self.tcp_connections = 0
+        self.tcp_accepted = 0
+        self.tcp_rejected = 0
+        self.tcp_queries = 0
+        self.transport = None
+        self.tcp_server = None
+        self.upstreams = []
+        # Tasks nobody waits for: prefetches, and copies of queries still waiting for an
+        # upstream after another upstream answered
+        self.background = set()
+        self.loop = None
+        self.stopped = None
+        self.running = True
+
+    def datagram_received(self, data, addr):
+        self.handle(data, addr, lambda response: self.transport.sendto(client_reply(response, data), addr))
+
+    # Answer a query from source, passing the response to reply. Returns the task forwarding
+    # the query upstream, or None if it was answered straight away or ignored. Malformed
+    # queries (including ones whose additional section only fails once the answer is
+    # fitted to them) are dropped, as in DNSServer.handle_request.
+    def handle(self, data, source, reply):
+        started = time.perf_counter()
+        try:
+            domain, blocked = answer_locally(data)
+            if domain is None:
+                return None
+            if blocked is not None:
+                reply(blocked)
+                record_answer('blocked', domain, started)
+                return None
+            key = None
+            if self.cache is not None:
+                key = question_key(data)
+                cached = self.cache.get(key, data)
+                if cached is not None:
+                    reply(cached)
+                    record_answer('cached', domain, started)
+                    return None
+        except MalformedMessage as e:
+            logging.debug(f"Malformed DNS request from {source}: {e}")
+            return None
+        return self.loop.create_task(self.forward(data, reply, domain, key, started, source))
+
+    # Hold a reference to a task nobody awaits until it is done
+    def keep(self, task):
+        self.background.add(task)
+        task.add_done_callback(self.background.discard)
+
+    # Resolve a query upstream. Returns the answer, or None if no upstream answered. A query
+    # for a question that is already being looked up waits for that lookup instead.
+    async def fetch(self, data):
+        key = question_key(data)
+        lookup = self.lookups.get(key)
+        if lookup is not None:
+            self.coalesced += 1
+            response = await asyncio.shield(lookup)
+            return answer_for(response, data) if response is not None else None
+        lookup = self.lookups[key] = self.loop.create_future()
+        response = None
+        try:
+            response = await self.lookup(data)
+        finally:
+            del self.lookups[key]
+            lookup.set_result(response)
+        return response
+
+    async def lookup(self, data):
+        # Offer the upstream server our EDNS buffer size so fewer answers come back truncated
+        query = with_edns(data, edns_payload_size)
+        tried = []
+        for attempt in range(self.upstream_retries + 1):
+            forward_data, upstream = await self.race(query, tried)
+            if forward_data is not None:
+                break
+        else:
+            self.failures += 1
+            return None
+        if is_truncated(forward_data):
+            # Too large for UDP: ask again over TCP, or pass the truncated answer on if that fails
+            self.upstream_truncated += 1
+            tcp_data = await query_tcp_async(upstream.address, query, self.upstream_timeout)
+            if tcp_data is None:
+                self.upstream_tcp_failures += 1
+            else:
+                forward_data = tcp_data
+        return forward_data
+
+    async def forward(self, data, reply, domain, key=None, started=None, source=None):
+        try:
+            await self._forward(data, reply, domain, key, started)
+        except MalformedMessage as e:
+            logging.debug(f"Malformed DNS request from {source}: {e}")
+
+    async def _forward(self, data, reply, domain, key, started):
+        forward_data = await self.fetch_or_wait(data, key)
+        if forward_data is None:
+            logging.debug(f"No answer from {self.upstream_pool} for {domain}")
+            # Rather an expired answer than none at all (RFC 8767)
+            stale = self.cache.get_stale(key, data) if key is not None else None
+            if stale is not None:
+                reply(stale)
+                log_to_csv('Cached', domain)
+                if started is not None:
+                    server_stats.answered('stale', started)
+                return
+            reply(servfail_reply(data))
+            if started is not None:
+                server_stats.answered('servfail', started)
+            return
+        reply(forward_data)
+        log_to_csv('Forwarded', domain)
+        if started is not None:
+            server_stats.answered('forwarded', started)
+
+    # Resolve a query upstream and cache the answer. Returns None if there is none yet. When an
+    # expired answer for the question may be served stale, the client waits no longer than the
+    # cache's stale_answer_timeout (RFC 8767 client response timer) and the lookup goes on in
+    # the background, refreshing the cache when it ends.
+    async def fetch_or_wait(self, data, key):
+        if key is None:
+            return await self.fetch(data)
+        fetching = self.loop.create_task(self.fetch(data))
+
+        def store(task):
+            if not task.cancelled() and task.exception() is None and task.result() is not None:
+                self.cache.put(key, task.result())
+
+        fetching.add_done_callback(store)
+        if self.cache.stale_answer_timeout <= 0 or not self.cache.has_stale(key):
+            return await fetching
+        done, _ = await asyncio.wait({fetching}, timeout=self.cache.stale_answer_timeout)
+        if not done:
+            self.keep(fetching)
+            return None
+        return fetching.result()
+
+    # Called by the cache (on the event loop) to refresh a popular entry before it expires
+    def refresh(self, key, query):
+        self.keep(self.loop.create_task(self._refresh(key, query)))
+
+    async def _refresh(self, key, query):
+        forward_data = await self.fetch(query)
+        if forward_data is None:
+            self.cache.refresh_failed(key)
+        else:
+            self.cache.put(key, forward_data)
+
+    # Send a query to one upstream server and record how it did. Returns (answer or None, upstream).
+    async def ask(self, upstream, query):
+        # Spread in-flight queries over the upstream sockets
+        protocol = min(self.upstreams, key=lambda protocol: len(protocol.pending))
+        sent = time.monotonic()
+        try:
+            response = await protocol.query(query, upstream.address, self.upstream_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self.upstream_pool.failure(upstream, self.upstream_timeout)
+            return None, upstream
+        rtt = time.monotonic() - sent
+        self.latency.add(rtt)
+        self.upstream_pool.success(upstream, rtt)
+        return response, upstream
+
+    # Send a query to the upstream servers the pool picks (adding them to tried) and return
+    # the first answer and the upstream it came from, or (None, None) if none of them answered
+    async def race(self, query, tried):
+        chosen = self.upstream_pool.choose(tried)
+        tried.extend(chosen)
+        asking = {self.loop.create_task(self.ask(upstream, query)) for upstream in chosen}
+        while asking:
+            done, asking = await asyncio.wait(asking, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                response, upstream = task.result()
+                if response is not None:
+                    # The others keep waiting so their upstream's health is still recorded
+                    for other in asking:
+                        self.keep(other)
+                    return response, upstream
+        return None, None
+
+    # Serve one DNS over TCP connection. Queries are read as they arrive and answered
+    # as their answers become ready, so pipelined queries are resolved concurrently.
+    async def serve_tcp(self, reader, writer):
+        if self.tcp_connections >= self.tcp_max_connections:
+            self.tcp_rejected += 1
+            writer.close()
+            return
+        self.tcp_connections += 1
+        self.tcp_accepted += 1
+        peer = writer.get_extra_info('peername')
+        forwarding = set()
+
+        def reply_to(data):
+            def reply(response):
+                if not writer.is_closing():
+                    writer.write(frame(client_reply(response, data, udp=False)))
+            return reply
+
+        try:
+            while True:
+                try:
+                    header = await asyncio.wait_for(reader.readexactly(2), self.tcp_idle_timeout)
+                    data = await asyncio.wait_for(reader.readexactly(int.from_bytes(header, 'big')),
+                                                  self.tcp_idle_timeout)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                self.tcp_queries += 1
+                task = self.handle(data, f"{peer[0]}:{peer[1]} (TCP)", reply_to(data))
+                if task is not None:
+                    forwarding.add(task)
+                    task.add_done_callback(forwarding.discard)
+            # The client has sent all its queries; let the answers go out first
+            if forwarding:
+                await asyncio.wait(forwarding, timeout=self.tcp_idle_timeout)
+        finally:
+            self.tcp_connections -= 1
+            writer.close()
+
+    def get_stats(self):
+        stats = {
+            'mode': 'asyncio',
+            'upstream_in_flight': sum(len(protocol.pending) for protocol in self.upstreams),
+            'upstream_sockets': len(self.upstreams),
+            'upstream_timeouts': self.timeouts,
+            'upstream_failures': self.failures,
+            'upstream_truncated': self.upstream_truncated,
+            'upstream_tcp_failures': self.upstream_tcp_failures,
+            'upstream_coalesced': self.coalesced,
+            'upstream_lookups_in_flight': len(self.lookups),
+            'upstream': str(self.upstream_pool),
+        }
+        if self.tcp_server is not None:
+            stats.update({'tcp_connections': self.tcp_connections, 'tcp_connections_accepted': self.tcp_accepted,
+                          'tcp_connections_rejected': self.tcp_rejected, 'tcp_queries': self.tcp_queries})
+        stats.update({f"upstream_latency_{name}": value for name, value in self.latency.percentiles().items()})
+        stats['upstreams'] = self.upstream_pool.stats()
+        if self.cache is not None:
+            stats.update(self.cache.stats())
+        stats.update(query_logger.stats())
+        return stats
+
+    async def serve(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = self.loop.create_future()
+        await self.loop.create_datagram_endpoint(lambda: ClientProtocol(self), local_addr=(self.host, self.port),
+                                             reuse_port=self.reuse_port or None)
+        for _ in range(self.upstream_sockets):
+            _, protocol = await self.loop.create_datagram_endpoint(UpstreamProtocol, local_addr=('0.0.0.0', 0))
+            self.upstreams.append(protocol)
+        if self.tcp:
+            try:
+                self.tcp_server = await asyncio.start_server(self.serve_tcp, self.host, self.port,
+                                                             reuse_address=True, reuse_port=self.reuse_port or None)
+                print(f"Accepting DNS queries over TCP on {self.host}:{self.port}\n")
+            except OSError as e:
+                logging.error(f"Could not listen for DNS over TCP on port {self.port}: {e}")
+        try:
+            await self.stopped
+        finally:
+            if self.tcp_server is not None:
+                self.tcp_server.close()
+            self.transport.close()
+            for protocol in self.upstreams:
+                protocol.transport.close()
+
+    def start(self):
+        print(f"Starting asyncio DNS server on {self.host}:{self.port}")
+        print(f"Forwarding DNS requests to {self.upstream_pool} over {self.upstream_sockets} sockets"
+              f"{' (race mode)' if self.upstream_pool.race else ''}\n")
+        if logging_enabled:
+            query_logger.start()
+        asyncio.run(self.serve())
+
+    def stop(self):
+        self.running = False
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(lambda: self.stopped.done() or self.stopped.set_result(None))
+        query_logger.close()
+        print("DNS server stopped")
+
+# Function to create the DNS server for a serving mode ('threaded', 'pool' or 'asyncio') from the
+# configuration. Prefork workers pass reuse_port so they can all bind the DNS port.
+def create_dns_server(server_mode, reuse_port=False):
     dns_port = get_config_value(config_file, 'dnsPort')
     if dns_port is None:
         raise ValueError("Configuration value for 'dnsPort' is missing or invalid.")
-    dns_alternative = get_config_value(config_file, 'dnsAlternative')
+    # dnsUpstreams lists several upstream servers; without it everything goes to dnsAlternative
+    dns_alternative = get_config_value(config_file, 'dnsUpstreams') or get_config_value(config_file, 'dnsAlternative')
     if dns_alternative is None:
         raise ValueError("Configuration value for 'dnsAlternative' is missing or invalid.")
-    dns_server = DNSServer(port=dns_port, forwarder=dns_alternative)
+    upstream_race = get_config_value(config_file, 'upstreamRace', 'False') == 'True'
+    upstream_failure_limit = int(get_config_value(config_file, 'upstreamFailureLimit', 3))
+    upstream_probe_interval = float(get_config_value(config_file, 'upstreamProbeInterval', 10))
+    worker_pool_size = int(get_config_value(config_file, 'workerPoolSize', 32))
+    request_queue_size = int(get_config_value(config_file, 'requestQueueSize', 1024))
+    overload_policy = get_config_value(config_file, 'overloadPolicy', 'drop')
+    stats_interval = float(get_config_value(config_file, 'statsInterval', 0))
+    upstream_sockets = int(get_config_value(config_file, 'upstreamSockets', 4))
+    upstream_timeout = float(get_config_value(config_file, 'upstreamTimeout', 2.0))
+    upstream_retries = int(get_config_value(config_file, 'upstreamRetries', 2))
+    tcp = get_config_value(config_file, 'tcpEnabled', 'True') == 'True'
+    tcp_idle_timeout = float(get_config_value(config_file, 'tcpIdleTimeout', 10))
+    tcp_max_connections = int(get_config_value(config_file, 'tcpMaxConnections', 128))
+    cache = None
+    if get_config_value(config_file, 'cacheEnabled', 'False') == 'True':
+        cache = DNSCache(max_entries=get_config_value(config_file, 'cacheMaxEntries', 10000),
+                         max_bytes=get_config_value(config_file, 'cacheMaxBytes', 32 * 1024 * 1024),
+                         max_ttl=get_config_value(config_file, 'cacheMaxTtl', 86400),
+                         max_negative_ttl=get_config_value(config_file, 'cacheMaxNegativeTtl', 3600),
+                         prefetch_min_hits=get_config_value(config_file, 'cachePrefetchMinHits', 3),
+                         prefetch_threshold=float(get_config_value(config_file, 'cachePrefetchThreshold', 10)) / 100,
+                         stale_max_age=get_config_value(config_file, 'cacheStaleMaxAge', 0),
+                         stale_ttl=get_config_value(config_file, 'cacheStaleTtl', 30),
+                         stale_answer_timeout=get_config_value(config_file, 'cacheStaleAnswerTimeout', 1.8))
+    if server_mode == 'asyncio':
+        return AsyncDNSServer(port=dns_port, forwarder=dns_alternative,
+                              upstream_sockets=upstream_sockets, upstream_timeout=upstream_timeout,
+                              upstream_retries=upstream_retries, cache=cache, reuse_port=reuse_port,
+                              tcp=tcp, tcp_idle_timeout=tcp_idle_timeout, tcp_max_connections=tcp_max_connections,
+                              upstream_race=upstream_race, upstream_failure_limit=upstream_failure_limit,
+                              upstream_probe_interval=upstream_probe_interval)
+    return DNSServer(port=dns_port, forwarder=dns_alternative, mode=server_mode,
+                     pool_size=worker_pool_size, queue_size=request_queue_size,
+                     overload_policy=overload_policy, stats_interval=stats_interval,
+                     upstream_sockets=upstream_sockets, upstream_timeout=upstream_timeout,
+                     upstream_retries=upstream_retries, cache=cache, reuse_port=reuse_port,
+                     batch_io=get_config_value(config_file, 'batchIO', 'False') == 'True',
+                     batch_size=get_config_value(config_file, 'batchSize', 32),
+                     tcp=tcp, tcp_idle_timeout=tcp_idle_timeout, tcp_max_connections=tcp_max_connections,
+                     upstream_race=upstream_race, upstream_failure_limit=upstream_failure_limit,
+                     upstream_probe_interval=upstream_probe_interval)
+
+# Entry point of a prefork worker process (see prefork.py). The worker serves with the engine
+# set by workerServerMode, sends its counters and log rows to the parent and applies the list
+# edits and reloads the parent sends it.
+def run_worker(worker, commands, report_queue):
+    global query_logger, server_stats
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    query_logger = LogForwarder(report_queue, worker,
+                                batch_size=get_config_value(config_file, 'logBatchSize', 256),
+                                flush_interval=get_config_value(config_file, 'logFlushInterval', 1.0))
+    server_stats = ServerStats()
+    dns_server = create_dns_server(get_config_value(config_file, 'workerServerMode', 'pool'), reuse_port=True)
+
+    def follow_commands():
+        global blocked_domains
+        while True:
+            edits = commands.get()
+            with block_index_lock:
+                if edits is not None:
+                    apply_index_edits(edits)
+                    continue
+                # The parent has just rewritten the snapshot, so the worker loads it instead of parsing the lists
+                index = load_snapshot(block_list_snapshot, block_list_sources(), block_subdomains, block_list_backend)
+                if index is None:
+                    logging.error(f"Worker {worker} could not load the block list snapshot; keeping the old lists")
+                else:
+                    blocked_domains = index
+
+    def report():
+        while True:
+            time.sleep(1)
+            report_queue.put(('stats', worker, server_stats.raw(), dns_server.get_stats()))
+
+    threading.Thread(target=follow_commands, name='worker-commands', daemon=True).start()
+    threading.Thread(target=report, name='worker-stats', daemon=True).start()
+    try:
+        dns_server.start()
+    except KeyboardInterrupt:
+        dns_server.stop()
+
+# Turn SIGTERM (sent by the GUI when it stops the server) into a clean shutdown
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt
+
+# Watch the block and allow lists and reload them when they change (or on SIGHUP)
+list_reload_interval = float(get_config_value(config_file, 'listReloadInterval', 2))
+list_watcher = ListWatcher(block_list_sources, reload_block_index, list_reload_interval)
+
+# Routes of the local control API (see control.py) for a running dns_server
+def control_routes(dns_server):
+    def list_edit(edit):
+        def route(body):
+            domain = normalise_list_entry(body.get('domain'))
+            edit_block_index(edit, domain)
+            return {'domain': domain, 'blocked': parse_entry(domain)[0] in blocked_domains}
+        return route
+
+    def health(body):
+        return {'status': 'ok', 'mode': dns_server.get_stats()['mode'],
+                'uptime': round(time.time() - server_stats.started, 1),
+                'blocked_domains': len(blocked_domains), 'list_reloads': list_watcher.reloads}
+
+    def stats(body):
+        index = blocked_domains
+        return {'requests': server_stats.stats(), 'server': dns_server.get_stats(),
+                'block_list': {section: len(getattr(index, section)) for section in SECTIONS}}
+
+    def reload(body):
+        list_watcher.trigger()
+        return {'status': 'reloading'}
+
+    return {
+        ('GET', '/health'): health,
+        ('GET', '/stats'): stats,
+        ('POST', '/blocklist'): list_edit(block_domain),
+        ('DELETE', '/blocklist'): list_edit(unblock_domain),
+        ('POST', '/allowlist'): list_edit(allow_domain),
+        ('DELETE', '/allowlist'): list_edit(disallow_domain),
+        ('POST', '/reload'): reload,
+    }
+
+if __name__ == "__main__":
+    if '--compile-blocklist' in sys.argv[1:]:
+        # The snapshot is brought up to date when the block list index loads above
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, lambda signum, frame: list_watcher.trigger())
+    setup_logging(config_file)
+    server_mode = get_config_value(config_file, 'serverMode', 'pool')
+    if server_mode == 'prefork':
+        # Workers are forked before the parent starts any threads
+        dns_server = PreforkServer(run_worker, get_config_value(config_file, 'workerProcesses', 0),
+                                   on_log=query_logger.log_rows, on_stats=server_stats.update_worker,
+                                   stats_interval=get_config_value(config_file, 'statsInterval', 0))
+        dns_server.spawn()
+        index_listeners.append(dns_server.broadcast)
+        if logging_enabled:
+            query_logger.start()
+    else:
+        dns_server = create_dns_server(server_mode)
+    list_watcher.start()
+
+    control_port = int(get_config_value(config_file, 'controlPort', 0))
+    control_server = None
+    if control_port > 0:
+        control_token_file = os.path.join(os.path.dirname(__file__),
+                                          get_config_value(config_file, 'controlTokenFile', '../etc/control.token'))
+        try:
+            control_server = ControlServer(control_routes(dns_server), load_token(control_token_file),
+                                           get_config_value(config_file, 'controlHost', '127.0.0.1'), control_port)
+            control_server.start()
+        except (OSError, ValueError) as e:
+            logging.error(f"Could not start the control API on port {control_port}: {e}")
+            control_server = None
 
     try:
         dns_server.start()
     except KeyboardInterrupt:
+        if control_server is not None:
+            control_server.stop()
         dns_server.stop()
+        query_logger.close()
@@ -0,0 +1,85 @@
+import bisect
+import threading
+import time
+
+# Upper bounds (in milliseconds) of the request latency histogram buckets; the
+# last bucket counts everything slower
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+# Live request counters shared by every engine. Each answered request is
+# recorded once with its outcome and how long it took from receiving the query
+# to sending the answer, so counts and latencies can be read at any time
+# without scanning the query log. In prefork mode the parent's instance also
+# holds the latest counters reported by each worker process and adds them up.
+class ServerStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counts = {'queries': 0, 'blocked': 0, 'forwarded': 0, 'cached': 0, 'stale': 0, 'servfail': 0,
+                       'truncated': 0}
+        self.histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.latency_total = 0.0
+        self.workers = {}
+
+    # Count a query as soon as it is received
+    def received(self):
+        with self.lock:
+            self.counts['queries'] += 1
+
+    # Record the outcome ('blocked', 'forwarded', 'cached', 'stale' or 'servfail') of a
+    # query received at started (a time.perf_counter() value)
+    def answered(self, outcome, started):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        bucket = bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)
+        with self.lock:
+            self.counts[outcome] += 1
+            self.histogram[bucket] += 1
+            self.latency_total += elapsed_ms
+
+    # Count an answer that was too large for UDP and went out truncated
+    def truncated(self):
+        with self.lock:
+            self.counts['truncated'] += 1
+
+    # Latency percentile estimated from the histogram (upper bound of the bucket)
+    def _percentile(self, histogram, total, fraction):
+        target = total * fraction
+        seen = 0
+        for index, count in enumerate(histogram):
+            seen += count
+            if seen >= target:
+                return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else None
+        return None
+
+    # Raw counters, as sent from a worker process to the parent
+    def raw(self):
+        with self.lock:
+            return {'counts': dict(self.counts), 'histogram': list(self.histogram), 'latency_total': self.latency_total}
+
+    # Store the latest raw counters of a worker process
+    def update_worker(self, worker, raw):
+        with self.lock:
+            self.workers[worker] = raw
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+            histogram = list(self.histogram)
+            latency_total = self.latency_total
+            for raw in self.workers.values():
+                for name, count in raw['counts'].items():
+                    counts[name] += count
+                histogram = [total + count for total, count in zip(histogram, raw['histogram'])]
+                latency_total += raw['latency_total']
+        answered = sum(histogram)
+        stats = dict(counts)
+        stats['uptime'] = round(time.time() - self.started, 1)
+        stats['latency_histogram_ms'] = {
+            **{f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, histogram)},
+            'inf': histogram[-1],
+        }
+        if answered:
+            stats['latency_mean_ms'] = round(latency_total / answered, 3)
+            stats['latency_p50_ms'] = self._percentile(histogram, answered, 0.5)
+            stats['latency_p99_ms'] = self._percentile(histogram, answered, 0.99)
+        return stats
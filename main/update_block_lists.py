@@ -1,34 +1,134 @@
+import argparse
+import json
 import os
-import requests
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Define the paths
 block_list_file = os.path.join(os.path.dirname(__file__), '../etc/block_lists.txt')
 output_folder = os.path.join(os.path.dirname(__file__), '../etc/block_lists')
+# ETag/Last-Modified of each downloaded list, kept outside the block list folder so the
+# server does not read it as a list
+state_file = os.path.join(os.path.dirname(__file__), '../etc/block_lists.state.json')
+
+# Lists are fetched in parallel over one pooled session. Each request carries the
+# validators from the last download (If-None-Match/If-Modified-Since), so a list
+# that has not changed costs a 304 and leaves the file (and the server's compiled
+# snapshot) untouched. Bodies are streamed to a hidden temporary file next to the
+# target and renamed over it once complete, so the server never sees a partial
+# list. Connection errors and 429/5xx answers are retried with backoff.
 
-# Ensure the output folder exists
-os.makedirs(output_folder, exist_ok=True)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
 
 # Function to sanitize filenames
 def sanitize_filename(url):
     return re.sub(r'[\\/*?:"<>|]', '_', url)
 
-# Read the block list file
-with open(block_list_file, 'r') as file:
-    urls = file.readlines()
-
-# Fetch each URL and save the result
-for url in urls:
-    url = url.strip()
-    if url:
-        sanitized_url = sanitize_filename(url)
-        output_file = os.path.join(output_folder, f"{sanitized_url}.txt")
-        try:
-            print(f"Fetching {url}...")
-            response = requests.get(url)
+def read_urls(path):
+    with open(path, 'r') as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith('#')]
+
+def load_state(path):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def save_state(path, state):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+    os.replace(temporary, path)
+
+def make_session(workers=8, retries=3, backoff=0.5):
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                  allowed_methods=frozenset(['GET']), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Download one list if it changed. Returns (result, state entry) where result is
+# 'updated', 'unchanged' or 'failed'.
+def fetch_list(session, url, output_file, previous, timeout=30):
+    headers = {}
+    # Only ask for a conditional answer if we still have the file it refers to
+    if previous and os.path.isfile(output_file):
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+    temporary = os.path.join(os.path.dirname(output_file), f".{os.path.basename(output_file)}.tmp")
+    try:
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            if response.status_code == 304:
+                return 'unchanged', previous
             response.raise_for_status()  # Raise an error for bad status codes
-            with open(output_file, 'w', encoding='utf-8') as out_file:
-                out_file.write(response.text)
-            print(f"Saved {url} to {output_file}")
-        except requests.RequestException as e:
-            print(f"Failed to fetch {url}: {e}")
\ No newline at end of file
+            with open(temporary, 'wb') as out_file:
+                for chunk in response.iter_content(chunk_size=1 << 16):
+                    out_file.write(chunk)
+            os.replace(temporary, output_file)
+            return 'updated', {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'file': os.path.basename(output_file),
+                'fetched': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+    except (requests.RequestException, OSError) as e:
+        print(f"Failed to fetch {url}: {e}")
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        return 'failed', previous
+
+# Fetch every URL into output_folder. Returns {url: result}.
+def update_block_lists(urls, output_folder, state_file, workers=8, timeout=30, retries=3, backoff=0.5, session=None):
+    os.makedirs(output_folder, exist_ok=True)
+    state = load_state(state_file)
+    session = session or make_session(workers, retries, backoff)
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for url in urls:
+            output_file = os.path.join(output_folder, f"{sanitize_filename(url)}.txt")
+            print(f"Fetching {url}...")
+            futures[executor.submit(fetch_list, session, url, output_file, state.get(url), timeout)] = (url, output_file)
+        for future in as_completed(futures):
+            url, output_file = futures[future]
+            result, entry = future.result()
+            results[url] = result
+            if entry:
+                state[url] = entry
+            if result == 'updated':
+                print(f"Saved {url} to {output_file}")
+            elif result == 'unchanged':
+                print(f"{url} has not changed")
+    save_state(state_file, state)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download the block lists listed in etc/block_lists.txt.")
+    parser.add_argument('--list', default=block_list_file, help="file with one block list URL per line")
+    parser.add_argument('--output', default=output_folder, help="folder the lists are saved to")
+    parser.add_argument('--state', default=state_file, help="file the ETag/Last-Modified of each list is kept in")
+    parser.add_argument('--workers', type=int, default=8, help="number of lists downloaded at once")
+    parser.add_argument('--timeout', type=float, default=30, help="seconds to wait for a server to respond")
+    parser.add_argument('--retries', type=int, default=3, help="times to retry a failed download")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    results = update_block_lists(read_urls(args.list), args.output, args.state, workers=args.workers,
+                                 timeout=args.timeout, retries=args.retries)
+    counts = {result: list(results.values()).count(result) for result in ('updated', 'unchanged', 'failed')}
+    print(f"{counts['updated']} updated, {counts['unchanged']} unchanged, {counts['failed']} failed "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 1 if counts['failed'] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,141 @@
+import random
+import socket
+import threading
+import time
+import logging
+
+# Picks the upstream DNS server for each forwarded query out of the configured
+# list (dnsUpstreams). Every upstream keeps an exponentially weighted moving
+# average (EWMA) of its round-trip time, with timeouts counted as a sample of
+# the full timeout, and a count of the queries it failed in a row.
+#
+# Queries go to the healthy upstream with the lowest average; an upstream that
+# has never been asked is tried first, and one still waiting for its first
+# answer is passed over. Retries of a query prefer upstreams it has not been
+# sent to yet. In race mode every query goes to the two best and the first
+# answer wins. An upstream that fails failure_limit queries in a row is
+# ejected: it gets no queries until probe_interval seconds have passed, after
+# which the next query is also sent to it as a probe. An answer brings it back,
+# another timeout ejects it for a further interval. If every upstream is
+# ejected, queries go to the one due back first.
+#
+# So that an upstream that was slow for a while gets the chance to show it is
+# fast again, a small share of queries (explore) is also sent to one of the
+# other healthy upstreams; the first answer still wins, so this costs no time.
+
+# Parse 'host[:port], host[:port], ...' into a list of (host, port)
+def parse_upstreams(value, default_port=53):
+    upstreams = []
+    for item in str(value).replace(';', ',').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(':')
+        try:
+            upstreams.append((host, int(port) if port else default_port))
+        except ValueError:
+            raise ValueError(f"Invalid upstream DNS server '{item}'. Expected host or host:port.") from None
+    if not upstreams:
+        raise ValueError("No upstream DNS servers are configured.")
+    return upstreams
+
+class Upstream:
+    def __init__(self, host, port=53):
+        self.address = (socket.gethostbyname(host), int(port))
+        self.rtt = None
+        self.failures = 0
+        self.ejected_until = 0
+        self.probing = False
+        self.queries = 0
+        self.answers = 0
+        self.timeouts = 0
+        self.ejections = 0
+
+    def __str__(self):
+        return f"{self.address[0]}:{self.address[1]}"
+
+class UpstreamPool:
+    def __init__(self, upstreams, race=False, failure_limit=3, probe_interval=10, smoothing=0.3, explore=0.05):
+        self.upstreams = [Upstream(host, port) for host, port in upstreams]
+        self.race = race
+        self.failure_limit = max(1, int(failure_limit))
+        self.probe_interval = float(probe_interval)
+        self.smoothing = float(smoothing)
+        self.explore = float(explore)
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return ', '.join(str(upstream) for upstream in self.upstreams)
+
+    # Expected round-trip time of upstream, for ordering
+    def _expected_rtt(self, upstream):
+        if upstream.rtt is not None:
+            return upstream.rtt
+        return 0 if not upstream.queries else float('inf')
+
+    # Return the upstreams to send a query to, best first; tried holds the upstreams
+    # earlier attempts of the same query went to
+    def choose(self, tried=()):
+        now = time.monotonic()
+        with self.lock:
+            healthy = [upstream for upstream in self.upstreams if not upstream.ejected_until]
+            healthy.sort(key=lambda upstream: (upstream in tried, self._expected_rtt(upstream)))
+            chosen = healthy[:2 if self.race else 1]
+            if not chosen:
+                chosen = [min(self.upstreams, key=lambda upstream: upstream.ejected_until)]
+            elif len(healthy) > len(chosen) and random.random() < self.explore:
+                chosen.append(random.choice(healthy[len(chosen):]))
+            for upstream in self.upstreams:
+                if upstream.ejected_until and upstream.ejected_until <= now and not upstream.probing \
+                        and upstream not in chosen:
+                    upstream.probing = True
+                    chosen.append(upstream)
+            for upstream in chosen:
+                upstream.queries += 1
+            return chosen
+
+    def _sample(self, upstream, seconds):
+        if upstream.rtt is None:
+            upstream.rtt = seconds
+        else:
+            upstream.rtt += self.smoothing * (seconds - upstream.rtt)
+
+    # Record an answer from upstream that took rtt seconds
+    def success(self, upstream, rtt):
+        with self.lock:
+            self._sample(upstream, rtt)
+            upstream.answers += 1
+            upstream.failures = 0
+            if upstream.ejected_until:
+                upstream.ejected_until = 0
+                upstream.probing = False
+                logging.info(f"Upstream DNS server {upstream} is answering again")
+
+    # Record a query upstream did not answer within timeout seconds
+    def failure(self, upstream, timeout):
+        with self.lock:
+            self._sample(upstream, timeout)
+            upstream.timeouts += 1
+            upstream.failures += 1
+            if upstream.ejected_until:
+                upstream.ejected_until = time.monotonic() + self.probe_interval
+                upstream.probing = False
+            elif upstream.failures >= self.failure_limit:
+                upstream.ejected_until = time.monotonic() + self.probe_interval
+                upstream.ejections += 1
+                logging.warning(f"Upstream DNS server {upstream} failed {upstream.failures} queries in a row; "
+                                f"ejecting it for {self.probe_interval:g} seconds")
+
+    def stats(self):
+        now = time.monotonic()
+        with self.lock:
+            return [{
+                'address': str(upstream),
+                'rtt_ms': round(upstream.rtt * 1000, 3) if upstream.rtt is not None else None,
+                'healthy': not upstream.ejected_until,
+                'ejected_for': round(max(0, upstream.ejected_until - now), 1) if upstream.ejected_until else 0,
+                'queries': upstream.queries,
+                'answers': upstream.answers,
+                'timeouts': upstream.timeouts,
+                'ejections': upstream.ejections,
+            } for upstream in self.upstreams]
@@ -0,0 +1,80 @@
+import queue
+import threading
+import logging
+
+# Bounded pool of long-lived worker threads fed from a request queue.
+# Used by DNSServer instead of starting a new thread for every datagram.
+class WorkerPool:
+    def __init__(self, handler, size=32, queue_size=1024, name='dns-worker'):
+        self.handler = handler
+        self.size = int(size)
+        self.queue = queue.Queue(maxsize=int(queue_size))
+        self.name = name
+        self.threads = []
+        self.busy = 0
+        self.peak_busy = 0
+        self.peak_depth = 0
+        self.submitted = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.size):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    # Queue a job for the workers. Returns False if the queue is full so the
+    # caller can apply its overload policy.
+    def submit(self, *args):
+        try:
+            self.queue.put_nowait(args)
+        except queue.Full:
+            with self.lock:
+                self.rejected += 1
+            return False
+        with self.lock:
+            self.submitted += 1
+            depth = self.queue.qsize()
+            if depth > self.peak_depth:
+                self.peak_depth = depth
+        return True
+
+    def _run(self):
+        while True:
+            args = self.queue.get()
+            if args is None:
+                break
+            with self.lock:
+                self.busy += 1
+                if self.busy > self.peak_busy:
+                    self.peak_busy = self.busy
+            try:
+                self.handler(*args)
+            except Exception as e:
+                logging.error(f"Unhandled error in worker: {e}")
+            finally:
+                with self.lock:
+                    self.busy -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'pool_size': self.size,
+                'busy_workers': self.busy,
+                'peak_busy_workers': self.peak_busy,
+                'queue_depth': self.queue.qsize(),
+                'queue_capacity': self.queue.maxsize,
+                'peak_queue_depth': self.peak_depth,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+            }
+
+    def stop(self):
+        for _ in self.threads:
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                # Workers are daemon threads; they die with the process
+                break
+        self.threads = []
@@ -1,42 +1,16 @@
 import os
-import subprocess
-# import time
+import sys
 
-def nslookup(domain):
-    try:
-        result = subprocess.run(['nslookup', domain, '127.0.0.1'], capture_output=True, text=True)
-        return result.stdout
-    except Exception as e:
-        return str(e)
+# Check that every domain in the block lists is blocked. The names are sent once each
+# over UDP to a DNS server started with the configured lists and a fake upstream
+# server (see bench/loadgen.py, which also measures throughput and latency).
+#
+#     python test_blocking.py [--qps 5000] [--mode asyncio] [other bench/loadgen.py options]
 
-def process_block_list_file(filepath):
-    with open(filepath, 'r') as file:
-        for line in file:
-            if line.startswith('0.0.0.0'):
-                domain = line.split()[1].strip()
-                print(f"Performing nslookup for: {domain}")
-                lookup_result = nslookup(domain)
-                print(lookup_result)
-                # time.sleep(1)
-
-def process_block_lists_directory(directory):
-    if not os.path.isdir(directory):
-        raise FileNotFoundError(f"The directory {directory} does not exist.")
-    
-    for filename in os.listdir(directory):
-        filepath = os.path.join(directory, filename)
-        if os.path.isfile(filepath):
-            process_block_list_file(filepath)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench'))
+import loadgen
 
 if __name__ == "__main__":
-    # Start the server.py script
-    server_script_path = os.path.join(os.path.dirname(__file__), './main/server.py')
-    server_process = subprocess.Popen(['python', server_script_path])
-
-    try:
-        block_lists_directory = os.path.join(os.path.dirname(__file__), './etc/block_lists')
-        process_block_lists_directory(block_lists_directory)
-    finally:
-        # Stop the server.py script
-        server_process.terminate()
-        server_process.wait()
\ No newline at end of file
+    block_lists_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'etc', 'block_lists')
+    sys.exit(loadgen.main(['--domains', block_lists_directory, '--once', '--qps', '5000', '--max-loss', '0']
+                          + sys.argv[1:]))
@@ -0,0 +1,22 @@
+import os
+import sys
+
+import pytest
+
+# The server modules live in main/ and import each other as top-level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'main'))
+
+# Stands in for time.monotonic so tests can move time forward
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock():
+    return Clock()
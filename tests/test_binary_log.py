@@ -0,0 +1,84 @@
+import gzip
+import shutil
+
+import pytest
+
+from binary_log import BinaryLogWriter, BinaryLogReader, convert_csv, dictionary_path
+
+def read_rows(path):
+    reader = BinaryLogReader(path)
+    try:
+        return list(reader)
+    finally:
+        reader.close()
+
+def read_domains(path):
+    reader = BinaryLogReader(path)
+    reader.close()
+    return reader.domains
+
+def test_rows_round_trip(tmp_path):
+    path = str(tmp_path / 'q.bin')
+    rows = [(1700000000.25, 'Received', 'ads.example.com'), (1700000001.5, 'Blocked', 'ads.example.com'),
+            (1700000002.0, 'Forwarded', 'example.org'), (1700000003.0, 'Cached', 'example.org')]
+    writer = BinaryLogWriter(path)
+    writer.write_rows(rows[:2])
+    writer.write_rows(rows[2:])
+    writer.close()
+    assert read_rows(path) == rows
+    assert read_domains(path) == ['ads.example.com', 'example.org']
+
+def test_appending_keeps_domain_ids(tmp_path):
+    path = str(tmp_path / 'q.bin')
+    writer = BinaryLogWriter(path)
+    writer.write_rows([(1.0, 'Received', 'a.example.com')])
+    writer.close()
+    writer = BinaryLogWriter(path)
+    writer.write_rows([(2.0, 'Received', 'b.example.com'), (3.0, 'Blocked', 'a.example.com')])
+    writer.close()
+    assert read_rows(path) == [(1.0, 'Received', 'a.example.com'), (2.0, 'Received', 'b.example.com'),
+                               (3.0, 'Blocked', 'a.example.com')]
+
+# query_name decodes any byte as Latin-1, so a client can send names holding line breaks
+@pytest.mark.parametrize('name', ['evil\x85x.com', 'evil\nx.com', 'evil\rx.com', 'evil\x1cx.com', 'evil\x1ex.com',
+                                  'back\\slash.com', 'back\\nslash.com', 'trailing\\'])
+def test_names_with_line_breaks_round_trip(tmp_path, name):
+    path = str(tmp_path / 'q.bin')
+    writer = BinaryLogWriter(path)
+    writer.write_rows([(1.0, 'Received', name), (2.0, 'Received', 'good.com')])
+    writer.close()
+    writer = BinaryLogWriter(path)
+    writer.write_rows([(3.0, 'Blocked', name), (4.0, 'Received', 'later.com')])
+    writer.close()
+    assert read_rows(path) == [(1.0, 'Received', name), (2.0, 'Received', 'good.com'), (3.0, 'Blocked', name),
+                               (4.0, 'Received', 'later.com')]
+
+def test_entry_still_being_written_is_ignored(tmp_path):
+    path = str(tmp_path / 'q.bin')
+    writer = BinaryLogWriter(path)
+    writer.write_rows([(1.0, 'Received', 'a.example.com')])
+    writer.close()
+    with open(dictionary_path(path), 'ab') as f:
+        f.write(b'b.exa')
+    assert read_domains(path) == ['a.example.com']
+
+def test_compressed_segment_is_read(tmp_path):
+    path = str(tmp_path / 'q.bin')
+    writer = BinaryLogWriter(path)
+    writer.write_rows([(1.0, 'Received', 'a\x85b.com'), (2.0, 'Blocked', 'c.com')])
+    writer.close()
+    for source in (path, dictionary_path(path)):
+        with open(source, 'rb') as f_in, gzip.open(source + '.gz', 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    assert read_rows(path + '.gz') == [(1.0, 'Received', 'a\x85b.com'), (2.0, 'Blocked', 'c.com')]
+
+def test_csv_log_is_converted(tmp_path):
+    csv_path = tmp_path / 'q.csv'
+    csv_path.write_text("time,action,domain\n2024-05-01 18:00:00:250,Received,ads.example.com\n"
+                        "not a time,Received,skipped.com\n2024-05-01 18:00:01:000,Blocked,ads.example.com\n")
+    path = str(tmp_path / 'q.bin')
+    assert convert_csv(str(csv_path), path) == 2
+    rows = read_rows(path)
+    assert [(action, domain) for _, action, domain in rows] == [('Received', 'ads.example.com'),
+                                                               ('Blocked', 'ads.example.com')]
+    assert rows[1][0] - rows[0][0] == pytest.approx(0.75)
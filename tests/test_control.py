@@ -0,0 +1,93 @@
+import http.client
+import json
+import os
+import stat
+
+import pytest
+
+from control import ControlServer, load_token, is_loopback_origin
+
+TOKEN = 'test-token'
+
+@pytest.fixture
+def control():
+    calls = []
+
+    def block(body):
+        if 'domain' not in body:
+            raise ValueError("Missing 'domain'")
+        calls.append(body['domain'])
+        return {'blocked': body['domain']}
+
+    server = ControlServer({('GET', '/health'): lambda body: {'status': 'ok'}, ('POST', '/blocklist'): block},
+                           TOKEN, '127.0.0.1', 0)
+    server.start()
+    yield server, calls
+    server.stop()
+
+def request(server, method, path, body=None, headers=None, token=TOKEN):
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    sent = {'Content-Type': 'application/json'}
+    if token is not None:
+        sent['X-Adward-Token'] = token
+    sent.update(headers or {})
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    connection.request(method, path, body=data, headers=sent)
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+def test_request_with_token_is_answered(control):
+    server, calls = control
+    assert request(server, 'GET', '/health') == (200, {'status': 'ok'})
+    assert request(server, 'POST', '/blocklist', {'domain': 'ads.example.com'}) == (200, {'blocked': 'ads.example.com'})
+    assert calls == ['ads.example.com']
+    assert request(server, 'POST', '/blocklist', {})[0] == 400
+
+@pytest.mark.parametrize('token', [None, '', 'wrong-token'])
+def test_missing_or_wrong_token_is_refused(control, token):
+    server, calls = control
+    assert request(server, 'POST', '/blocklist', {'domain': 'ads.example.com'}, token=token)[0] == 401
+    assert calls == []
+
+def test_body_must_be_json(control):
+    server, calls = control
+    status, _ = request(server, 'POST', '/blocklist', {'domain': 'ads.example.com'},
+                        headers={'Content-Type': 'text/plain'})
+    assert status == 415
+    assert calls == []
+
+@pytest.mark.parametrize('length', ['-5', 'ten', '1.5'])
+def test_invalid_content_length_is_refused(control, length):
+    server, calls = control
+    connection = http.client.HTTPConnection('127.0.0.1', server.port, timeout=5)
+    connection.putrequest('POST', '/blocklist')
+    for name, value in (('Content-Type', 'application/json'), ('X-Adward-Token', TOKEN),
+                        ('Content-Length', length)):
+        connection.putheader(name, value)
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 400
+    connection.close()
+    assert calls == []
+
+@pytest.mark.parametrize('headers', [{'Origin': 'http://evil.example.com'}, {'Origin': 'null'},
+                                     {'Host': 'evil.example.com'}, {'Host': 'evil.example.com:5380'}])
+def test_foreign_origin_or_host_is_refused(control, headers):
+    server, calls = control
+    assert request(server, 'POST', '/blocklist', {'domain': 'ads.example.com'}, headers=headers)[0] == 403
+    assert calls == []
+
+def test_loopback_origin_is_accepted(control):
+    server, _ = control
+    assert request(server, 'GET', '/health', headers={'Origin': 'http://localhost:5380'})[0] == 200
+    assert is_loopback_origin('http://[::1]:8080')
+    assert not is_loopback_origin('http://localhost.evil.example.com')
+
+def test_token_file_is_created_private_and_reused(tmp_path):
+    path = str(tmp_path / 'control.token')
+    token = load_token(path)
+    assert len(token) >= 32
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
+    assert load_token(path) == token
@@ -0,0 +1,161 @@
+import types
+
+import dnslib
+import pytest
+
+import dns_cache
+from dns_cache import DNSCache, ENTRY_OVERHEAD
+from dns_wire import question_key
+
+def query(name='example.com', qtype='A', txid=1):
+    record = dnslib.DNSRecord.question(name, qtype)
+    record.header.id = txid
+    return record.pack()
+
+def answer(data, ttl=300, address='192.0.2.1'):
+    reply = dnslib.DNSRecord.parse(data).reply()
+    reply.add_answer(dnslib.RR(reply.q.qname, dnslib.QTYPE.A, rdata=dnslib.A(address), ttl=ttl))
+    return reply.pack()
+
+def negative(data, ttl=900, minimum=60, rcode=dnslib.RCODE.NXDOMAIN):
+    reply = dnslib.DNSRecord.parse(data).reply()
+    reply.header.rcode = rcode
+    soa = dnslib.SOA('ns.example.com', 'admin.example.com', (1, 3600, 600, 86400, minimum))
+    reply.add_auth(dnslib.RR('example.com', dnslib.QTYPE.SOA, rdata=soa, ttl=ttl))
+    return reply.pack()
+
+def ttls(data):
+    return [record.ttl for record in dnslib.DNSRecord.parse(data).rr + dnslib.DNSRecord.parse(data).auth]
+
+@pytest.fixture
+def cache(clock, monkeypatch):
+    monkeypatch.setattr(dns_cache, 'time', types.SimpleNamespace(monotonic=clock))
+    return DNSCache()
+
+def test_ttls_age_while_cached(cache, clock):
+    data = query()
+    cache.put(question_key(data), answer(data, ttl=300))
+    clock.advance(100)
+    assert ttls(cache.get(question_key(data), data)) == [200]
+
+def test_entries_expire_after_their_ttl(cache, clock):
+    data = query()
+    cache.put(question_key(data), answer(data, ttl=30))
+    clock.advance(30)
+    assert cache.get(question_key(data), data) is None
+    assert cache.stats()['cache_expirations'] == 1
+
+def test_ttl_is_capped_at_max_ttl(clock, monkeypatch):
+    monkeypatch.setattr(dns_cache, 'time', types.SimpleNamespace(monotonic=clock))
+    cache = DNSCache(max_ttl=60)
+    data = query()
+    cache.put(question_key(data), answer(data, ttl=3600))
+    clock.advance(61)
+    assert cache.get(question_key(data), data) is None
+
+def test_negative_ttl_is_the_lesser_of_soa_ttl_and_minimum(cache, clock):
+    data = query()
+    cache.put(question_key(data), negative(data, ttl=900, minimum=60))
+    clock.advance(59)
+    assert dnslib.DNSRecord.parse(cache.get(question_key(data), data)).header.rcode == dnslib.RCODE.NXDOMAIN
+    clock.advance(1)
+    assert cache.get(question_key(data), data) is None
+
+def test_nodata_answer_is_cached_negatively(cache, clock):
+    data = query()
+    cache.put(question_key(data), negative(data, ttl=30, minimum=300, rcode=dnslib.RCODE.NOERROR))
+    clock.advance(29)
+    assert cache.get(question_key(data), data) is not None
+    clock.advance(1)
+    assert cache.get(question_key(data), data) is None
+
+def test_negative_answer_without_soa_is_not_cached(cache):
+    data = query()
+    reply = dnslib.DNSRecord.parse(data).reply()
+    reply.header.rcode = dnslib.RCODE.NXDOMAIN
+    cache.put(question_key(data), reply.pack())
+    assert cache.get(question_key(data), data) is None
+    assert cache.stats()['cache_uncacheable'] == 1
+
+def test_servfail_and_truncated_answers_are_not_cached(cache):
+    data = query()
+    reply = dnslib.DNSRecord.parse(data).reply()
+    reply.header.rcode = dnslib.RCODE.SERVFAIL
+    cache.put(question_key(data), reply.pack())
+    truncated = dnslib.DNSRecord.parse(answer(data))
+    truncated.header.tc = 1
+    cache.put(question_key(data), truncated.pack())
+    assert cache.stats()['cache_entries'] == 0
+
+def test_least_recently_used_entries_are_evicted_by_bytes():
+    queries = [query(f"host{number}.example.com") for number in range(3)]
+    responses = [answer(data) for data in queries]
+    # Room for two of the three answers
+    cache = DNSCache(max_bytes=sum(len(response) + ENTRY_OVERHEAD for response in responses[:2]) + 1)
+    cache.put(question_key(queries[0]), responses[0])
+    cache.put(question_key(queries[1]), responses[1])
+    # Touch the first so the second is the least recently used
+    assert cache.get(question_key(queries[0]), queries[0]) is not None
+    cache.put(question_key(queries[2]), responses[2])
+    assert cache.get(question_key(queries[1]), queries[1]) is None
+    assert cache.get(question_key(queries[0]), queries[0]) is not None
+    assert cache.get(question_key(queries[2]), queries[2]) is not None
+    assert cache.stats()['cache_evictions'] == 1
+    assert cache.bytes <= cache.max_bytes
+
+def test_least_recently_used_entries_are_evicted_by_count():
+    cache = DNSCache(max_entries=2)
+    queries = [query(f"host{number}.example.com") for number in range(3)]
+    for data in queries:
+        cache.put(question_key(data), answer(data))
+    assert cache.get(question_key(queries[0]), queries[0]) is None
+    assert len(cache.entries) == 2
+
+def test_hit_takes_the_id_and_name_case_of_the_query(cache):
+    stored = query('example.com', txid=1)
+    cache.put(question_key(stored), answer(stored))
+    asked = query('ExAmPlE.CoM', txid=4242)
+    assert question_key(asked) == question_key(stored)
+    record = dnslib.DNSRecord.parse(cache.get(question_key(asked), asked))
+    assert record.header.id == 4242
+    assert str(record.q.qname) == 'ExAmPlE.CoM.'
+    assert str(record.rr[0].rdata) == '192.0.2.1'
+
+def test_expired_entry_is_served_stale_when_allowed(clock, monkeypatch):
+    monkeypatch.setattr(dns_cache, 'time', types.SimpleNamespace(monotonic=clock))
+    cache = DNSCache(stale_max_age=3600, stale_ttl=30)
+    data = query()
+    cache.put(question_key(data), answer(data, ttl=60))
+    clock.advance(120)
+    assert cache.get(question_key(data), data) is None
+    assert ttls(cache.get_stale(question_key(data), data)) == [30]
+    clock.advance(3600)
+    assert cache.get_stale(question_key(data), data) is None
+
+def test_has_stale_only_for_expired_entries_within_stale_max_age(clock, monkeypatch):
+    monkeypatch.setattr(dns_cache, 'time', types.SimpleNamespace(monotonic=clock))
+    cache = DNSCache(stale_max_age=3600)
+    data = query()
+    key = question_key(data)
+    assert not cache.has_stale(key)
+    cache.put(key, answer(data, ttl=60))
+    assert not cache.has_stale(key)
+    clock.advance(120)
+    assert cache.has_stale(key)
+    clock.advance(3600)
+    assert not cache.has_stale(key)
+    assert not DNSCache().has_stale(key)
+
+def test_popular_entry_is_refreshed_near_expiry(clock, monkeypatch):
+    monkeypatch.setattr(dns_cache, 'time', types.SimpleNamespace(monotonic=clock))
+    cache = DNSCache(prefetch_min_hits=2, prefetch_threshold=0.1)
+    refreshed = []
+    cache.refresh = lambda key, data: refreshed.append(key)
+    data = query()
+    cache.put(question_key(data), answer(data, ttl=100))
+    cache.get(question_key(data), data)
+    clock.advance(95)
+    cache.get(question_key(data), data)
+    cache.get(question_key(data), data)
+    # Only one refresh at a time
+    assert refreshed == [question_key(data)]
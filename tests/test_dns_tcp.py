@@ -0,0 +1,42 @@
+import socket
+import threading
+import time
+
+from dns_tcp import TCPConnection, TCPListener, frame, read_message
+
+def test_drain_waits_only_for_queries_still_to_be_answered():
+    left, right = socket.socketpair()
+    connection = TCPConnection(left, ('127.0.0.1', 5353))
+    connection.received()
+    connection.received()
+    connection.dropped()
+    threading.Timer(0.1, connection.send, args=(b'answer',)).start()
+    started = time.monotonic()
+    connection.drain(5)
+    assert time.monotonic() - started < 2
+    assert connection.pending == 0
+    assert read_message(right) == b'answer'
+    connection.close()
+    right.close()
+
+def test_connection_with_dropped_query_closes_without_waiting():
+    # Echo queries back, except 'bad' ones, which get no answer like malformed queries
+    def dispatch(data, connection):
+        if data == b'bad':
+            connection.dropped()
+        else:
+            connection.send(data)
+
+    listener = TCPListener('127.0.0.1', 0, dispatch, idle_timeout=5)
+    listener.start()
+    try:
+        client = socket.create_connection(listener.sock.getsockname(), timeout=5)
+        client.sendall(frame(b'good') + frame(b'bad'))
+        client.shutdown(socket.SHUT_WR)
+        started = time.monotonic()
+        assert read_message(client) == b'good'
+        assert read_message(client) is None
+        assert time.monotonic() - started < 2
+        client.close()
+    finally:
+        listener.stop()
@@ -0,0 +1,122 @@
+import dnslib
+import pytest
+
+from dns_wire import (BlockReply, MalformedMessage, query_name, question_key, answer_for, find_opt,
+                      udp_payload_size, with_edns, without_edns, truncated_reply, fit_response, error_reply,
+                      is_truncated, rcode, RCODE_SERVFAIL, MAX_UDP_SIZE)
+
+def query(name='example.com', qtype='A', txid=7, edns=None):
+    record = dnslib.DNSRecord.question(name, qtype)
+    record.header.id = txid
+    if edns is not None:
+        record.add_ar(dnslib.EDNS0(udp_len=edns))
+    return record.pack()
+
+# An answer to data with count address records, optionally ending in an OPT record
+def answer(data, count=1, edns=None):
+    reply = dnslib.DNSRecord.parse(data).reply()
+    reply.ar = []
+    for number in range(count):
+        reply.add_answer(dnslib.RR(reply.q.qname, dnslib.QTYPE.A, rdata=dnslib.A(f"192.0.2.{number % 250}"), ttl=60))
+    if edns is not None:
+        reply.add_ar(dnslib.EDNS0(udp_len=edns))
+    return reply.pack()
+
+def test_query_name_is_lower_case_without_trailing_dot():
+    assert query_name(query('ADS.Example.COM.')) == 'ads.example.com'
+
+@pytest.mark.parametrize('data', [b'', bytes(12), query()[:15], query()[:12] + b'\x40' + bytes(8)])
+def test_query_name_rejects_malformed_queries(data):
+    with pytest.raises(MalformedMessage):
+        query_name(data)
+
+def test_question_key_ignores_case_but_not_type():
+    assert question_key(query('Example.COM')) == question_key(query('example.com'))
+    assert question_key(query('example.com', 'AAAA')) != question_key(query('example.com'))
+
+def test_answer_for_copies_id_and_name_spelling():
+    response = answer(query('example.com', txid=1))
+    record = dnslib.DNSRecord.parse(answer_for(response, query('EXAMPLE.com', txid=99)))
+    assert record.header.id == 99
+    assert str(record.q.qname) == 'EXAMPLE.com.'
+    assert len(record.rr) == 1
+
+def test_edns_payload_size_is_read_from_the_opt_record():
+    assert find_opt(query()) is None
+    assert udp_payload_size(query()) == MAX_UDP_SIZE
+    assert udp_payload_size(query(edns=4096)) == 4096
+    # Sizes below 512 are treated as 512 (RFC 6891 section 6.2.5)
+    assert udp_payload_size(query(edns=100)) == MAX_UDP_SIZE
+
+def test_with_edns_adds_or_rewrites_the_opt_record():
+    added = with_edns(query(), 1232)
+    assert udp_payload_size(added) == 1232
+    assert dnslib.DNSRecord.parse(added).q == dnslib.DNSRecord.parse(query()).q
+    rewritten = with_edns(query(edns=4096), 1232)
+    assert udp_payload_size(rewritten) == 1232
+    assert len(rewritten) == len(query(edns=4096))
+
+def test_without_edns_removes_the_trailing_opt_record():
+    data = query()
+    stripped = without_edns(answer(data, edns=1232))
+    assert stripped == answer(data)
+    assert find_opt(stripped) is None
+
+def test_truncated_reply_keeps_header_and_question_only():
+    data = query()
+    record = dnslib.DNSRecord.parse(truncated_reply(answer(data, count=3)))
+    assert record.header.tc == 1
+    assert record.header.id == 7
+    assert record.q == dnslib.DNSRecord.parse(data).q
+    assert not record.rr
+
+def test_fit_response_strips_opt_for_clients_without_edns():
+    data = query()
+    assert find_opt(fit_response(answer(data, edns=1232), data)) is None
+    with_opt = query(edns=1232)
+    assert find_opt(fit_response(answer(with_opt, edns=1232), with_opt)) is not None
+
+def test_fit_response_truncates_answers_larger_than_the_client_can_receive():
+    data = query()
+    large = answer(data, count=40)
+    assert len(large) > MAX_UDP_SIZE
+    fitted = fit_response(large, data, 1232)
+    assert is_truncated(fitted) and len(fitted) <= MAX_UDP_SIZE
+    # Over TCP (no limit) and for an EDNS client that can take it, the answer is kept
+    assert fit_response(large, data) == large
+    edns_query = query(edns=4096)
+    edns_answer = answer(edns_query, count=40, edns=1232)
+    assert fit_response(edns_answer, edns_query, 1232) == edns_answer
+    # The server's own limit still applies
+    assert is_truncated(fit_response(answer(edns_query, count=100, edns=1232), edns_query, 1232))
+
+def test_error_reply_carries_the_question_and_rcode():
+    data = query(edns=1232)
+    reply = error_reply(data, RCODE_SERVFAIL)
+    assert rcode(reply) == RCODE_SERVFAIL
+    record = dnslib.DNSRecord.parse(reply)
+    assert record.header.id == 7 and record.header.qr == 1
+    assert record.q == dnslib.DNSRecord.parse(data).q
+    assert not record.ar
+
+@pytest.mark.parametrize('mode, rcode_value', [('nxdomain', 3), ('null', 0), ('refused', 5)])
+def test_block_reply_modes(mode, rcode_value):
+    data = query('Ads.Example.com')
+    record = dnslib.DNSRecord.parse(BlockReply(mode, ttl=60).build(data))
+    assert record.header.rcode == rcode_value
+    assert record.header.aa == 1 and record.header.id == 7
+    assert str(record.q.qname) == 'Ads.Example.com.'
+    if mode == 'null':
+        assert str(record.rr[0].rdata) == '0.0.0.0' and record.rr[0].ttl == 60
+    else:
+        assert not record.rr
+
+def test_null_block_reply_answers_aaaa_with_unspecified_address():
+    record = dnslib.DNSRecord.parse(BlockReply('null').build(query(qtype='AAAA')))
+    assert str(record.rr[0].rdata) == '::'
+    # Other types get an empty answer
+    assert not dnslib.DNSRecord.parse(BlockReply('null').build(query(qtype='MX'))).rr
+
+def test_unknown_block_mode_is_rejected():
+    with pytest.raises(ValueError):
+        BlockReply('drop')
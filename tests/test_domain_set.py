@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from domain_matcher import DomainMatcher, LayeredSet
+from domain_set import FrontCodedDomainSet, pack_domain_set
+
+NAMES = ['ads.example.com', 'example.com', 'cdn.ads.example.com', 'tracker.example.net', 'a.b', 'x' * 60 + '.org']
+
+@pytest.mark.parametrize('block_size', [1, 2, 16])
+def test_compact_set_holds_exactly_its_names(block_size):
+    domains = FrontCodedDomainSet.from_names(NAMES, block_size)
+    assert len(domains) == len(NAMES)
+    for name in NAMES:
+        assert name in domains
+    for name in ['com', 'xample.com', 'ads.example.co', 'example.comm', 'zzz.zz', '', 'b']:
+        assert name not in domains
+    assert sorted(domains) == sorted(NAMES)
+
+def test_compact_set_agrees_with_a_python_set():
+    random.seed(3)
+    names = {f"{random.choice(['ads', 'cdn', 't'])}{random.randrange(5000)}.example{random.randrange(50)}.com"
+             for _ in range(3000)}
+    domains = FrontCodedDomainSet.from_names(names)
+    probes = list(names)[:500] + [f"miss{number}.example{number % 50}.com" for number in range(500)]
+    assert all((name in domains) == (name in names) for name in probes)
+    assert set(domains) == names
+
+def test_compact_set_reads_from_an_offset_in_a_shared_buffer():
+    first = pack_domain_set(['one.example'])
+    buffer = first + pack_domain_set(NAMES)
+    domains = FrontCodedDomainSet(buffer, len(first))
+    assert sorted(domains) == sorted(NAMES)
+    assert domains.end == len(buffer)
+
+def test_empty_compact_set():
+    domains = FrontCodedDomainSet.from_names([])
+    assert len(domains) == 0 and 'example.com' not in domains and list(domains) == []
+
+def test_layered_set_edits_leave_the_base_alone():
+    base = FrontCodedDomainSet.from_names(['a.com', 'b.com'])
+    layered = LayeredSet(base)
+    layered.add('c.com')
+    layered.discard('a.com')
+    assert 'c.com' in layered and 'a.com' not in layered and 'b.com' in layered
+    assert sorted(layered) == ['b.com', 'c.com'] and len(layered) == 2
+    layered.add('a.com')
+    assert 'a.com' in layered and not layered.removed
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_matcher_zones_and_allow_entries(compact):
+    matcher = DomainMatcher()
+    for entry in ['ads.example.com', '*.tracker.net', '*.example.org']:
+        matcher.add(entry)
+    matcher.allow('*.ok.example.org')
+    matcher.allow('fine.tracker.net')
+    if compact:
+        for section in ('blocked', 'blocked_zones', 'allowed', 'allowed_zones'):
+            setattr(matcher, section, FrontCodedDomainSet.from_names(getattr(matcher, section)))
+    assert 'ads.example.com' in matcher
+    assert 'sub.ads.example.com' not in matcher
+    assert 'tracker.net' in matcher and 'deep.sub.tracker.net' in matcher
+    assert 'fine.tracker.net' not in matcher
+    assert 'x.example.org' in matcher
+    assert 'ok.example.org' not in matcher and 'a.ok.example.org' not in matcher
+    assert 'example.com' not in matcher
+
+def test_block_subdomains_treats_every_entry_as_a_zone():
+    matcher = DomainMatcher(block_subdomains=True)
+    matcher.add('ads.example.com')
+    assert 'cdn.ads.example.com' in matcher
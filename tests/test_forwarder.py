@@ -0,0 +1,124 @@
+import socket
+import threading
+import time
+
+import dnslib
+import pytest
+
+from forwarder import UpstreamForwarder
+from upstream_pool import UpstreamPool
+
+def query(name='example.com', txid=1):
+    record = dnslib.DNSRecord.question(name)
+    record.header.id = txid
+    return record.pack()
+
+def answer(data, address='192.0.2.1'):
+    reply = dnslib.DNSRecord.parse(data).reply()
+    reply.add_answer(dnslib.RR(reply.q.qname, dnslib.QTYPE.A, rdata=dnslib.A(address), ttl=300))
+    return reply.pack()
+
+# Stands in for an upstream DNS server: respond(data) returns the datagrams to send
+# back for each query it receives, after delay seconds
+class FakeUpstream:
+    def __init__(self, respond, delay=0.0):
+        self.respond = respond
+        self.delay = delay
+        self.received = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.1)
+        self.address = self.sock.getsockname()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            try:
+                data, addr = self.sock.recvfrom(4096)
+            except OSError:
+                continue
+            self.received.append(data)
+            threading.Thread(target=self._answer, args=(data, addr), daemon=True).start()
+
+    def _answer(self, data, addr):
+        time.sleep(self.delay)
+        for response in self.respond(data):
+            self.sock.sendto(response, addr)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+@pytest.fixture
+def forwarder_for():
+    opened = []
+
+    def make(respond, delay=0.0, timeout=1.0, retries=0):
+        upstream = FakeUpstream(respond, delay)
+        forwarder = UpstreamForwarder(UpstreamPool([upstream.address], explore=0), sockets=2, timeout=timeout,
+                                      retries=retries)
+        forwarder.start()
+        opened.append((upstream, forwarder))
+        return upstream, forwarder
+
+    yield make
+    for upstream, forwarder in opened:
+        forwarder.close()
+        upstream.close()
+
+def test_answer_gets_the_callers_transaction_id(forwarder_for):
+    upstream, forwarder = forwarder_for(lambda data: [answer(data)])
+    response = forwarder.query(query(txid=0x1234))
+    record = dnslib.DNSRecord.parse(response)
+    assert record.header.id == 0x1234
+    assert str(record.rr[0].rdata) == '192.0.2.1'
+    # The upstream saw a transaction ID of the forwarder's own choosing
+    assert len(upstream.received) == 1
+
+def test_answers_with_wrong_transaction_id_or_question_are_ignored(forwarder_for):
+    def respond(data):
+        txid = int.from_bytes(data[:2], 'big')
+        other_txid = ((txid + 1) % 65536).to_bytes(2, 'big')
+        spoofed_question = answer(query('evil.example.net'), '198.51.100.1')
+        return [other_txid + answer(data, '198.51.100.1')[2:],
+                data[:2] + spoofed_question[2:],
+                answer(data)]
+
+    _, forwarder = forwarder_for(respond)
+    response = forwarder.query(query())
+    assert str(dnslib.DNSRecord.parse(response).rr[0].rdata) == '192.0.2.1'
+    assert forwarder.stats()['upstream_mismatched'] == 2
+
+def test_no_answer_returns_none_after_retries(forwarder_for):
+    upstream, forwarder = forwarder_for(lambda data: [], timeout=0.2, retries=1)
+    assert forwarder.query(query()) is None
+    assert len(upstream.received) == 2
+    assert forwarder.stats()['upstream_failures'] == 1
+
+def test_concurrent_queries_for_one_question_share_a_lookup(forwarder_for):
+    upstream, forwarder = forwarder_for(lambda data: [answer(data)], delay=0.3)
+    results = {}
+
+    def ask(txid, name):
+        results[txid] = forwarder.query(query(name, txid))
+
+    threads = [threading.Thread(target=ask, args=(txid, 'Example.COM' if txid % 2 else 'example.com'))
+               for txid in range(1, 9)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(upstream.received) == 1
+    assert forwarder.stats()['upstream_coalesced'] == 7
+    for txid, response in results.items():
+        record = dnslib.DNSRecord.parse(response)
+        # Every client gets its own transaction ID and the name as it asked for it
+        assert record.header.id == txid
+        assert str(record.q.qname) == ('Example.COM.' if txid % 2 else 'example.com.')
+        assert str(record.rr[0].rdata) == '192.0.2.1'
+    # The next query after the lookup is sent again
+    forwarder.query(query())
+    assert len(upstream.received) == 2
@@ -0,0 +1,49 @@
+import pytest
+
+from list_ingest import parse_line, normalise_name, unique
+
+@pytest.mark.parametrize('line, entries', [
+    # Hosts files
+    ('0.0.0.0 ads.example.com', ['ads.example.com']),
+    ('127.0.0.1 Ads.Example.COM. # tracker', ['ads.example.com']),
+    ('0.0.0.0 one.example.com two.example.com', ['one.example.com', 'two.example.com']),
+    ('::1 ip6.example.com', ['ip6.example.com']),
+    ('0.0.0.0 localhost', []),
+    ('127.0.0.1 localhost.localdomain', []),
+    ('192.168.1.10 printer.lan', []),
+    # Plain domain lists
+    ('tracker.example.com', ['tracker.example.com']),
+    ('tracker.example.com # comment', ['tracker.example.com']),
+    # Zones
+    ('*.example.net', ['*.example.net']),
+    ('*.EXAMPLE.net.', ['*.example.net']),
+    # AdBlock rules
+    ('||ads.example.org^', ['*.ads.example.org']),
+    ('||ads.example.org^$important', ['*.ads.example.org']),
+    ('||ads.example.org^$third-party', []),
+    ('||ads.example.org/path', []),
+    ('@@||allowed.example.org^', []),
+    # Comments, headers and blank lines
+    ('# comment', []),
+    ('! AdBlock comment', []),
+    ('[Adblock Plus 2.0]', []),
+    ('', []),
+    ('   ', []),
+    # Not names
+    ('1.2.3.4', []),
+    ('bad_label!.example.com', []),
+])
+def test_parse_line(line, entries):
+    assert parse_line(line) == entries
+
+def test_internationalised_names_are_punycoded():
+    assert normalise_name('bücher.example') == 'xn--bcher-kva.example'
+
+def test_overlong_names_are_rejected():
+    assert normalise_name('.'.join(['a' * 63] * 4)) is None
+    assert normalise_name('a' * 64 + '.com') is None
+
+@pytest.mark.parametrize('chunk_size', [2, 1000])
+def test_unique_keeps_one_of_each_entry(chunk_size):
+    entries = ['b.com', 'a.com', 'b.com', 'c.com', 'a.com', '*.d.com']
+    assert sorted(unique(iter(entries), chunk_size)) == ['*.d.com', 'a.com', 'b.com', 'c.com']
@@ -0,0 +1,47 @@
+import os
+import time
+
+from list_watcher import ListWatcher
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+def touch(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+    # Make sure the mtime moves even on filesystems with coarse timestamps
+    info = os.stat(path)
+    os.utime(path, ns=(info.st_atime_ns, info.st_mtime_ns + 1000000000))
+
+def test_external_change_reloads(tmp_path):
+    path = str(tmp_path / 'list.txt')
+    touch(path, "0.0.0.0 a.example.com\n")
+    watcher = ListWatcher(lambda: [path], lambda: None, interval=0.05)
+    watcher.start()
+    try:
+        touch(path, "0.0.0.0 b.example.com\n")
+        assert wait_for(lambda: watcher.reloads == 1)
+    finally:
+        watcher.stop()
+
+def test_acknowledged_change_does_not_reload(tmp_path):
+    own = str(tmp_path / 'custom.txt')
+    other = str(tmp_path / 'other.txt')
+    touch(own, "0.0.0.0 a.example.com\n")
+    touch(other, "0.0.0.0 b.example.com\n")
+    watcher = ListWatcher(lambda: [own, other], lambda: None, interval=0.05)
+    watcher.start()
+    try:
+        touch(own, "0.0.0.0 c.example.com\n")
+        watcher.acknowledge([own])
+        time.sleep(0.3)
+        assert watcher.reloads == 0
+        # Files the server did not write are still watched
+        touch(other, "0.0.0.0 d.example.com\n")
+        watcher.acknowledge([own])
+        assert wait_for(lambda: watcher.reloads == 1)
+    finally:
+        watcher.stop()
@@ -0,0 +1,48 @@
+import os
+import time
+
+import pytest
+
+from query_logger import QueryLogger, find_segments, iter_log_rows, read_manifest, manifest_path, scan_log_file
+
+def write_rows(path, rows, log_format):
+    logger = QueryLogger(path, log_format=log_format)
+    logger._open()
+    logger.writer.write_rows(rows)
+    logger.writer.close()
+    return logger.path
+
+@pytest.mark.parametrize('log_format', ['csv', 'binary'])
+def test_scan_reads_time_range_and_row_count(tmp_path, log_format):
+    now = time.time()
+    path = write_rows(str(tmp_path / 'q.csv'), [(now - 60, 'Received', 'a'), (now - 30, 'Blocked', 'a'),
+                                               (now, 'Received', 'b')], log_format)
+    first, last, rows = scan_log_file(path, log_format)
+    assert rows == 3
+    assert first == pytest.approx(now - 60, abs=0.002)
+    assert last == pytest.approx(now, abs=0.002)
+    assert scan_log_file(str(tmp_path / 'missing.csv'), log_format) == (None, None, 0)
+
+@pytest.mark.parametrize('log_format', ['csv', 'binary'])
+def test_continued_log_is_rotated_with_its_real_time_range(tmp_path, log_format):
+    now = time.time()
+    rows = [(now - 7200, 'Received', 'old'), (now - 3600, 'Received', 'older'), (now - 60, 'Received', 'recent')]
+    path = write_rows(str(tmp_path / 'q.csv'), rows, log_format)
+    # The first row is older than the rotation interval, so the file is rotated on start
+    logger = QueryLogger(str(tmp_path / 'q.csv'), rotate_interval=5000, retention_days=30, compression='none',
+                         log_format=log_format)
+    logger.start()
+    deadline = time.time() + 5
+    while not read_manifest(manifest_path(path))['segments'] and time.time() < deadline:
+        time.sleep(0.05)
+    logger.running = False
+    logger.wake.set()
+    logger.thread.join()
+    segment, = read_manifest(manifest_path(path))['segments']
+    assert segment['rows'] == 3
+    assert segment['start'] == pytest.approx(now - 7200, abs=0.002)
+    assert segment['end'] == pytest.approx(now - 60, abs=0.002)
+    # Still found by time, and not deleted by the 30 day retention
+    assert os.path.exists(os.path.join(str(tmp_path), segment['file']))
+    assert find_segments(path, now - 100, now)
+    assert [row[2] for row in iter_log_rows(path, now - 100, now)] == ['recent']
@@ -0,0 +1,99 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from update_block_lists import update_block_lists, sanitize_filename
+
+LIST = b"0.0.0.0 ads.example.com\n0.0.0.0 tracker.example.com\n"
+ETAG = '"v1"'
+LAST_MODIFIED = 'Sat, 01 Jun 2024 12:00:00 GMT'
+
+# Stands in for a block list host. Each path answers with the next of its queued
+# responses (the last one repeats); every request's headers are recorded.
+class ListHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        queue = self.server.responses[self.path]
+        status, body = queue.pop(0) if len(queue) > 1 else queue[0]
+        if status == 200 and (self.headers.get('If-None-Match') == ETAG
+                              or self.headers.get('If-Modified-Since') == LAST_MODIFIED):
+            self.send_response(304)
+            self.end_headers()
+            return
+        truncated = status == 'truncated'
+        self.send_response(200 if truncated else status)
+        self.send_header('ETag', ETAG)
+        self.send_header('Last-Modified', LAST_MODIFIED)
+        # A truncated answer promises more than it sends, then hangs up half-way
+        self.send_header('Content-Length', str(len(body) * 2 if truncated else len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if truncated:
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def list_server():
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), ListHandler)
+    httpd.daemon_threads = True
+    httpd.requests = []
+    httpd.responses = {}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def url_of(httpd, path):
+    return f"http://127.0.0.1:{httpd.server_address[1]}{path}"
+
+def run(tmp_path, url):
+    return update_block_lists([url], str(tmp_path / 'lists'), str(tmp_path / 'state.json'), workers=1,
+                              timeout=5, retries=3, backoff=0)
+
+def output_file(tmp_path, url):
+    return tmp_path / 'lists' / f"{sanitize_filename(url)}.txt"
+
+def test_download_saves_list_and_validators(list_server, tmp_path):
+    url = url_of(list_server, '/hosts.txt')
+    list_server.responses['/hosts.txt'] = [(200, LIST)]
+    assert run(tmp_path, url) == {url: 'updated'}
+    assert output_file(tmp_path, url).read_bytes() == LIST
+    state = json.loads((tmp_path / 'state.json').read_text())
+    assert state[url]['etag'] == ETAG
+    assert state[url]['last_modified'] == LAST_MODIFIED
+
+def test_unchanged_list_is_not_rewritten(list_server, tmp_path):
+    url = url_of(list_server, '/hosts.txt')
+    list_server.responses['/hosts.txt'] = [(200, LIST)]
+    run(tmp_path, url)
+    path = output_file(tmp_path, url)
+    os.utime(path, ns=(0, 0))
+    assert run(tmp_path, url) == {url: 'unchanged'}
+    headers = list_server.requests[-1][1]
+    assert headers['If-None-Match'] == ETAG
+    assert headers['If-Modified-Since'] == LAST_MODIFIED
+    assert path.read_bytes() == LIST
+    assert os.stat(path).st_mtime_ns == 0
+
+def test_server_errors_are_retried(list_server, tmp_path):
+    url = url_of(list_server, '/hosts.txt')
+    list_server.responses['/hosts.txt'] = [(503, b'busy'), (502, b'bad gateway'), (200, LIST)]
+    assert run(tmp_path, url) == {url: 'updated'}
+    assert len(list_server.requests) == 3
+    assert output_file(tmp_path, url).read_bytes() == LIST
+
+def test_failed_transfer_keeps_the_old_list(list_server, tmp_path):
+    url = url_of(list_server, '/hosts.txt')
+    path = output_file(tmp_path, url)
+    path.parent.mkdir()
+    path.write_bytes(b"0.0.0.0 old.example.com\n")
+    list_server.responses['/hosts.txt'] = [('truncated', LIST)]
+    assert run(tmp_path, url) == {url: 'failed'}
+    assert path.read_bytes() == b"0.0.0.0 old.example.com\n"
+    assert os.listdir(path.parent) == [path.name]
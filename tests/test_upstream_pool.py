@@ -0,0 +1,77 @@
+import types
+
+import pytest
+
+import upstream_pool
+from upstream_pool import UpstreamPool, parse_upstreams
+
+FIRST = ('127.0.0.1', 5301)
+SECOND = ('127.0.0.1', 5302)
+
+@pytest.fixture
+def pool(clock, monkeypatch):
+    monkeypatch.setattr(upstream_pool, 'time', types.SimpleNamespace(monotonic=clock))
+    return UpstreamPool([FIRST, SECOND], failure_limit=3, probe_interval=10, explore=0)
+
+def addresses(upstreams):
+    return [upstream.address for upstream in upstreams]
+
+def by_address(pool, address):
+    return next(upstream for upstream in pool.upstreams if upstream.address == address)
+
+def test_parse_upstreams():
+    assert parse_upstreams('1.1.1.1, 9.9.9.9:5353;8.8.8.8') == [('1.1.1.1', 53), ('9.9.9.9', 5353), ('8.8.8.8', 53)]
+    with pytest.raises(ValueError):
+        parse_upstreams('1.1.1.1:dns')
+    with pytest.raises(ValueError):
+        parse_upstreams(' , ')
+
+def test_fastest_upstream_is_chosen_and_retries_go_elsewhere(pool):
+    first, second = by_address(pool, FIRST), by_address(pool, SECOND)
+    pool.success(first, 0.050)
+    pool.success(second, 0.010)
+    assert addresses(pool.choose()) == [SECOND]
+    assert addresses(pool.choose([second])) == [FIRST]
+
+def test_failing_upstream_is_ejected_and_probed_back(pool, clock):
+    first, second = by_address(pool, FIRST), by_address(pool, SECOND)
+    pool.success(first, 0.010)
+    pool.success(second, 0.050)
+    for _ in range(3):
+        pool.failure(first, 2.0)
+    assert not pool.stats()[0]['healthy']
+    assert addresses(pool.choose()) == [SECOND]
+
+    # Once probe_interval has passed the next query also goes to it, but only one at a time
+    clock.advance(10)
+    assert addresses(pool.choose()) == [SECOND, FIRST]
+    assert addresses(pool.choose()) == [SECOND]
+
+    # A timed-out probe ejects it for another interval
+    pool.failure(first, 2.0)
+    clock.advance(5)
+    assert addresses(pool.choose()) == [SECOND]
+    clock.advance(5)
+    assert addresses(pool.choose()) == [SECOND, FIRST]
+
+    # An answered probe brings it back, though its average still holds the timeouts
+    pool.success(first, 0.010)
+    assert pool.stats()[0]['healthy']
+    assert addresses(pool.choose([second])) == [FIRST]
+    assert pool.stats()[0]['ejections'] == 1
+
+def test_all_ejected_uses_the_one_due_back_first(pool, clock):
+    first, second = by_address(pool, FIRST), by_address(pool, SECOND)
+    for _ in range(3):
+        pool.failure(second, 2.0)
+    clock.advance(1)
+    for _ in range(3):
+        pool.failure(first, 2.0)
+    assert addresses(pool.choose()) == [SECOND]
+
+def test_race_mode_asks_the_two_best(clock, monkeypatch):
+    monkeypatch.setattr(upstream_pool, 'time', types.SimpleNamespace(monotonic=clock))
+    pool = UpstreamPool([FIRST, SECOND, ('127.0.0.1', 5303)], race=True, explore=0)
+    for upstream, rtt in zip(pool.upstreams, (0.030, 0.010, 0.020)):
+        pool.success(upstream, rtt)
+    assert addresses(pool.choose()) == [SECOND, ('127.0.0.1', 5303)]
@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from worker_pool import WorkerPool
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+@pytest.fixture
+def blocked_pool():
+    release = threading.Event()
+    handled = []
+
+    def handler(job):
+        release.wait(5)
+        handled.append(job)
+
+    pool = WorkerPool(handler, size=2, queue_size=3)
+    pool.start()
+    yield pool, release, handled
+    release.set()
+    pool.stop()
+
+def test_jobs_are_handled_by_the_workers():
+    handled = []
+    done = threading.Event()
+
+    def handler(job):
+        handled.append((job, threading.current_thread().name))
+        if len(handled) == 10:
+            done.set()
+
+    pool = WorkerPool(handler, size=3, queue_size=16, name='test-worker')
+    pool.start()
+    for job in range(10):
+        assert pool.submit(job)
+    assert done.wait(5)
+    pool.stop()
+    assert sorted(job for job, _ in handled) == list(range(10))
+    assert all(name.startswith('test-worker-') for _, name in handled)
+    assert pool.stats()['submitted'] == 10
+
+def test_full_queue_sheds_new_jobs(blocked_pool):
+    pool, release, handled = blocked_pool
+    # Two jobs keep both workers busy, three more fill the queue
+    for job in range(2):
+        assert pool.submit(job)
+    assert wait_for(lambda: pool.stats()['busy_workers'] == 2)
+    for job in range(2, 5):
+        assert pool.submit(job)
+    assert not pool.submit(5)
+    assert not pool.submit(6)
+    stats = pool.stats()
+    assert stats['rejected'] == 2
+    assert stats['queue_depth'] == 3
+    assert stats['peak_queue_depth'] == 3
+    assert stats['peak_busy_workers'] == 2
+
+    # Once the workers catch up the pool takes jobs again
+    release.set()
+    assert wait_for(lambda: len(handled) == 5)
+    assert pool.submit(7)
+    assert wait_for(lambda: len(handled) == 6)
+    assert sorted(handled) == [0, 1, 2, 3, 4, 7]
+
+def test_failing_job_does_not_stop_its_worker():
+    handled = []
+
+    def handler(job):
+        if job == 'bad':
+            raise RuntimeError("broken request")
+        handled.append(job)
+
+    pool = WorkerPool(handler, size=1, queue_size=4)
+    pool.start()
+    pool.submit('bad')
+    pool.submit('good')
+    assert wait_for(lambda: handled == ['good'])
+    pool.stop()